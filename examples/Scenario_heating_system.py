@@ -0,0 +1,129 @@
+import os
+import sys
+import mosaik
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+
+sim_config = {
+    'CSV': {
+        'python': 'mosaik_csv:CSV',
+    },
+    'DB': {
+        'python': 'mosaik_hdf5:MosaikHdf5'
+    },
+    'HeatingSystemSim': {
+        'python': 'mosaik_heatpump.heatingsystem.heatingsystem_mosaik:HeatingSystemSimulator',
+    },
+}
+
+END = 3 * 60 * 60
+START = '01.01.2020 00:00'
+STEP_SIZE = 60 * 1
+
+#Parameters for mosaik-heatpump
+params_hp = {'hp_model': 'Air_30kW_1stage',
+             'heat_source': 'Air',
+             'cons_T': 35,
+             'Q_Demand': 19780,
+             'cond_in_T': 30,
+             'heat_source_T': 7,
+             }
+#Parameters for hot water tank model
+params_hwt = {
+    'height': 3600,
+    'volume': 4000,
+    'T_env': 20.0,
+    'htc_walls': 0.28,
+    'htc_layers': 0.897,
+    'n_layers': 6,
+    'n_sensors': 6,
+    'connections': {
+        'sh_in': {'pos': 10, 'type': 'sh_in'},
+        'sh_out': {'pos': 2150, 'type': 'sh_out'},
+        'dhw_in': {'pos': 10, 'type': 'dhw_in', 'T_sp': -100},
+        'dhw_out': {'pos': 3400, 'type': 'dhw_out'},
+        'hp_in': {'pos': 10, 'type': 'hp_in'},
+        'hp_out': {'pos': 500, 'type': 'hp_out'},
+        },
+    }
+init_vals_hwt = {
+            'layers': {'T': [40, 40, 40, 40, 40, 40]}
+        }
+#Parameters for controller model
+params_ctrl = {
+    'T_hp_sp_h': 50,
+    'T_hp_sp_l': 40,
+    'T_hr_sp_dhw': 40,
+    'T_hr_sp_sh': 35,
+    'dhw_in_T': 10,
+    'sh_dT': 7,
+    'operation_mode': 'heating',
+    'control_strategy': '1'
+}
+
+model_list = ['Air_30kW_1stage', 'Air_30kW_1stage', 'LW 300(L)', None]
+calc_mode_list = ['detailed', 'fast', 'hplib', 'fixed']
+filename_list = ['detailed', 'fast', 'hplib', 'fixed']
+
+for i in range(len(model_list)):
+
+    time_at_start = time.time()
+
+    HDF_File = 'Scenario_' + filename_list[i] + '_heating_system.hdf5'
+
+    world = mosaik.World(sim_config)
+
+    # Initialize the simulators. The heat pump, the hot water tank and the controller are coupled inside the
+    # heating system simulator like in Scenario_time_shifted.py.
+
+    systemsim = world.start('HeatingSystemSim', step_size=STEP_SIZE, config=params_hwt)
+
+    db = world.start('DB', step_size=STEP_SIZE, duration=END)
+    hdf5 = db.Database(filename=HDF_File, buf_size=1440)
+
+    heat_load_file = './data/scenario_data.csv'
+    heat_load_sim = world.start('CSV', sim_start=START,
+                                        datafile=heat_load_file,
+                                        date_format='DD.MM.YYYY hh:mm',
+                                        delimiter=',')
+    heat_load = heat_load_sim.HEATLOAD.create(1)
+
+    params_hp['calc_mode'] = calc_mode_list[i]
+    params_hp['hp_model'] = model_list[i]
+
+    if 'hplib' in params_hp['calc_mode']:
+        params_hp['equivalent hp model'] = 'Air_30kW_1stage'
+    elif 'fixed' in params_hp['calc_mode']:
+        params_hp['COP'] = 3.5
+        params_hp['heating capacity'] = 15000
+        params_hp['cond_m'] = 0.5
+
+    systems = systemsim.HeatingSystem.create(1, params={'hp': params_hp, 'hwt': params_hwt,
+                                                       'hwt_init_vals': init_vals_hwt, 'ctrl': params_ctrl})
+
+    world.connect(heat_load[0], systems[0], ('T_amb', 'T_amb'), ('T_amb', 'heat_source_T'),
+                  ('SH Demand [kW]', 'sh_demand'), ('DHW Demand [L]', 'dhw_demand'), ('dhw_in_T', 'dhw_in_T'))
+
+    world.connect(heat_load[0], hdf5, 'T_amb', 'SH Demand [kW]', 'DHW Demand [L]')
+    world.connect(systems[0], hdf5, 'hp.Q_Demand', 'hp.Q_Supplied', 'hp.T_amb', 'hp.heat_source_T', 'hp.heat_source',
+                  'hp.cons_T', 'hp.P_Required', 'hp.COP', 'hp.cond_m', 'hp.cond_in_T', 'hp.on_fraction')
+
+    world.connect(systems[0], hdf5, 'ctrl.heat_demand', 'ctrl.heat_supply', 'ctrl.hp_demand', 'ctrl.sh_supply',
+                  'ctrl.sh_demand', 'ctrl.hp_supply', 'ctrl.sh_in_F', 'ctrl.sh_in_T', 'ctrl.sh_out_F',
+                  'ctrl.sh_out_T', 'ctrl.dhw_in_F', 'ctrl.dhw_in_T', 'ctrl.dhw_out_F', 'ctrl.dhw_out_T',
+                  'ctrl.hp_in_F', 'ctrl.hp_in_T', 'ctrl.hp_out_F', 'ctrl.hp_out_T', 'ctrl.P_hr_sh', 'ctrl.P_hr_dhw',
+                  'ctrl.dhw_demand', 'ctrl.dhw_supply')
+    world.connect(systems[0], hdf5, 'hwt.sensor_00.T', 'hwt.sensor_01.T', 'hwt.sensor_02.T', 'hwt.sensor_03.T',
+                  'hwt.sensor_04.T', 'hwt.sensor_05.T', 'hwt.sh_out.T', 'hwt.sh_out.F', 'hwt.dhw_out.T',
+                  'hwt.dhw_out.F', 'hwt.hp_in.T', 'hwt.hp_in.F', 'hwt.hp_out.T', 'hwt.hp_out.F', 'hwt.T_mean',
+                  'hwt.sh_in.T', 'hwt.sh_in.F', 'hwt.dhw_in.T', 'hwt.dhw_in.F')
+
+    #Run
+    world.run(until=END)
+
+    time_at_end = time.time()
+
+    print('The simulation took %s seconds' % (time_at_end - time_at_start))
@@ -0,0 +1,81 @@
+import os
+import sys
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from mosaik_heatpump.heatingsystem import scenario, sweep
+
+END = 3 * 60 * 60
+START = '01.01.2020 00:00'
+STEP_SIZE = 60 * 1
+
+#Parameters for mosaik-heatpump
+params_hp = {'hp_model': 'Air_30kW_1stage',
+             'heat_source': 'Air',
+             'cons_T': 35,
+             'Q_Demand': 19780,
+             'cond_in_T': 30,
+             'heat_source_T': 7,
+             'equivalent hp model': 'Air_30kW_1stage',
+             'COP': 3.5,
+             'heating capacity': 15000,
+             'cond_m': 0.5,
+             }
+#Parameters for hot water tank model
+params_hwt = {
+    'height': 3600,
+    'volume': 4000,
+    'T_env': 20.0,
+    'htc_walls': 0.28,
+    'htc_layers': 0.897,
+    'n_layers': 6,
+    'n_sensors': 6,
+    'connections': {
+        'sh_in': {'pos': 10, 'type': 'sh_in'},
+        'sh_out': {'pos': 2150, 'type': 'sh_out'},
+        'dhw_in': {'pos': 10, 'type': 'dhw_in', 'T_sp': -100},
+        'dhw_out': {'pos': 3400, 'type': 'dhw_out'},
+        'hp_in': {'pos': 10, 'type': 'hp_in'},
+        'hp_out': {'pos': 500, 'type': 'hp_out'},
+        },
+    }
+init_vals_hwt = {
+            'layers': {'T': [40, 40, 40, 40, 40, 40]}
+        }
+#Parameters for controller model
+params_ctrl = {
+    'T_hp_sp_h': 50,
+    'T_hp_sp_l': 40,
+    'T_hr_sp_dhw': 40,
+    'T_hr_sp_sh': 35,
+    'dhw_in_T': 10,
+    'sh_dT': 7,
+    'operation_mode': 'heating',
+    'control_strategy': '1'
+}
+
+# The heat pump models and calculation modes of Scenario_time_shifted.py, combined with different tank volumes and
+# set points of the controller
+variations = {
+    ('hp.hp_model', 'hp.calc_mode'): [('Air_30kW_1stage', 'detailed'), ('Air_30kW_1stage', 'fast'),
+                                      ('LW 300(L)', 'hplib'), (None, 'fixed')],
+    'hwt.volume': [2000, 4000],
+    'ctrl.T_hp_sp_h': [45, 50],
+}
+
+
+def progress(done, total):
+    print('\r%d/%d runs' % (done, total), end='', file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    inputs = scenario.read_inputs('./data/scenario_data.csv', start=START)
+    rows = sweep.run_sweep({'hp': params_hp, 'hwt': params_hwt, 'hwt_init_vals': init_vals_hwt, 'ctrl': params_ctrl},
+                           variations, inputs, END, STEP_SIZE, directory='Sweep_heating_system', progress=progress)
+    print(file=sys.stderr)
+    sweep.save_table(rows, 'Sweep_heating_system.csv')
+
+    for row in rows:
+        print('%(run)4d %(hp.calc_mode)-8s %(hwt.volume)5d %(ctrl.T_hp_sp_h)3d  Q_hp %(Q_hp)8.2f kWh  '
+              'E_hp %(E_hp)7.2f kWh  %(wall_time)6.2f s %(error)s' % row)
@@ -0,0 +1,178 @@
+"""
+This module contains a fleet of controllers with the same parameters, whose inputs and states are stored in numpy arrays
+and are calculated for all controllers at once.
+"""
+
+import numpy as np
+
+HP_OFF = 0
+HP_ON = 1
+HP_UNKNOWN = -1  # hp_status None, before the heat pump was switched on or off
+
+
+class ControllerFleet():
+    """
+    *num* controllers with the same *params*, which are calculated together in each step.
+
+    The control strategies '1' and '2' of the 'heating' mode and the 'cooling' mode are supported. The results are
+    the same as those of *num* :class:`.controller.Controller` instances. The strategy is selected once, when the
+    fleet is created.
+
+    The inputs, the set points and the outputs of the controllers are numpy arrays with one value for each controller
+    and are named like the attributes of :class:`.controller.Controller`. Missing values are NaN. *hp_status* is
+    :data:`HP_ON`, :data:`HP_OFF` or :data:`HP_UNKNOWN`. A single controller can be accessed like a
+    :class:`.controller.Controller` with :meth:`unit`.
+    """
+
+    setpoints = ['T_hp_sp_h', 'T_hp_sp_l', 'T_hr_sp', 'T_hr_sp_dhw', 'T_hr_sp_sh', 'dhw_in_T', 'sh_dT']
+    values = ['T_amb', 'heat_source_T', 'sh_demand', 'sh_supply', 'dhw_demand', 'dhw_supply', 'hp_demand',
+              'hp_supply', 'heat_demand', 'heat_supply', 'T_mean', 'T_room', 'sh_in_F', 'sh_in_T', 'sh_out_F',
+              'sh_out_T', 'dhw_in_F', 'dhw_out_F', 'dhw_out_T', 'bottom_layer_T', 'top_layer_T', 'hp_in_F',
+              'hp_in_T', 'hp_out_F', 'hp_out_T', 'hp_cond_m', 'hp_on_fraction', 'hwt_mass', 'hwt_hr_P_th_set',
+              'P_hr_sh', 'P_hr_dhw', 'step_size']
+    others = ['hwt_connections', 'hp_signal', 'heater_signal']
+
+    def __init__(self, params, num):
+        self.num = num
+        self.operation_mode = params.get('operation_mode')
+        self.control_strategy = params.get('control_strategy')
+        if self.operation_mode is not None and self.operation_mode.lower() == 'cooling':
+            self._step_hp = self._step_cooling
+        elif self.operation_mode is not None and self.operation_mode.lower() == 'heating':
+            if self.control_strategy == '1':
+                self._step_hp = self._step_strategy_1
+            elif self.control_strategy == '2':
+                self._step_hp = self._step_strategy_2
+            else:
+                raise ValueError('Control strategy %s is not supported by the controller fleet'
+                                 % self.control_strategy)
+        else:
+            raise ValueError('Operation mode %s is not supported by the controller fleet' % self.operation_mode)
+        self.heater = params.get('T_hr_sp') is not None
+
+        for attr in self.values:
+            setattr(self, attr, np.full(num, np.nan))
+        for attr in self.setpoints:
+            value = params.get(attr)
+            setattr(self, attr, np.full(num, np.nan if value is None else value, dtype=float))
+        self.hp_status = np.full(num, HP_UNKNOWN, dtype=np.int8)
+        self.arrays = {attr: getattr(self, attr) for attr in self.values + self.setpoints}
+        # the arrays of the values and set points by name
+
+    def unit(self, i):
+        """Returns a view of the controller *i*, with the attributes of a :class:`.controller.Controller`."""
+        return ControllerFleetUnit(self, i)
+
+    def step(self):
+        """
+        perform simulation step for all controllers
+
+        The values are calculated like in the :meth:`.controller.Controller.step` method of a single controller.
+        """
+        self.sh_demand[:] = np.where(np.isnan(self.sh_demand) | (self.sh_demand < 0), 0, self.sh_demand * 1000)
+        self._calc_sh_supply()
+        self.dhw_demand[np.isnan(self.dhw_demand) | (self.dhw_demand < 0)] = 0
+        self._calc_dhw_supply()
+
+        self.heat_supply[:] = self.sh_supply + self.dhw_supply
+        self.heat_demand[:] = self.sh_demand + self.dhw_demand
+
+        self._step_hp()
+
+        missing = np.isnan(self.hp_in_T)
+        self.hp_in_T[missing] = self.hp_out_T[missing]
+        self.hp_supply[np.isnan(self.hp_supply)] = 0
+
+        flow = ~np.isnan(self.hp_on_fraction) & ~np.isnan(self.hp_cond_m)
+        self.hp_in_F[flow] = (self.hp_on_fraction * self.hp_cond_m)[flow]
+        self.hp_out_F[flow] = (-self.hp_on_fraction * self.hp_cond_m)[flow]
+
+        if self.heater:
+            with np.errstate(invalid='ignore'):
+                self.hwt_hr_P_th_set[:] = np.where(
+                    self.T_mean < self.T_hr_sp,
+                    (self.hwt_mass * 4184 * (self.T_hr_sp - self.T_mean)) / self.step_size, 0)
+
+    def _hp_demand(self, on, off):
+        """Sets the heat demand of the heat pumps, which are *on*, and switches off the heat pumps *off*."""
+        with np.errstate(invalid='ignore'):
+            demand = self.hwt_mass * 4184 * (self.T_hp_sp_l - self.bottom_layer_T) / self.step_size
+        self.hp_demand[:] = np.where(on & ~off, demand, 0)
+        self.hp_status[on & off] = HP_OFF
+
+    def _step_strategy_1(self):
+        self.hp_status[self.bottom_layer_T < self.T_hp_sp_l] = HP_ON
+        on = self.hp_status == HP_ON
+        self._hp_demand(on, ~(self.bottom_layer_T < self.T_hp_sp_h))
+
+    def _step_strategy_2(self):
+        self.hp_status[self.top_layer_T < self.T_hp_sp_h] = HP_ON
+        self.hp_status[(self.hp_status == HP_OFF) & (self.bottom_layer_T < self.T_hp_sp_l)] = HP_ON
+        on = self.hp_status == HP_ON
+        self._hp_demand(on, ~(self.bottom_layer_T < self.T_hp_sp_l))
+
+    def _step_cooling(self):
+        self.hp_status[(self.T_room > self.T_hp_sp_h) | ((self.bottom_layer_T - self.T_room) < 5)] = HP_ON
+        self.hp_status[self.bottom_layer_T > 52] = HP_OFF
+        on = self.hp_status == HP_ON
+        off = ~(self.T_room > (self.T_hp_sp_l + 0.5))
+        self.hp_demand[:] = np.where(on & ~off, 10000000, 0)
+        self.hp_status[on & off] = HP_OFF
+
+    def _calc_dhw_supply(self):
+        dhw_in_F = self.dhw_demand / self.step_size
+        hot = self.dhw_out_T >= self.T_hr_sp_dhw
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dhw_in_F_hot = dhw_in_F * ((self.T_hr_sp_dhw - self.dhw_in_T) / (self.dhw_out_T - self.dhw_in_T))
+        self.dhw_in_F[:] = np.where(hot, dhw_in_F_hot, dhw_in_F)
+        self.dhw_supply[:] = np.where(hot, self.dhw_in_F * 4184 * (self.dhw_out_T - self.dhw_in_T),
+                                      self.dhw_in_F * 4184 * (self.T_hr_sp_dhw - self.dhw_in_T))
+        self.P_hr_dhw[:] = np.where(hot, 0, self.dhw_in_F * 4184 * (self.T_hr_sp_dhw - self.dhw_out_T))
+        self.dhw_out_F[:] = - self.dhw_in_F
+
+    def _calc_sh_supply(self):
+        self.sh_in_F[:] = self.sh_demand / (4184 * self.sh_dT)
+        self.sh_supply[:] = self.sh_in_F * 4184 * self.sh_dT
+        hot = self.sh_out_T >= self.T_hr_sp_sh
+        self.sh_in_T[:] = np.where(hot, self.sh_out_T - self.sh_dT, self.T_hr_sp_sh - self.sh_dT)
+        self.P_hr_sh[:] = np.where(hot, 0, self.sh_in_F * 4184 * (self.T_hr_sp_sh - self.sh_out_T))
+        self.sh_out_F[:] = - self.sh_in_F
+
+
+class ControllerFleetUnit():
+    """
+    A single controller of a :class:`ControllerFleet`, whose attributes read and write the arrays of the fleet, like
+    those of a :class:`.controller.Controller`. Missing values are None. Other attributes are stored in the unit.
+    """
+
+    __slots__ = ['_fleet', '_i', '_attrs']
+
+    def __init__(self, fleet, i):
+        object.__setattr__(self, '_fleet', fleet)
+        object.__setattr__(self, '_i', i)
+        object.__setattr__(self, '_attrs', dict.fromkeys(fleet.others))
+
+    def __getattr__(self, attr):
+        fleet = self._fleet
+        if attr in ('operation_mode', 'control_strategy'):
+            return getattr(fleet, attr)
+        if attr == 'hp_status':
+            return {HP_ON: 'on', HP_OFF: 'off'}.get(int(fleet.hp_status[self._i]))
+        if attr in fleet.arrays:
+            value = fleet.arrays[attr][self._i].item()
+            return None if value != value else value
+        try:
+            return self._attrs[attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+    def __setattr__(self, attr, value):
+        fleet = self._fleet
+        if attr in fleet.arrays:
+            fleet.arrays[attr][self._i] = np.nan if value is None else value
+        elif attr in ('operation_mode', 'control_strategy'):
+            raise AttributeError('%s is the same for all controllers of a fleet' % attr)
+        elif attr == 'hp_status':
+            fleet.hp_status[self._i] = {'on': HP_ON, 'off': HP_OFF}.get(value, HP_UNKNOWN)
+        else:
+            self._attrs[attr] = value
@@ -1,5 +1,9 @@
+from functools import partial
 import mosaik_api
+import numpy as np
 from mosaik_heatpump.controller.controller import Controller
+from mosaik_heatpump.controller.controller_fleet import ControllerFleet, ControllerFleetUnit
+from mosaik_heatpump.recorder import check_config, start_recorder
 
 META = {
     'type': 'time-based',
@@ -25,22 +29,30 @@ class ControllerSimulator(mosaik_api.Simulator):
         super().__init__(META)
 
         self.models = dict()  # contains the model instances
+        self.fleets = []  # contains the fleets of controllers calculated together
         self.sid = None
         self.eid_prefix = 'Controller_'
         self.step_size = None
         self.async_requests = dict()
         self.time = None
         self.step_executed = False
+        self.model_step_executed = False  # the controllers not in fleets are stepped once per time in event-based mode
+        self.fleet_step_executed = False  # the fleets are stepped once per time in event-based mode
         self.first_iteration = None
         self.final_iteration = False
+        self.record = None  # the configuration of the recorder, see mosaik_heatpump.recorder
+        self.recorder = None
 
-    def init(self, sid, time_resolution, step_size, same_time_loop=False):
+    def init(self, sid, time_resolution, step_size, same_time_loop=False, record=None):
         self.time_resolution = float(time_resolution)
         if self.time_resolution != 1.0:
             print('WARNING: %s got a time_resolution other than 1.0, which \
                 can not be handled by this simulator.', sid)
         self.sid = sid # simulator id
         self.step_size = step_size
+        self.record = record
+        if record is not None:
+            check_config(record, sid, self.meta['models']['Controller']['attrs'])
         if same_time_loop:
             self.meta['type'] = 'event-based'
         return self.meta
@@ -48,10 +60,17 @@ class ControllerSimulator(mosaik_api.Simulator):
     def create(self, num, model, params=None):
         entities = []
 
+        fleet = None
+        if params is not None and params.get('fleet', False):
+            fleet = ControllerFleet(params, num)
+            self.fleets.append(fleet)
+
         next_eid = len(self.models)
         for i in range(next_eid, next_eid + num):
             eid = '%s%d' % (self.eid_prefix, i)
-            if params is not None:
+            if fleet is not None:
+                self.models[eid] = fleet.unit(i - next_eid)
+            elif params is not None:
                 self.models[eid] = Controller(params)
             else:
                 self.models[eid] = Controller()
@@ -64,31 +83,70 @@ class ControllerSimulator(mosaik_api.Simulator):
                 self.first_iteration = True
                 self.final_iteration = False
                 self.step_executed = False
+                self.model_step_executed = False
+                self.fleet_step_executed = False
             elif self.step_executed:
                 if not self.final_iteration:
                     self.first_iteration = False
                     self.final_iteration = True
                 else:
                     self.final_iteration = False
+        fleet_inputs = {fleet: {attr: dict() for attr in fleet.arrays} for fleet in self.fleets}
+        # the inputs of the fleets by attribute, as dicts of the index of the controller and the value
         for eid, attrs in inputs.items():
             if self.meta['type'] == 'event-based':
                 if time != self.time:
                     self.time = time
                     setattr(self.models[eid], 'execute_step', True)
+            model = self.models[eid]
+            if isinstance(model, ControllerFleetUnit):
+                # the inputs are written to the arrays of the fleet at once and the fleets are calculated below
+                values = fleet_inputs[model._fleet]
+                i = model._i
+                for attr, src_ids in attrs.items():
+                    if len(src_ids) > 1:
+                        raise ValueError('Two many inputs for attribute %s' % attr)
+                    unit_values = values.get(attr)
+                    for val in src_ids.values():
+                        if unit_values is not None:
+                            unit_values[i] = val
+                        else:
+                            setattr(model, attr, val)
+                continue
             for attr, src_ids in attrs.items():
                 if len(src_ids) > 1:
                     raise ValueError('Two many inputs for attribute %s' % attr)
                 for val in src_ids.values():
                     setattr(self.models[eid], attr, val)
             if self.meta['type'] == 'event-based':
-                if not self.step_executed:
+                if not self.model_step_executed:
                     self.models[eid].step_size = self.step_size
                     self.models[eid].step()
+                    self.model_step_executed = True
                     self.step_executed = True
             else:
                 self.models[eid].step_size = self.step_size
                 self.models[eid].step()
 
+        for fleet, values in fleet_inputs.items():
+            for attr, unit_values in values.items():
+                if unit_values:
+                    fleet.arrays[attr][list(unit_values)] = np.array(list(unit_values.values()), dtype=float)
+            fleet.step_size[:] = self.step_size
+
+        if self.fleets and not (self.meta['type'] == 'event-based' and self.fleet_step_executed):
+            for fleet in self.fleets:
+                fleet.step()
+            if self.meta['type'] == 'event-based':
+                self.fleet_step_executed = True
+                self.step_executed = True
+
+        if self.record is not None:
+            if self.recorder is None:
+                self.recorder = start_recorder(self.record, self.sid, self.models,
+                                               self.meta['models']['Controller']['attrs'], self._get_accessor)
+            self.recorder.record(time)
+
         if self.meta['type'] == 'event-based':
             return None
         else:
@@ -115,6 +173,13 @@ class ControllerSimulator(mosaik_api.Simulator):
                     data[eid][attr] = getattr(self.models[eid], attr)
         return data
 
+    def _get_accessor(self, eid, attr):
+        return partial(getattr, self.models[eid], attr)
+
+    def finalize(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
 def main():
     return mosaik_api.start_simulation(ControllerSimulator())
 
@@ -1,5 +1,7 @@
+from functools import partial
 import mosaik_api
 from mosaik_heatpump.coolingloadsim.coolingloadsim import CoolingLoadSim
+from mosaik_heatpump.recorder import check_config, start_recorder
 
 META = {
     'type': 'time-based',
@@ -21,14 +23,19 @@ class CoolingLoadSimulator(mosaik_api.Simulator):
         self.sid = None
         self.eid_prefix = 'CoolingLoadSim_'
         self.step_size = None
+        self.record = None  # the configuration of the recorder, see mosaik_heatpump.recorder
+        self.recorder = None
 
-    def init(self, sid, time_resolution, step_size):
+    def init(self, sid, time_resolution, step_size, record=None):
         self.time_resolution = float(time_resolution)
         if self.time_resolution != 1.0:
             print('WARNING: %s got a time_resolution other than 1.0, which \
                 can not be handled by this simulator.', sid)
         self.sid = sid # simulator id
         self.step_size = step_size
+        self.record = record
+        if record is not None:
+            check_config(record, sid, self.meta['models']['CoolingLoadSim']['attrs'])
         return self.meta
 
     def create(self, num, model, params=None):
@@ -57,6 +64,12 @@ class CoolingLoadSimulator(mosaik_api.Simulator):
             self.models[eid].step_size = self.step_size
             self.models[eid].step()
 
+        if self.record is not None:
+            if self.recorder is None:
+                self.recorder = start_recorder(self.record, self.sid, self.models,
+                                               self.meta['models']['CoolingLoadSim']['attrs'], self._get_accessor)
+            self.recorder.record(time)
+
         return time + self.step_size
 
     def get_data(self, outputs):
@@ -70,6 +83,13 @@ class CoolingLoadSimulator(mosaik_api.Simulator):
                 data[eid][attr] = getattr(self.models[eid], attr)
         return data
 
+    def _get_accessor(self, eid, attr):
+        return partial(getattr, self.models[eid], attr)
+
+    def finalize(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
 def main():
     return mosaik_api.start_simulation(CoolingLoadSimulator())
 
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+The heatingsystem module contains a heating system of a heat pump, a hotwater
+tank and a controller, which are coupled in one process like the simulators
+in the scenarios of the examples (:class:`HeatingSystem`).
+
+"""
+from functools import partial
+
+from mosaik_heatpump.controller.controller import Controller
+from mosaik_heatpump.heatpump.Heat_Pump_Data import get_cop_table
+from mosaik_heatpump.heatpump.Heat_Pump_Model import Heat_Pump
+from mosaik_heatpump.hotwatertanksim.hotwatertank import HotWaterTank
+from mosaik_heatpump.hotwatertanksim.hotwatertank_mosaik import get_accessors
+
+
+class HeatingSystem():
+    """
+    A heat pump, a hotwater tank and a controller, which exchange their
+    values with direct calls instead of mosaik connections.
+
+    The parameters of the components are provided by the dictionary
+    **params**::
+
+        params = {
+            'hp': params_hp,
+            'hwt': params_hwt,
+            'hwt_init_vals': init_vals_hwt,
+            'ctrl': params_ctrl,
+        }
+
+    * **hp**, **hwt**, **hwt_init_vals** and **ctrl**: the parameters of the
+      :class:`.Heat_Pump_Model.Heat_Pump`, the parameters and initial values
+      of the :class:`.hotwatertank.HotWaterTank` and the parameters of the
+      :class:`.controller.Controller`
+    * **bottom_sensor** and **top_sensor**: optional, the sensors of the tank
+      whose temperatures are the *bottom_layer_T* and the *top_layer_T* of
+      the controller, 'sensor_00' and 'sensor_04' by default
+    * **initial_data**: optional, the values of the inputs of the tank
+      (*'hwt'*) and the heat pump (*'hp'*) in the first step, by default
+      those of the time shifted connections of the scenarios
+
+    In each step, the tank is calculated with the values of the controller
+    and the heat pump of the previous step, then the heat pump with the
+    values of the controller of the previous step and the temperature of the
+    tank, and finally the controller with the values of the tank and the
+    heat pump of this step, like in *examples/Scenario_time_shifted.py*.
+
+    The inputs of the heating system (*inputs*) are passed to the controller
+    in each step. The values of the components are accessed with
+    :meth:`get_accessor`.
+
+    """
+
+    inputs = ['T_amb', 'heat_source_T', 'sh_demand', 'dhw_demand', 'dhw_in_T']
+
+    ctrl_to_hwt = [('sh_in_F', 'sh_in.F'), ('sh_in_T', 'sh_in.T'), ('sh_out_F', 'sh_out.F'),
+                   ('dhw_in_F', 'dhw_in.F'), ('dhw_in_T', 'dhw_in.T'), ('dhw_out_F', 'dhw_out.F'),
+                   ('T_amb', 'T_env')]
+    ctrl_to_hp = [('hp_demand', 'Q_Demand'), ('T_amb', 'T_amb'), ('heat_source_T', 'heat_source_T')]
+    hp_to_hwt = [('cons_T', 'hp_in.T'), ('cond_m', 'hp_in.F'), ('cond_m_neg', 'hp_out.F')]
+    hp_to_ctrl = [('Q_Supplied', 'hp_supply'), ('on_fraction', 'hp_on_fraction'), ('cond_m', 'hp_cond_m')]
+    # the connections between the components, pairs of the source and the
+    # destination attribute
+
+    def __init__(self, params, COP_m_data=None):
+        if COP_m_data is None and params['hp']['calc_mode'] in ('fast', 'fast_interp', 'fixed_hl'):
+            COP_m_data = get_cop_table(params['hp']['hp_model'])
+        self.hp = Heat_Pump(params['hp'], COP_m_data)
+        self.hwt = HotWaterTank(params['hwt'], params.get('hwt_init_vals'))
+        self.ctrl = Controller(params['ctrl'])
+
+        for attr in self.inputs:
+            setattr(self, attr, None)
+
+        hwt_to_ctrl = [('T_mean', 'T_mean'), ('mass', 'hwt_mass'),
+                       ('%s.T' % params.get('bottom_sensor', 'sensor_00'), 'bottom_layer_T'),
+                       ('%s.T' % params.get('top_sensor', 'sensor_04'), 'top_layer_T'),
+                       ('dhw_out.T', 'dhw_out_T'), ('sh_out.T', 'sh_out_T'), ('hp_out.T', 'hp_out_T')]
+        self._hwt_to_ctrl = [(get_accessors(self.hwt, src)[0], dest) for src, dest in hwt_to_ctrl]
+        self._hp_cond_in_T = get_accessors(self.hwt, 'hp_out.T')[0]
+
+        initial_data = params.get('initial_data', {})
+        self._hwt_inputs = {dest: 0 for src, dest in self.ctrl_to_hwt + self.hp_to_hwt}
+        self._hwt_inputs.update(initial_data.get('hwt', {}))
+        self._hp_inputs = {'Q_Demand': 0, 'T_amb': 5, 'heat_source_T': 5}
+        self._hp_inputs.update(initial_data.get('hp', {}))
+        # the inputs of the tank and the heat pump in the next step
+        self._hwt_setters = [(get_accessors(self.hwt, attr)[1], attr) for attr in self._hwt_inputs]
+
+    def step(self, step_size):
+        """Perform simulation step with step size step_size"""
+        for setter, attr in self._hwt_setters:
+            setter(self._hwt_inputs[attr])
+        self.hwt.step(step_size)
+
+        hp_inputs = self.hp.inputs
+        for attr, value in self._hp_inputs.items():
+            setattr(hp_inputs, attr, value)
+        hp_inputs.cond_in_T = self._hp_cond_in_T()
+        hp_inputs.step_size = step_size
+        self.hp.step()
+
+        ctrl = self.ctrl
+        for attr in self.inputs:
+            value = getattr(self, attr)
+            if value is not None:
+                setattr(ctrl, attr, value)
+        for getter, attr in self._hwt_to_ctrl:
+            setattr(ctrl, attr, getter())
+        hp_state = self.hp.state
+        for src, dest in self.hp_to_ctrl:
+            setattr(ctrl, dest, float(getattr(hp_state, src)))
+        ctrl.step_size = step_size
+        ctrl.step()
+
+        for src, dest in self.ctrl_to_hwt:
+            self._hwt_inputs[dest] = getattr(ctrl, src)
+        for src, dest in self.hp_to_hwt:
+            self._hwt_inputs[dest] = float(getattr(hp_state, src))
+        for src, dest in self.ctrl_to_hp:
+            self._hp_inputs[dest] = getattr(ctrl, src)
+
+    def get_accessor(self, name):
+        """
+        Returns a getter of the attribute *name*, which is an input of the
+        heating system or an attribute of the heat pump (*'hp.<attr>'*), the
+        tank (*'hwt.<attr>'*) or the controller (*'ctrl.<attr>'*), like the
+        outputs of their simulators.
+        """
+        component, _, attr = name.partition('.')
+        if component == 'hp':
+            if attr == 'step_executed':
+                return partial(getattr, self.hp.state, attr)
+            return partial(_get_float_attr, self.hp.state, attr)
+        if component == 'hwt':
+            return get_accessors(self.hwt, attr)[0]
+        if component == 'ctrl':
+            return partial(getattr, self.ctrl, attr)
+        return partial(getattr, self, name)
+
+
+def _get_float_attr(obj, attr):
+    return float(getattr(obj, attr))
@@ -0,0 +1,110 @@
+"""
+Mosaik interface for the heating system of a heat pump, a hot water tank and a controller
+
+"""
+import mosaik_api
+from mosaik_heatpump.controller.controller_mosaik import META as CTRL_META
+from mosaik_heatpump.heatingsystem.heatingsystem import HeatingSystem
+from mosaik_heatpump.heatpump.Heat_Pump_mosaik import META as HP_META
+from mosaik_heatpump.hotwatertanksim.hotwatertank_mosaik import tank_attrs
+from mosaik_heatpump.recorder import check_config, start_recorder
+
+
+class HeatingSystemSimulator(mosaik_api.Simulator):
+    def __init__(self):
+        # dummy metadata, actual metadata is set in init()
+        meta = {
+                'type': 'time-based',
+                'models': {},
+                }
+        super().__init__(meta)
+        self.models = dict()
+        self.accessors = dict()  # getters of the outputs of each model
+        self.attrs = set()
+        self.sid = None
+        self.eid_prefix = 'HeatingSystem_'
+        self.step_size = None  # [sec]
+        self.time = None
+        self.record = None  # the configuration of the recorder, see mosaik_heatpump.recorder
+        self.recorder = None
+
+    def init(self, sid, time_resolution, step_size, config, record=None):
+        """*config* are the parameters of the hot water tanks, which define their attributes."""
+        self.time_resolution = float(time_resolution)
+        if self.time_resolution != 1.0:
+            print('WARNING: %s got a time_resolution other than 1.0, which \
+                can not be handled by this simulator.', sid)
+        self.sid = sid  # simulator id
+        self.step_size = step_size
+        self.record = record
+        attrs = list(HeatingSystem.inputs)
+        attrs += ['hp.%s' % attr for attr in HP_META['models']['HeatPump']['attrs']]
+        attrs += ['hwt.%s' % attr for attr in tank_attrs(config) if attr != '_']
+        attrs += ['ctrl.%s' % attr for attr in CTRL_META['models']['Controller']['attrs'] if attr != '_']
+        self.attrs = set(attrs)
+        self.meta['models']['HeatingSystem'] = {
+            'public': True,
+            'params': ['params'],
+            'attrs': attrs
+        }
+        if record is not None:
+            check_config(record, sid, attrs)
+        return self.meta
+
+    def create(self, num, model, params):
+        entities = []
+
+        next_eid = len(self.models)
+        for i in range(next_eid, next_eid + num):
+            eid = '%s%d' % (self.eid_prefix, i)
+            self.models[eid] = HeatingSystem(params)
+            self.accessors[eid] = dict()
+            entities.append({'eid': eid, 'type': model})
+        return entities
+
+    def step(self, time, inputs, max_advance):
+        self.time = time
+        for eid, attrs in inputs.items():
+            for attr, src_ids in attrs.items():
+                if attr not in HeatingSystem.inputs:
+                    raise ValueError('Unknown input attribute: %s' % attr)
+                if len(src_ids) > 1:
+                    raise ValueError('Two many inputs for attribute %s' % attr)
+                for val in src_ids.values():
+                    setattr(self.models[eid], attr, val)
+
+        for model in self.models.values():
+            model.step(self.step_size)
+
+        if self.record is not None:
+            if self.recorder is None:
+                self.recorder = start_recorder(self.record, self.sid, self.models, self.attrs, self._get_accessor)
+            self.recorder.record(time)
+
+        return time + self.step_size
+
+    def get_data(self, outputs):
+        data = {}
+        for eid, attrs in outputs.items():
+            data[eid] = {}
+            accessors = self.accessors[eid]
+            for attr in attrs:
+                if attr not in self.attrs:
+                    raise ValueError('Unknown output attribute: %s' % attr)
+                if attr not in accessors:
+                    accessors[attr] = self.models[eid].get_accessor(attr)
+                data[eid][attr] = accessors[attr]()
+        return data
+
+    def _get_accessor(self, eid, attr):
+        return self.models[eid].get_accessor(attr)
+
+    def finalize(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+def main():
+    return mosaik_api.start_simulation(HeatingSystemSimulator())
+
+if __name__ == '__main__':
+    main()
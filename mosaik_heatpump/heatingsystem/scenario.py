@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+The scenario module runs a :class:`.heatingsystem.HeatingSystem` over a time
+series of heat loads without mosaik (:func:`run`). The time series is read
+once from a file in the format of *mosaik-csv* (:func:`read_inputs`), like
+*examples/data/scenario_data.csv*.
+
+"""
+import csv
+from datetime import datetime
+
+import numpy as np
+
+from mosaik_heatpump.heatingsystem.heatingsystem import HeatingSystem
+
+DATE_FORMAT = '%d.%m.%Y %H:%M'
+
+INPUT_COLUMNS = {
+    'T_amb': 'T_amb',
+    'heat_source_T': 'T_amb',
+    'sh_demand': 'SH Demand [kW]',
+    'dhw_demand': 'DHW Demand [L]',
+    'dhw_in_T': 'dhw_in_T',
+}
+# the columns of the inputs of the heating system, like the connections of
+# the heat load in the scenarios
+
+
+def read_inputs(filename, start=None, date_format=DATE_FORMAT):
+    """
+    Reads the time series of the file *filename* in the format of
+    *mosaik-csv*, with an optional first line with the name of the model and a
+    header with the column *Time* and the names of the other columns.
+
+    Returns the times of the rows in seconds since *start* (by default the
+    time of the first row) and a dictionary with an array of the values of
+    each column.
+    """
+    with open(filename, newline='') as f:
+        rows = list(csv.reader(f))
+    if rows[0][0] != 'Time':
+        rows = rows[1:]
+    header, rows = rows[0], [row for row in rows[1:] if row]
+
+    dates = [datetime.strptime(row[0], date_format) for row in rows]
+    if start is None:
+        start = dates[0]
+    elif isinstance(start, str):
+        start = datetime.strptime(start, date_format)
+    times = np.array([(date - start).total_seconds() for date in dates])
+    columns = {name: np.array([float(row[i]) for row in rows]) for i, name in enumerate(header) if i > 0}
+    return times, columns
+
+
+def run(params, inputs, end, step_size=60, outputs=(), columns=INPUT_COLUMNS, COP_m_data=None):
+    """
+    Runs a :class:`.heatingsystem.HeatingSystem` with the parameters *params*
+    from the time 0 to *end* (in seconds) with steps of *step_size*.
+
+    *inputs* is the result of :func:`read_inputs`. The inputs of the heating
+    system are the values of the *columns* in the last row whose time is not
+    after the time of the step, like the values sent by *mosaik-csv*.
+
+    Returns a dictionary with an array of the values of each attribute of
+    *outputs* (see :meth:`.heatingsystem.HeatingSystem.get_accessor`) after
+    each step. Missing values are NaN.
+    """
+    times, values = inputs
+    step_times = np.arange(0, end, step_size)
+    rows = np.searchsorted(times, step_times, side='right') - 1
+    if len(rows) > 0 and rows[0] < 0:
+        raise ValueError('The inputs start after the start of the scenario')
+    rows = rows.tolist()
+    series = [(attr, np.asarray(values[column]).tolist()) for attr, column in columns.items()]
+
+    system = HeatingSystem(params, COP_m_data)
+    getters = [system.get_accessor(attr) for attr in outputs]
+    results = [np.empty(len(rows)) for attr in outputs]
+    nan = float('nan')
+
+    for i, row in enumerate(rows):
+        for attr, column in series:
+            setattr(system, attr, column[row])
+        system.step(step_size)
+        for getter, result in zip(getters, results):
+            value = getter()
+            result[i] = nan if value is None else value
+
+    return dict(zip(outputs, results))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+The sweep module runs the scenario of :mod:`.scenario` for all combinations
+of a grid of parameters in parallel processes and collects the wall time and
+the key figures of each run in one table.
+
+Usage::
+
+    inputs = scenario.read_inputs('data/scenario_data.csv')
+    rows = sweep.run_sweep(params, {('hp.hp_model', 'hp.calc_mode'): [('Air_30kW_1stage', 'fast'),
+                                                                       (None, 'fixed')],
+                                    'hwt.volume': [2000, 4000],
+                                    'ctrl.T_hp_sp_h': [45, 50]},
+                           inputs, END, directory='sweep')
+    sweep.save_table(rows, 'sweep/summary.csv')
+
+"""
+import copy
+import csv
+import itertools
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from mosaik_heatpump.heatingsystem import scenario
+
+OUTPUTS = ['hp.Q_Supplied', 'hp.P_Required', 'ctrl.heat_demand', 'ctrl.heat_supply', 'ctrl.P_hr_sh', 'ctrl.P_hr_dhw',
+           'hwt.T_mean']
+# the outputs of the runs, from which the key figures are calculated
+
+KPIS = ['Q_hp', 'E_hp', 'SCOP', 'E_hr', 'heat_demand', 'heat_supply', 'T_mean_min', 'T_mean_max']
+
+
+def set_param(params, name, value):
+    """Sets the parameter *name* of *params*, whose parts are separated by dots, like 'hwt.connections.sh_out.pos'."""
+    keys = name.split('.')
+    for key in keys[:-1]:
+        params = params[key]
+    params[keys[-1]] = value
+
+
+def grid(variations):
+    """
+    Returns a list of dictionaries with the values of all combinations of
+    the *variations*, which are lists of values by the name of the parameter
+    (see :func:`set_param`). Parameters varied together, like the model and
+    the calculation mode of the heat pump, are given by a tuple of names and
+    a list of tuples of values.
+    """
+    names = list(variations)
+    variants = []
+    for values in itertools.product(*[variations[name] for name in names]):
+        variant = {}
+        for name, value in zip(names, values):
+            if isinstance(name, tuple):
+                variant.update(zip(name, value))
+            else:
+                variant[name] = value
+        variants.append(variant)
+    return variants
+
+
+def kpis(results, step_size):
+    """
+    Returns the key figures of the *results* of a run with the outputs
+    :data:`OUTPUTS`, the energies in kWh and the temperatures in °C.
+    """
+    kWh = step_size / 3.6e6
+    Q_hp = np.nansum(results['hp.Q_Supplied']) * kWh
+    E_hp = np.nansum(results['hp.P_Required']) * kWh
+    return {
+        'Q_hp': Q_hp,
+        'E_hp': E_hp,
+        'SCOP': Q_hp / E_hp if E_hp > 0 else float('nan'),
+        'E_hr': (np.nansum(results['ctrl.P_hr_sh']) + np.nansum(results['ctrl.P_hr_dhw'])) * kWh,
+        'heat_demand': np.nansum(results['ctrl.heat_demand']) * kWh,
+        'heat_supply': np.nansum(results['ctrl.heat_supply']) * kWh,
+        'T_mean_min': np.nanmin(results['hwt.T_mean']),
+        'T_mean_max': np.nanmax(results['hwt.T_mean']),
+    }
+
+
+_inputs = None
+
+
+def _init_worker(inputs):
+    global _inputs
+    _inputs = inputs
+
+
+def _run(task):
+    """Runs the variant of a task in its directory and returns its row of the table."""
+    i, params, variant, end, step_size, run_dir = task
+    row = {'run': i}
+    row.update(variant)
+    cwd = os.getcwd()
+    time_at_start = time.time()
+    try:
+        if run_dir is not None:
+            os.makedirs(run_dir, exist_ok=True)
+            os.chdir(run_dir)
+        results = scenario.run(params, _inputs, end, step_size, outputs=OUTPUTS)
+        if run_dir is not None:
+            np.savez('results.npz', **results)
+        row.update(kpis(results, step_size))
+        row['error'] = ''
+    except Exception as e:
+        row.update(dict.fromkeys(KPIS, float('nan')))
+        row['error'] = repr(e)
+    finally:
+        os.chdir(cwd)
+    row['wall_time'] = time.time() - time_at_start
+    return row
+
+
+def run_sweep(params, variations, inputs, end, step_size=60, processes=None, directory=None, progress=None):
+    """
+    Runs the scenario of :func:`.scenario.run` with the parameters *params*
+    of the heating system, changed by each variant of the :func:`grid` of the
+    *variations*, in *processes* parallel processes (by default all cores).
+
+    Each run is executed in its own directory 'run_<number>' below
+    *directory*, if given, where its outputs :data:`OUTPUTS` are saved in
+    *results.npz*. *progress* is called with the number of finished and the
+    number of all runs after each run.
+
+    Returns the table of the runs as a list of dictionaries in the order of
+    the grid, with the number of the run, the values of the variant, the key
+    figures (see :func:`kpis`), the wall time in seconds and the error of
+    failed runs, whose key figures are NaN.
+    """
+    tasks = []
+    for i, variant in enumerate(grid(variations)):
+        variant_params = copy.deepcopy(params)
+        for name, value in variant.items():
+            set_param(variant_params, name, value)
+        run_dir = None if directory is None else os.path.abspath(os.path.join(directory, 'run_%04d' % i))
+        tasks.append((i, variant_params, variant, end, step_size, run_dir))
+
+    rows = [None] * len(tasks)
+    with mp.Pool(processes, initializer=_init_worker, initargs=(inputs,)) as pool:
+        for done, row in enumerate(pool.imap_unordered(_run, tasks), 1):
+            rows[row['run']] = row
+            if progress is not None:
+                progress(done, len(tasks))
+    return rows
+
+
+def save_table(rows, filename):
+    """Writes the table *rows* of :func:`run_sweep` to the CSV file *filename*."""
+    fieldnames = []
+    for row in rows:
+        fieldnames += [name for name in row if name not in fieldnames]
+    with open(filename, 'w', newline='') as write_file:
+        writer = csv.DictWriter(write_file, fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
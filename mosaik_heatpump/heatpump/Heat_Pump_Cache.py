@@ -0,0 +1,147 @@
+"""
+Caches shared by the heat pump models of a process.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+import uuid
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class LRUCache():
+    """
+    Bounded mapping that evicts the least recently used entry once *maxsize*
+    entries are stored.
+
+    The counters *hits*, *misses* and *evictions* are kept so that the size of
+    the cache can be tuned for a scenario, see :meth:`info`.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        """Returns the entry stored for *key* or None, if there is none."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores *value* for *key* and evicts the oldest entries if required."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        """Changes the number of entries kept to *maxsize* and evicts the oldest entries if required."""
+        self.maxsize = maxsize
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def info(self):
+        """Returns the counters of the cache as a :class:`CacheInfo` tuple."""
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._data))
+
+
+DESIGN_CACHE = LRUCache(maxsize=16)
+"""The design points of the 'detailed' mode, i.e. the directories of the saved design points and the values of the
+design calculations, keyed by ``(hp_model, idx)``"""
+
+
+def set_design_cache_size(maxsize):
+    """Sets the number of design points kept in :data:`DESIGN_CACHE` by all heat pumps of the process."""
+    if isinstance(maxsize, bool) or not isinstance(maxsize, int) or maxsize < 1:
+        raise ValueError('The size of the design cache must be a positive int, not %r' % (maxsize,))
+    DESIGN_CACHE.resize(maxsize)
+
+
+class DesignPathStore():
+    """
+    Directories holding the saved design points of the 'detailed' mode.
+
+    TESPy reads the design point of an offdesign calculation from a directory, so every design point, identified by
+    the heat pump model and the design index, gets its own directory below *directory*. A design point is written
+    only once and is reused afterwards by all heat pumps, also by those of other processes that use the same
+    *directory*. The directories are written atomically, so that parallel simulations never read a design point
+    that is still being written.
+
+    If no *directory* is given, a temporary directory of the process is used, which is removed on exit.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.writes = 0
+        self.reuses = 0
+
+    @property
+    def root(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='mosaik_heatpump_')
+            atexit.register(shutil.rmtree, self.directory, True)
+        return self.directory
+
+    def path(self, hp_model, idx):
+        """Returns the directory of the design point *idx* of the model *hp_model*."""
+        model_dir = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(hp_model))
+        return os.path.join(self.root, model_dir, str(idx))
+
+    def save(self, nw, hp_model, idx):
+        """Saves the designed network *nw*, unless the design point is already stored, and returns its path."""
+        path = self.path(hp_model, idx)
+        if os.path.isfile(os.path.join(path, 'connections.csv')):
+            self.reuses += 1
+            return path
+
+        tmp_path = '%s.%d.%s.tmp' % (path, os.getpid(), uuid.uuid4().hex)
+        nw.save(tmp_path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another heat pump or process stored the same design point in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            self.reuses += 1
+        else:
+            self.writes += 1
+        return path
+
+
+_DESIGN_PATH_STORES = {}
+
+
+def get_design_path_store(directory=None):
+    """Returns the :class:`DesignPathStore` of the process for *directory* (a temporary directory if None)."""
+    key = None if directory is None else os.path.abspath(directory)
+    try:
+        return _DESIGN_PATH_STORES[key]
+    except KeyError:
+        store = _DESIGN_PATH_STORES[key] = DesignPathStore(key)
+        return store
@@ -0,0 +1,277 @@
+"""
+Precompiled lookup tables for the data files of the heat pump models.
+
+The JSON files are read once per process and converted into NumPy arrays, so
+that the lookups in the simulation steps need neither file access nor walks
+through string keyed dictionaries.
+"""
+
+import json
+import os
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+JSON_DATA_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'eta_s_data.json'))
+COP_M_DATA_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'cop_m_data.json'))
+
+DesignPoint = namedtuple('DesignPoint', ['valid_T', 'skip', 'heat_source_T_des', 'LFE_des', 'cons_T_max', 'LWC_des',
+                                         'etas_des', 'heatload_des', 'idx'])
+
+
+def nearest_index(keys, x):
+    """
+    Returns the index of the value in the sorted array *keys*, which is
+    closest to *x*. If two values are equally close, the index of the smaller
+    one is returned. *x* can be a scalar or an array.
+    """
+    if len(keys) == 1:
+        return np.zeros(np.shape(x), dtype=int)
+    pos = np.clip(np.searchsorted(keys, x, side='left'), 1, len(keys) - 1)
+    return np.where(keys[pos] - x < x - keys[pos - 1], pos, pos - 1)
+
+
+class DesignIndex():
+    """
+    Design points of a heat pump model from *eta_s_data.json* as dense arrays.
+
+    The rows of the matrices *eta_s*, *heatload* and *ids* belong to the
+    heat source temperatures *T_keys* and the columns to the condenser
+    temperatures *cons_T_keys*. Missing entries are NaN (-1 for *ids*).
+    """
+
+    def __init__(self, data):
+        T_keys = sorted(data['eta_s'], key=int)
+        cons_T_keys = sorted(data['eta_s'][T_keys[0]], key=int)
+        for T in T_keys:
+            if sorted(data['eta_s'][T], key=int) != cons_T_keys:
+                raise ValueError('The design points must form a regular grid, the condenser temperatures for the '
+                                 'heat source temperature %s differ.' % T)
+
+        self.T_keys = np.array([int(T) for T in T_keys])
+        self.cons_T_keys = np.array([int(T) for T in cons_T_keys])
+
+        def matrix(name, missing):
+            return np.array([[missing if data[name][T].get(C) is None else data[name][T][C] for C in cons_T_keys]
+                             for T in T_keys])
+
+        self.eta_s = matrix('eta_s', np.nan)
+        self.heatload = matrix('heatload', np.nan) * 1000
+        self.ids = matrix('ids', -1).astype(int)
+        self.min_heatload = data['min_heatload']
+        self.max_heatload = data['max_heatload']
+
+        # range of the condenser temperatures with a known compressor efficiency for each heat source temperature
+        cons_T_known = np.where(np.isnan(self.eta_s), np.nan, self.cons_T_keys)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # rows without any design point stay NaN
+            self.cons_T_min = np.nanmin(cons_T_known, axis=1)
+            self.cons_T_max = np.nanmax(cons_T_known, axis=1)
+
+    def lookup(self, heat_source_T, cond_in_T, air):
+        """
+        Returns the :class:`DesignPoint` closest to the operating point.
+
+        *valid_T* is False, if no design point exists for the heat source
+        temperature, the remaining fields are meaningless in this case.
+        *skip* is True, if the heat pump can't be operated at the operating
+        point. The inputs can be scalars or arrays.
+        """
+        heat_source_T = np.asarray(heat_source_T, dtype=float)
+        cond_in_T = np.asarray(cond_in_T, dtype=float)
+
+        # the design points of water heat pumps are given for the temperature leaving the evaporator
+        T = heat_source_T if air else heat_source_T - 5
+        valid_T = ~(heat_source_T > cond_in_T) & (self.T_keys[0] <= T) & (T <= self.T_keys[-1])
+        i = nearest_index(self.T_keys, T)
+        T_des = self.T_keys[i]
+
+        cons_T_max = self.cons_T_max[i]
+        cons_T_des = cond_in_T + 5
+        too_high = cons_T_des > cons_T_max
+        skip = (cons_T_des < self.cons_T_min[i]) | (too_high & ~(cond_in_T < cons_T_max))
+        cons_T_des = np.where(too_high & (cond_in_T < cons_T_max), cons_T_max, cons_T_des)
+        j = nearest_index(self.cons_T_keys, cons_T_des)
+
+        heatload_des = self.heatload[i, j]
+        skip = skip | np.isnan(heatload_des) | ~valid_T
+
+        return DesignPoint(valid_T=valid_T, skip=skip,
+                           heat_source_T_des=T_des if air else T_des + 5,
+                           LFE_des=T_des - 5 if air else T_des,
+                           cons_T_max=cons_T_max,
+                           LWC_des=self.cons_T_keys[j],
+                           etas_des=self.eta_s[i, j],
+                           heatload_des=np.where(np.isnan(heatload_des), 0, heatload_des),
+                           idx=self.ids[i, j])
+
+
+_ETA_S_DATA = None
+_DESIGN_INDICES = {}
+
+
+def get_design_index(hp_model):
+    """Returns the :class:`DesignIndex` of *hp_model*, which is built once per process."""
+    global _ETA_S_DATA
+    try:
+        return _DESIGN_INDICES[hp_model]
+    except KeyError:
+        if _ETA_S_DATA is None:
+            with open(JSON_DATA_FILE, "r") as read_file:
+                _ETA_S_DATA = json.load(read_file)
+        index = _DESIGN_INDICES[hp_model] = DesignIndex(_ETA_S_DATA[hp_model])
+        return index
+
+
+class COPTable():
+    """
+    COP and condenser mass flow of a heat pump model for the 'fast' mode.
+
+    The data of *cop_m_data.json* (heat source temperature -> condenser inlet
+    temperature -> heat load -> values) is converted into a regular grid over
+    *T_keys*, *cond_in_T_keys* and the union *heatload_keys* of the heat
+    loads of all cells. The arrays *COP* and *cond_m* are NaN where a heat
+    load wasn't calculated for a cell.
+
+    :meth:`lookup` returns the values of the closest tabulated heat load of
+    the cell closest to the operating point, exactly as the lookup on the
+    dictionaries did.
+    """
+
+    def __init__(self, data):
+        T_keys = sorted(data, key=int)
+        cond_in_T_keys = sorted(data[T_keys[0]], key=int)
+        for T in T_keys:
+            if sorted(data[T], key=int) != cond_in_T_keys:
+                raise ValueError('The COP data must form a regular grid, the condenser inlet temperatures for the '
+                                 'heat source temperature %s differ.' % T)
+
+        cells = [[data[T][C] or {} for C in cond_in_T_keys] for T in T_keys]
+        heatload_keys = sorted({float(HL) for row in cells for cell in row for HL in cell})
+
+        self.T_keys = np.array([int(T) for T in T_keys])
+        self.cond_in_T_keys = np.array([int(C) for C in cond_in_T_keys])
+        self.heatload_keys = np.array(heatload_keys, dtype=float)
+
+        shape = (len(T_keys), len(cond_in_T_keys), len(heatload_keys))
+        self.COP = np.full(shape, np.nan)
+        self.cond_m = np.full(shape, np.nan)
+        position = {HL: k for k, HL in enumerate(heatload_keys)}
+        for i, row in enumerate(cells):
+            for j, cell in enumerate(row):
+                for HL, values in cell.items():
+                    k = position[float(HL)]
+                    for name in ('COP', 'cond_m'):
+                        if values.get(name) is not None:
+                            getattr(self, name)[i, j, k] = values[name]
+
+        # For every position u in heatload_keys, the index of the tabulated heat load of the cell, which is the
+        # largest one below heatload_keys[u] (before) or the smallest one from heatload_keys[u] on (after), -1 if
+        # there is none.
+        present = np.zeros(shape[:2] + (shape[2] + 1,), dtype=bool)
+        for i, row in enumerate(cells):
+            for j, cell in enumerate(row):
+                present[i, j, [position[float(HL)] for HL in cell]] = True
+        k = np.arange(shape[2] + 1)
+        self._before = np.maximum.accumulate(np.where(present, k, -1), axis=2)
+        self._before = np.concatenate([np.full(shape[:2] + (1,), -1), self._before[..., :-1]], axis=2)
+        after = np.where(present, k, shape[2] + 1)
+        self._after = np.flip(np.minimum.accumulate(np.flip(after, axis=2), axis=2), axis=2)
+        self._after[self._after > shape[2]] = -1
+
+    def lookup(self, heat_source_T, cond_in_T, heatload):
+        """
+        Returns the arrays (cond_m, COP) for the operating points. The values
+        are NaN, if no data is available for the closest cell.
+        """
+        i = nearest_index(self.T_keys, heat_source_T)
+        j = nearest_index(self.cond_in_T_keys, cond_in_T)
+        u = np.searchsorted(self.heatload_keys, heatload, side='left')
+        before = self._before[i, j, u]
+        after = self._after[i, j, u]
+        use_after = (before < 0) | ((after >= 0) &
+                                    (self.heatload_keys[after] - heatload < heatload - self.heatload_keys[before]))
+        k = np.where(use_after, after, before)
+        empty = k < 0
+        cond_m = np.where(empty, np.nan, self.cond_m[i, j, k])
+        COP = np.where(empty, np.nan, self.COP[i, j, k])
+        return cond_m, COP
+
+    def _fill_heatloads(self):
+        """
+        Returns the arrays *cond_m* and *COP*, with the values of each cell
+        linearly interpolated over all *heatload_keys*. Failed calculations
+        (cond_m <= 0) are not used, cells without any valid data stay NaN.
+        """
+        cond_m = np.full(self.cond_m.shape, np.nan)
+        COP = np.full(self.COP.shape, np.nan)
+        valid = (self.cond_m > 0) & ~np.isnan(self.COP)
+        for i, j in zip(*np.nonzero(valid.any(axis=2))):
+            k = valid[i, j]
+            cond_m[i, j] = np.interp(self.heatload_keys, self.heatload_keys[k], self.cond_m[i, j, k])
+            COP[i, j] = np.interp(self.heatload_keys, self.heatload_keys[k], self.COP[i, j, k])
+        return cond_m, COP
+
+    def interpolate(self, heat_source_T, cond_in_T, heatload):
+        """
+        Returns the arrays (cond_m, COP) for the operating points, linearly
+        interpolated in all three dimensions of the grid. Operating points
+        outside the grid are clamped to its boundaries. Corners of the
+        surrounding grid cell without data are left out and the weights of
+        the others are scaled accordingly, the values are NaN if there is no
+        data in any of them.
+        """
+        if not hasattr(self, '_filled'):
+            self._filled = np.stack(self._fill_heatloads(), axis=-1)
+
+        i, w_i = _grid_position(self.T_keys, heat_source_T)
+        j, w_j = _grid_position(self.cond_in_T_keys, cond_in_T)
+        k, w_k = _grid_position(self.heatload_keys, heatload)
+
+        values = 0
+        weights = 0
+        for di, wi in ((0, 1 - w_i), (1, w_i)):
+            for dj, wj in ((0, 1 - w_j), (1, w_j)):
+                for dk, wk in ((0, 1 - w_k), (1, w_k)):
+                    corner = self._filled[np.minimum(i + di, len(self.T_keys) - 1),
+                                          np.minimum(j + dj, len(self.cond_in_T_keys) - 1),
+                                          np.minimum(k + dk, len(self.heatload_keys) - 1)]
+                    w = np.where(np.isnan(corner[..., 0]), 0, wi * wj * wk)
+                    values = values + w[..., None] * np.nan_to_num(corner)
+                    weights = weights + w
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = values / weights[..., None]
+        return values[..., 0], values[..., 1]
+
+
+def _grid_position(keys, x):
+    """
+    Returns the index of the lower grid point of the interval of the sorted
+    array *keys*, which contains *x*, and the relative position of *x* in the
+    interval (clamped to 0...1).
+    """
+    x = np.asarray(x, dtype=float)
+    if len(keys) == 1:
+        return np.zeros(x.shape, dtype=int), np.zeros(x.shape)
+    i = np.clip(np.searchsorted(keys, x, side='right') - 1, 0, len(keys) - 2)
+    w = np.clip((x - keys[i]) / (keys[i + 1] - keys[i]), 0, 1)
+    return i, w
+
+
+_COP_M_DATA = None
+_COP_TABLES = {}
+
+
+def get_cop_table(hp_model):
+    """Returns the :class:`COPTable` of *hp_model* from *cop_m_data.json*, which is built once per process."""
+    global _COP_M_DATA
+    try:
+        return _COP_TABLES[hp_model]
+    except KeyError:
+        if _COP_M_DATA is None:
+            with open(COP_M_DATA_FILE, "r") as read_file:
+                _COP_M_DATA = json.load(read_file)
+        table = _COP_TABLES[hp_model] = COPTable(_COP_M_DATA[hp_model])
+        return table
@@ -1,4 +1,5 @@
-import os
+import time
+import warnings
 from hplib import hplib as hpl
 from tespy.networks import Network
 from tespy.components import (
@@ -8,11 +9,9 @@ from tespy.components import (
 from tespy.connections import Connection, Ref
 from tespy.tools.characteristics import CharLine
 from tespy.tools.characteristics import load_default_char as ldc
-from bisect import bisect_left
-
-import json
-JSON_DATA_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'eta_s_data.json'))
-COP_M_DATA_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'cop_m_data.json'))
+import numpy as np
+from mosaik_heatpump.heatpump.Heat_Pump_Cache import DESIGN_CACHE, LRUCache, get_design_path_store
+from mosaik_heatpump.heatpump.Heat_Pump_Data import COPTable, get_design_index
 
 
 class Heat_Pump_Des():
@@ -34,6 +33,20 @@ class Heat_Pump_Des():
         self.HC_fixed = params.get('heating capacity', None)
         self.cond_m_fixed = params.get('cond_m', None)
 
+        # Repeat failed or unconverged offdesign calculations of the 'detailed' mode starting from the design state
+        # (each calculation starts from the last converged state of the heat pump)
+        self.warm_start = params.get('warm_start', False)
+
+        # Directory to store the design points for the 'detailed' calculation mode, a temporary directory if None
+        self.design_store = get_design_path_store(params.get('design_dir'))
+
+        # Number of offdesign results of the 'detailed' mode kept by this heat pump (no results are kept if None) and
+        # the tolerances of the temperatures (in K) and of the heat load (in W) within which they are reused
+        self.result_cache = None
+        if params.get('result_cache_size'):
+            self.result_cache = LRUCache(maxsize=params['result_cache_size'])
+        self.result_cache_tol = params.get('result_cache_tol', (0.01, 1))
+
         # Attributes of the heat pump
         self.LFE = None  # The temperature of the fluid leaving the evaporator
         self.LFE_des = None  # The temperature of the water leaving the condenser in design case
@@ -47,12 +60,22 @@ class Heat_Pump_Des():
         self.sh = False  # Super heater for the fluid entering the evaporator
         self.idx = None  # Index to keep track of the current design point
         self.nw = None  # The network with all the components
+        self.nw_idx = None  # The design point of the network
+        self.nw_solved = False  # The network was solved, otherwise it is initialised with the design point
+        self.design_path = None  # The directory with the saved design point of the network
         self.Q_Supplied = None  # Heat supplied by the heat pump
         self.on_fraction = None  # The fraction of timestep for which the heat pump operates
         self.cond_m = None  # The mass flow of water in condenser
         self.Q_evap = None  # The heat extracted from source in the evaporator
         self.COP_m_data = COP_m_data  # The saved data for fast calculation mode
+        self.cop_table = None  # The saved data for fast calculation mode as a COPTable
+        if isinstance(COP_m_data, COPTable):
+            self.cop_table = COP_m_data
+        elif COP_m_data is not None:
+            self.cop_table = COPTable(COP_m_data)
         self.skip_step = False  # Used to skip a step in case of an error
+        self.solve_iter = 0  # The number of iterations of the offdesign calculation in the last step
+        self.solve_time = 0  # The time taken by the offdesign calculation in the last step (in s)
 
         # Initiating the heat pump for the hplib mode
         if 'hplib' in self.calc_mode.lower():
@@ -73,103 +96,73 @@ class Heat_Pump_Des():
         if 'detailed' in self.calc_mode.lower():
             self.cond_in_T = self.cons_T - 5
             self._etas_heatload_id()
-            self._design_hp()
-
-
-
-    def _take_closest(self, myList, myNumber):
-        """
-        Assumes myList is sorted. Returns closest value to myNumber.
-        If two numbers are equally close, return the smallest number.
-        """
-        pos = bisect_left(myList, myNumber)
-        if pos == 0:
-            return myList[0]
-        if pos == len(myList):
-            return myList[-1]
-        before = myList[pos - 1]
-        after = myList[pos]
-        if after - myNumber < myNumber - before:
-            return after
-        else:
-            return before
-
+            self._load_design()
 
     def _etas_heatload_id(self):
-        with open(JSON_DATA_FILE, "r") as read_file_1:
-            data_1 = json.load(read_file_1)
-
-        etas_dict = data_1[self.hp_model]['eta_s']
-        heatload_dict = data_1[self.hp_model]['heatload']
-        id_dict = data_1[self.hp_model]['ids']
-
-        heat_source_T_min = min(list(map(int, etas_dict)))
-        heat_source_T_max = max(list(map(int, etas_dict)))
-
-        self.skip_step = False
-
-        if self.heat_source_T > self.cond_in_T:
-            self.skip_step = True
-
-        if not self.skip_step:
-
-            if 'air' in self.heat_source.lower():
-                if heat_source_T_min <= self.heat_source_T <= heat_source_T_max:
-                    idx_T = self._take_closest(list(map(int, etas_dict)), (self.heat_source_T))
-                    self.heat_source_T_des = idx_T
-                    self.LFE_des = self.heat_source_T_des - 5
-                else:
-                    self.skip_step = True
+        design_index = get_design_index(self.hp_model)
+        design = design_index.lookup(self.heat_source_T, self.cond_in_T, 'air' in self.heat_source.lower())
+
+        self.skip_step = bool(design.skip)
+
+        if design.valid_T:
+            self.heat_source_T_des = int(design.heat_source_T_des)
+            self.LFE_des = int(design.LFE_des)
+            self.cons_T_max = int(design.cons_T_max)
+            self.LWC_des = int(design.LWC_des)
+            self.etas_des = None if np.isnan(design.etas_des) else float(design.etas_des)
+            if design.heatload_des == 0:  # no design point
+                self.heatload_des = 0
+                self.heatload_max = 0
+                self.heatload_min = 0
             else:
-                if heat_source_T_min <= (self.heat_source_T-5) <= heat_source_T_max:
-                    idx_T = self._take_closest(list(map(int, etas_dict)), (self.heat_source_T - 5))
-                    self.LFE_des = idx_T
-                    self.heat_source_T_des = self.LFE_des + 5
-                else:
-                    self.skip_step = True
-
-            if not self.skip_step:
-
-                clean_dict = {k: etas_dict[str(idx_T)][k] for k in etas_dict[str(idx_T)] if
-                              etas_dict[str(idx_T)][k] is not None}
-
-                cons_T_min = min(list(map(int, clean_dict)))
-                self.cons_T_max = max(list(map(int, clean_dict)))
-
-                cons_T_des = self.cond_in_T + 5
-
-                if cons_T_des < cons_T_min:
-                    self.skip_step = True
-                elif cons_T_des > self.cons_T_max:
-                    if self.cond_in_T < self.cons_T_max:
-                        cons_T_des = self.cons_T_max
-                    else:
-                        self.skip_step = True
-
-                self.LWC_des = self._take_closest(list(map(int, etas_dict[str(idx_T)])), cons_T_des)
-
-                self.etas_des = etas_dict[str(idx_T)][str(self.LWC_des)]
+                self.heatload_des = float(design.heatload_des)
+                self.heatload_max = self.heatload_des
+                self.heatload_min = design_index.min_heatload
+            self.idx = int(design.idx)
 
-                heatload_des = heatload_dict[str(idx_T)][str(self.LWC_des)]
-
-                if heatload_des is None:
-                    self.skip_step = True
-                    self.heatload_des = 0
-                    self.heatload_max = 0
-                    self.heatload_min = 0
-
-                else:
-                    self.heatload_des = heatload_des * 1000
-                    self.heatload_max = self.heatload_des
-                    self.heatload_min = data_1[self.hp_model]['min_heatload']
-
-
-                self.idx = id_dict[str(idx_T)][str(self.LWC_des)]
+    def _load_design(self):
+        """
+        Makes a network designed for the current design point available in *self.nw*.
 
+        The design points already calculated by this or by any other heat pump of the same model are taken from
+        :data:`DESIGN_CACHE`, which holds the directory of the saved design point and the values of the design
+        calculation. The heat pump then only creates its own network, whose first offdesign calculation starts from
+        the saved design point, so that returning to a known design point needs no design calculation.
+        """
+        key = (self.hp_model, self.idx)
+        self.nw_idx = self.idx
+        design = DESIGN_CACHE.get(key)
+        if design is not None:
+            self.design_path = design['design_path']
+            self.cmp_stages = design['cmp_stages']
+            self.ic = design['ic']
+            self.sh = design['sh']
+            self._build_network()
+            self.nw_solved = False
+            self.P_cons = design['P_cons']
+            self.COP = design['COP']
+            self.Q_evap = design['Q_evap']
+            return
+
+        self._design_hp()
+        self.p_cop_calc()
 
+        if not self.skip_step:
+            DESIGN_CACHE.put(key, {'design_path': self.design_path, 'cmp_stages': self.cmp_stages, 'ic': self.ic,
+                                   'sh': self.sh, 'P_cons': self.P_cons, 'COP': self.COP, 'Q_evap': self.Q_evap})
 
     # Method to design the heat pump
     def _design_hp(self):
+        self._build_network()
+
+        # %% Calculation of the design condition
+        self.nw.solve('design')
+        self.nw_solved = True
+        # self.nw.print_results()
+        self.design_path = self.design_store.save(self.nw, self.hp_model, self.idx)
+
+    def _build_network(self):
+        """Creates the network of the heat pump with the parameters of the current design point, without solving it."""
 
         # The parameters that will vary for the different heat pump models are defined here
         if 'air_6kw' in self.hp_model.lower():
@@ -391,10 +384,47 @@ class Heat_Pump_Des():
         # %% key paramter
         cons.set_attr(Q=-self.heatload_des)
 
-        # %% Calculation of the design condition
-        self.nw.solve('design')
-        # self.nw.print_results()
-        self.nw.save('heat_pump')
+    def _solve_offdesign(self):
+        """
+        Performs the offdesign calculation of the current step.
+
+        TESPy starts each calculation from the last converged state of the network of this heat pump. In the warm start
+        mode, a calculation which fails or does not converge is repeated starting from the design state.
+        """
+        start = time.perf_counter()
+        self.solve_iter = 0
+
+        try:
+            init_path = None if self.nw_solved else self.design_path
+            self.nw.solve('offdesign', design_path=self.design_path, init_path=init_path)
+        except Exception:
+            if not self.warm_start:
+                raise
+            retry = True
+        else:
+            self.nw_solved = True
+            self.solve_iter += self.nw.iter + 1
+            retry = self.warm_start and not (self.nw.converged and not self.nw.lin_dep)
+
+        if retry:
+            self.nw.solve('offdesign', design_path=self.design_path, init_path=self.design_path,
+                          init_previous=False)
+            self.nw_solved = True
+            self.solve_iter += self.nw.iter + 1
+
+        self.solve_time = time.perf_counter() - start
+
+    def _result_key(self):
+        """Returns the key of the current operating point in the *result_cache*."""
+        T_tol, Q_tol = self.result_cache_tol
+        return (self.idx, round(self.heat_source_T / T_tol), round(self.cond_in_T / T_tol),
+                round(self.Q_Supplied / Q_tol))
+
+    def result_cache_hit_rate(self):
+        """Returns the share of the offdesign calculations that were taken from the *result_cache*."""
+        if self.result_cache is None or self.result_cache.hits + self.result_cache.misses == 0:
+            return 0
+        return self.result_cache.hits / (self.result_cache.hits + self.result_cache.misses)
 
     def p_cop_calc(self):
 
@@ -418,6 +448,8 @@ class Heat_Pump_Des():
 
         self.skip_step = False
         self.on_fraction = 1
+        self.solve_iter = 0
+        self.solve_time = 0
 
         heat_source_T = inputs.get('heat_source_T')
         if heat_source_T is not None:
@@ -435,8 +467,6 @@ class Heat_Pump_Des():
         if Q_Demand is not None:
             self.Q_Demand = Q_Demand
 
-        id_old = self.idx
-
         if self.calc_mode != 'fixed':
             self._etas_heatload_id()
 
@@ -493,17 +523,17 @@ class Heat_Pump_Des():
 
                 if not self.skip_step:
 
-                    if self.calc_mode == 'fast':
-                        heat_source_T_idx = str(self._take_closest(list(map(int, self.COP_m_data.keys())), self.heat_source_T))
-                        cond_in_T_idx = str(self._take_closest(list(map(int, self.COP_m_data[heat_source_T_idx].keys())),
-                                                               self.cond_in_T))
-                        HL_idx = str(self._take_closest(list(map(float, self.COP_m_data[heat_source_T_idx][cond_in_T_idx].keys())),
-                                                        self.Q_Supplied))
-                        try:
-                            self.cond_m = self.COP_m_data[heat_source_T_idx][cond_in_T_idx][HL_idx]['cond_m']
-                            self.COP = self.COP_m_data[heat_source_T_idx][cond_in_T_idx][HL_idx]['COP']
-                        except:
+                    if self.calc_mode == 'fast' or self.calc_mode == 'fast_interp':
+                        if self.calc_mode == 'fast':
+                            cond_m, COP = self.cop_table.lookup(self.heat_source_T, self.cond_in_T, self.Q_Supplied)
+                        else:
+                            cond_m, COP = self.cop_table.interpolate(self.heat_source_T, self.cond_in_T,
+                                                                     self.Q_Supplied)
+                        if np.isnan(cond_m) or np.isnan(COP):
                             self.step_error()
+                        else:
+                            self.cond_m = float(cond_m)
+                            self.COP = float(COP)
 
                         if self.cond_m > 0:
                             self.cons_T = self.cond_in_T + self.Q_Supplied/self.cond_m/4184
@@ -517,14 +547,29 @@ class Heat_Pump_Des():
 
                     elif self.calc_mode == 'detailed':
 
-                        if id_old != self.idx:
+                        result = None
+                        if self.result_cache is not None:
+                            result = self.result_cache.get(self._result_key())
+
+                        if result is not None:
+                            if result == 'error':
+                                self.step_error()
+                            else:
+                                self.cond_m, self.cons_T, self.COP, self.P_cons, self.Q_evap = result
+
+                        elif self.nw_idx != self.idx:
                             try:
-                                self._design_hp()
-                            except:
+                                self._load_design()
+                            except Exception as e:
+                                warnings.warn('The design of the heat pump model %s failed at the design point %s: '
+                                              '%r' % (self.hp_model, self.idx, e))
+                                self.nw = None
                                 self.step_error()
-                            self.p_cop_calc()
 
-                        if not self.skip_step:
+                        elif self.nw is None:
+                            self.step_error()  # the design of this design point failed before
+
+                        if not self.skip_step and result is None:
                             self.nw.get_conn('source ambient:out1_ambient pump:in1').set_attr(T=self.heat_source_T)
                             self.nw.get_conn('consumer cycle closer:out1_condenser recirculation pump:in1').set_attr(T=self.cond_in_T)
                             if 'fixed_evap_m' not in self.hp_model.lower():
@@ -532,13 +577,17 @@ class Heat_Pump_Des():
                                 self.nw.get_conn('evaporator:out1_sink ambient:in1').set_attr(T=self.LFE)
                             self.nw.get_comp('consumer').set_attr(Q=-self.Q_Supplied)
                             try:
-                                self.nw.solve('offdesign', design_path='heat_pump')
+                                self._solve_offdesign()
                                 self.cond_m = self.nw.get_conn('condenser:out2_consumer:in1').m.val
                                 self.cons_T = self.nw.get_conn('condenser:out2_consumer:in1').T.val
                                 self.p_cop_calc()
                             except:
                                 self.step_error()
 
+                            if self.result_cache is not None:
+                                self.result_cache.put(self._result_key(), 'error' if self.skip_step else
+                                                      (self.cond_m, self.cons_T, self.COP, self.P_cons, self.Q_evap))
+
                 else:
                     self.step_error()
         else:
@@ -570,10 +619,6 @@ if __name__ == '__main__':
         'heating capacity': 15000,
     }
 
-    # with open(COP_M_DATA_FILE, "r") as read_file_1:
-    #     COP_m_data_all = json.load(read_file_1)
-    #     COP_m_data = COP_m_data_all[params_air['hp_model']]
-    # heat_pump_1 = Heat_Pump_Des(params_air, COP_m_data=COP_m_data)
     heat_pump_1 = Heat_Pump_Des(params_air, COP_m_data=None)
 
 
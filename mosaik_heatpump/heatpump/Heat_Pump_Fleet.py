@@ -0,0 +1,158 @@
+"""
+This module contains a fleet of heat pumps with the same parameters, whose inputs and states are stored in numpy arrays
+and are calculated for all heat pumps at once.
+"""
+
+import numpy as np
+from mosaik_heatpump.heatpump.Heat_Pump_Des import Heat_Pump_Des
+from mosaik_heatpump.heatpump.Heat_Pump_Data import get_design_index
+
+
+class HeatPumpFleet():
+    """
+    *num* heat pumps with the same *params*, which are calculated together in each step.
+
+    The 'fixed', 'fast', 'fast_interp' and 'hplib' calculation modes are supported. The results are the same as those
+    of *num* :class:`.Heat_Pump_Model.Heat_Pump` instances, except that the values rounded in the 'hplib' mode are
+    rounded with :func:`numpy.round`.
+
+    The inputs and the states of the heat pumps are numpy arrays with one value for each heat pump and are named
+    like the attributes of :class:`.Heat_Pump_Model.Heat_Pump_Inputs` and :class:`.Heat_Pump_Model.Heat_Pump_State`.
+    Missing inputs are NaN. A single heat pump can be accessed like a :class:`.Heat_Pump_Model.Heat_Pump` with
+    :meth:`unit`.
+    """
+
+    inputs = ['Q_Demand', 'heat_source_T', 'cond_in_T', 'T_amb', 'step_size']
+    states = ['P_Required', 'COP', 'Q_Supplied', 'Q_evap', 'on_fraction', 'cond_m', 'cond_m_neg', 'cons_T',
+              'heat_source', 'solve_iter', 'solve_time', 'result_cache_hit_rate', 'step_executed']
+
+    def __init__(self, params, num, COP_m_data=None):
+        if params['calc_mode'] not in ('fixed', 'fast', 'fast_interp', 'hplib'):
+            raise ValueError('Calculation mode %s is not supported by the heat pump fleet' % params['calc_mode'])
+
+        self.num = num
+        self.design = Heat_Pump_Des(params, COP_m_data)
+        """The parameters of the heat pumps, stored in a :class:`.Heat_Pump_Des.Heat_Pump_Des` object"""
+        self.calc_mode = self.design.calc_mode
+        self.air = 'air' in self.design.heat_source.lower()
+
+        for attr in self.inputs:
+            value = params.get(attr)
+            setattr(self, attr, np.full(num, np.nan if value is None else value, dtype=float))
+        for attr in self.states:
+            setattr(self, attr, np.zeros(num))
+        self.step_executed = np.zeros(num, dtype=bool)
+
+    def unit(self, i):
+        """Returns a view of the heat pump *i*, with the attributes *inputs* and *state*."""
+        return HeatPumpFleetUnit(self, i)
+
+    def step(self):
+        """
+        perform simulation step for all heat pumps
+
+        The values of the states are calculated like in the :meth:`.Heat_Pump_Des.Heat_Pump_Des.step` method of
+        a single heat pump.
+        """
+        self.on_fraction[:] = 1
+        if self.calc_mode == 'fixed':
+            ok = self._step_fixed()
+        else:
+            design = get_design_index(self.design.hp_model).lookup(self.heat_source_T, self.cond_in_T, self.air)
+            heatload_max = design.heatload_des
+            heatload_min = np.where(heatload_max == 0, 0, get_design_index(self.design.hp_model).min_heatload)
+            ok = ~design.skip & ~(self.Q_Demand < heatload_min)
+            if self.calc_mode == 'hplib':
+                ok = self._step_hplib(ok & ~(self.cond_in_T > (design.cons_T_max - 5)))
+            else:
+                ok = self._step_fast(ok, heatload_max, design.cons_T_max)
+
+        for attr in ('P_Required', 'COP', 'Q_Supplied', 'cond_m', 'cons_T', 'Q_evap'):
+            getattr(self, attr)[~ok] = 0
+        self.cond_m_neg[:] = -self.cond_m
+        self.step_executed[:] = True
+
+    def _limit_to_demand(self, ok):
+        """Operates the heat pumps only for the fraction of the step required to supply the heat demand."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            on_fraction = np.round(self.Q_Demand / self.Q_Supplied, 2)
+        excess = ok & (self.Q_Supplied > self.Q_Demand)
+        self.on_fraction[excess] = on_fraction[excess]
+        self.Q_Supplied[excess] = self.Q_Demand[excess]
+        self.P_Required[excess] *= on_fraction[excess]
+        self.cond_m[excess] *= on_fraction[excess]
+
+    def _step_fixed(self):
+        self.COP[:] = self.design.COP_fixed
+        self.Q_Supplied[:] = self.design.HC_fixed
+        self.cond_m[:] = self.design.cond_m_fixed
+        self.P_Required[:] = self.Q_Supplied / self.COP
+        self.cons_T[:] = self.cond_in_T + self.Q_Supplied / self.cond_m / 4184
+        ok = np.ones(self.num, dtype=bool)
+        self._limit_to_demand(ok)
+        return ok
+
+    def _step_hplib(self, ok):
+        results = self.design.hp.simulate(t_in_primary=self.heat_source_T, t_in_secondary=self.cond_in_T,
+                                          t_amb=self.T_amb, mode=1)
+        self.cond_m[:] = np.round(results['m_dot'], 2)
+        self.COP[:] = np.round(results['COP'], 2)
+        self.P_Required[:] = np.round(results['P_el'], 2)
+        self.cons_T[:] = np.round(results['T_out'], 2)
+        self.Q_Supplied[:] = np.round(results['P_th'], 2)
+        self._limit_to_demand(ok)
+        return ok
+
+    def _step_fast(self, ok, heatload_max, cons_T_max):
+        self.Q_Supplied[:] = np.minimum(self.Q_Demand, heatload_max)
+        if self.calc_mode == 'fast':
+            cond_m, COP = self.design.cop_table.lookup(self.heat_source_T, self.cond_in_T, self.Q_Supplied)
+        else:
+            cond_m, COP = self.design.cop_table.interpolate(self.heat_source_T, self.cond_in_T, self.Q_Supplied)
+        ok = ok & ~np.isnan(COP) & (cond_m > 0)
+        self.cond_m[:] = np.where(ok, cond_m, 0)
+        self.COP[:] = np.where(ok, COP, 0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.cons_T[:] = self.cond_in_T + self.Q_Supplied / self.cond_m / 4184
+            too_hot = ok & (self.cons_T > cons_T_max)
+            self.cons_T[too_hot] = cons_T_max[too_hot]
+            self.Q_Supplied[too_hot] = (self.cond_m * 4184 * (self.cons_T - self.cond_in_T))[too_hot]
+            self.P_Required[:] = self.Q_Supplied / self.COP
+        self.Q_evap[:] = -(self.Q_Supplied - self.P_Required - 50)
+        return ok
+
+
+class HeatPumpFleetUnit():
+    """
+    A single heat pump of a :class:`HeatPumpFleet`, whose *inputs* and *state* attributes read and write the arrays
+    of the fleet, like those of a :class:`.Heat_Pump_Model.Heat_Pump`.
+    """
+
+    __slots__ = ['fleet', 'inputs', 'state']
+
+    def __init__(self, fleet, i):
+        self.fleet = fleet
+        self.inputs = _FleetValues(fleet, i, fleet.inputs)
+        self.state = _FleetValues(fleet, i, fleet.inputs + fleet.states)
+
+
+class _FleetValues():
+    """The values of the heat pump *i* in the arrays *attrs* of *fleet*."""
+
+    __slots__ = ['_fleet', '_i', '_attrs']
+
+    def __init__(self, fleet, i, attrs):
+        object.__setattr__(self, '_fleet', fleet)
+        object.__setattr__(self, '_i', i)
+        object.__setattr__(self, '_attrs', attrs)
+
+    def __getattr__(self, attr):
+        if attr not in self._attrs:
+            raise AttributeError(attr)
+        return getattr(self._fleet, attr)[self._i].item()
+
+    def __setattr__(self, attr, value):
+        if attr not in self._attrs:
+            raise AttributeError(attr)
+        getattr(self._fleet, attr)[self._i] = np.nan if value is None else value
@@ -0,0 +1,190 @@
+"""
+Generates the data of a heat pump model for the 'fast' calculation modes with the 'detailed' mode.
+
+The operating points, i.e. the heat source temperatures, the condenser inlet temperatures and the heat loads of the
+design points in *eta_s_data.json*, are calculated in parallel processes. The results are written to a checkpoint
+file as they are calculated, so that an interrupted run continues where it stopped when it is started again. When
+all operating points are calculated, the data of the model is written to *cop_m_data.json*, the file read by the
+fast calculation modes.
+
+Usage::
+
+    mosaik-heatpump-cop-data Air_30kW_fixed_evap_m --processes 8
+
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import numpy as np
+from mosaik_heatpump.heatpump.Heat_Pump_Des import Heat_Pump_Des
+from mosaik_heatpump.heatpump.Heat_Pump_Data import COP_M_DATA_FILE, get_design_index
+
+
+def heatloads(min_heatload, heatload_des, step=500):
+    """Returns the heat loads from *min_heatload* up to *heatload_des*, which are calculated for a design point."""
+    if (min_heatload + step) < heatload_des:
+        heatload_list = np.arange(min_heatload, heatload_des, step)
+        if heatload_list[-1] < heatload_des:
+            heatload_list = np.append(heatload_list, heatload_des)
+        return [float(heatload) for heatload in heatload_list]
+    return [float(heatload_des)]
+
+
+def grid(hp_model, T_min=None, T_max=None):
+    """
+    Returns the pairs (heat source temperature, condenser inlet temperature) of the grid of the model *hp_model*,
+    optionally limited to the heat source temperatures *T_min* to *T_max*.
+    """
+    design_index = get_design_index(hp_model)
+    T_min = design_index.T_keys.min() if T_min is None else T_min
+    T_max = design_index.T_keys.max() if T_max is None else T_max
+    cond_in_T_list = range(design_index.cons_T_keys.min() - 5, design_index.cons_T_keys.max() - 4)
+    return [(int(T), int(cond_in_T)) for T in range(T_min, T_max + 1) for cond_in_T in cond_in_T_list]
+
+
+_heat_pump = None
+_heatload_step = 500
+
+
+def _init_worker(params, heatload_step):
+    global _heat_pump, _heatload_step
+    _heat_pump = Heat_Pump_Des(params)
+    _heatload_step = heatload_step
+
+
+def _calculate(point):
+    """Calculates the condenser mass flows and the COPs of all heat loads at the grid *point*."""
+    heat_source_T, cond_in_T = point
+    hp = _heat_pump
+    hp.heat_source_T = heat_source_T
+    hp.cond_in_T = cond_in_T
+    hp._etas_heatload_id()
+    if hp.skip_step:
+        return point, {}
+
+    try:
+        hp._design_hp()
+        hp.nw_idx = hp.idx
+        designed = True
+    except:
+        designed = False
+
+    data = {}
+    for heatload in heatloads(get_design_index(hp.hp_model).min_heatload, hp.heatload_des, _heatload_step):
+        data[str(heatload)] = {'cond_m': 0, 'COP': 0}
+        if designed:
+            try:
+                hp.step({'heat_source_T': heat_source_T, 'cond_in_T': cond_in_T, 'Q_Demand': heatload})
+                data[str(heatload)] = {'cond_m': float(hp.cond_m), 'COP': float(hp.COP)}
+            except:
+                pass
+    return point, data
+
+
+def generate(hp_model, heat_source, processes=None, checkpoint=None, T_min=None, T_max=None, heatload_step=500,
+             progress=None):
+    """
+    Calculates the data of the model *hp_model* for the 'fast' calculation modes and returns it.
+
+    The results of each grid point are appended to the *checkpoint* file, if given, and the grid points already
+    contained in it are not calculated again. *progress* is called with the number of calculated and the number of
+    all grid points after each grid point.
+    """
+    points = grid(hp_model, T_min, T_max)
+    results = {}
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        with open(checkpoint, 'r') as read_file:
+            for line in read_file:
+                try:
+                    heat_source_T, cond_in_T, data = json.loads(line)
+                except ValueError:
+                    continue  # incomplete line of an interrupted run
+                results[(heat_source_T, cond_in_T)] = data
+
+    todo = [point for point in points if point not in results]
+    if todo:
+        params = {'hp_model': hp_model, 'heat_source': heat_source, 'heat_source_T': 7, 'cons_T': 35,
+                  'Q_Demand': 32500, 'calc_mode': 'detailed'}
+        write_file = open(checkpoint, 'a') if checkpoint is not None else None
+        try:
+            with mp.Pool(processes, initializer=_init_worker, initargs=(params, heatload_step)) as pool:
+                done = len(points) - len(todo)
+                for point, data in pool.imap_unordered(_calculate, todo):
+                    done += 1
+                    results[point] = data
+                    if write_file is not None:
+                        write_file.write(json.dumps([point[0], point[1], data]) + '\n')
+                        write_file.flush()
+                    if progress is not None:
+                        progress(done, len(points))
+        finally:
+            if write_file is not None:
+                write_file.close()
+
+    data = {}
+    for heat_source_T, cond_in_T in points:
+        data.setdefault(str(heat_source_T), {})[str(cond_in_T)] = results[(heat_source_T, cond_in_T)]
+    return data
+
+
+def save(hp_model, data, filename=COP_M_DATA_FILE, overwrite=False):
+    """Writes the *data* of the model *hp_model* to *filename*, keeping the data of the other models in it."""
+    all_data = {}
+    if os.path.isfile(filename):
+        with open(filename, 'r') as read_file:
+            all_data = json.load(read_file)
+    if hp_model in all_data and not overwrite:
+        raise ValueError('The data of the model %s already exists in %s' % (hp_model, filename))
+    all_data[hp_model] = data
+
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'w') as write_file:
+        json.dump(all_data, write_file, indent=4)
+    os.replace(tmp_filename, filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates the data of a heat pump model for the fast calculation '
+                                                 'modes.')
+    parser.add_argument('hp_model', help='name of the heat pump model, as used in eta_s_data.json')
+    parser.add_argument('--heat-source', choices=['air', 'water'],
+                        help='the source of heat (default: water for water models, air otherwise)')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--output', default=COP_M_DATA_FILE, help='the data file (default: %(default)s)')
+    parser.add_argument('--checkpoint', default=None,
+                        help='file of the calculated grid points (default: <output>.<hp_model>.partial)')
+    parser.add_argument('--overwrite', action='store_true', help='replace existing data of the model')
+    parser.add_argument('--T-min', type=int, default=None, help='lowest heat source temperature')
+    parser.add_argument('--T-max', type=int, default=None, help='highest heat source temperature')
+    parser.add_argument('--heatload-step', type=float, default=500, help='step of the heat loads in W')
+    args = parser.parse_args(argv)
+
+    heat_source = args.heat_source
+    if heat_source is None:
+        heat_source = 'water' if 'water' in args.hp_model.lower() else 'air'
+    checkpoint = args.checkpoint
+    if checkpoint is None:
+        checkpoint = '%s.%s.partial' % (args.output, args.hp_model)
+
+    if not args.overwrite and os.path.isfile(args.output):
+        with open(args.output, 'r') as read_file:
+            if args.hp_model in json.load(read_file):
+                parser.error('The data of the model %s already exists in %s, use --overwrite to replace it'
+                             % (args.hp_model, args.output))
+
+    def progress(done, total):
+        print('\r%d/%d grid points' % (done, total), end='', file=sys.stderr, flush=True)
+
+    data = generate(args.hp_model, heat_source, args.processes, checkpoint, args.T_min, args.T_max,
+                    args.heatload_step, progress)
+    print(file=sys.stderr)
+    save(args.hp_model, data, args.output, args.overwrite)
+    if os.path.isfile(checkpoint):
+        os.remove(checkpoint)
+
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,12 @@ class Heat_Pump_State():
         self.cond_m = 0
         """The mass flow rate of water in the condenser of the heat pump (in kg/s)"""
         self.cond_m_neg = 0
+        self.solve_iter = 0
+        """The number of iterations of the offdesign calculation in the 'detailed' mode"""
+        self.solve_time = 0
+        """The time taken by the offdesign calculation in the 'detailed' mode (in s)"""
+        self.result_cache_hit_rate = 0
+        """The share of the offdesign results of the 'detailed' mode that were reused from earlier steps"""
         self.step_executed = False
 
 
@@ -142,5 +148,8 @@ class Heat_Pump():
         self.state.cond_m = self.design.Heat_Pump.cond_m
         self.state.cond_m_neg = - self.design.Heat_Pump.cond_m
         self.state.cons_T = self.design.Heat_Pump.cons_T
+        self.state.solve_iter = self.design.Heat_Pump.solve_iter
+        self.state.solve_time = self.design.Heat_Pump.solve_time
+        self.state.result_cache_hit_rate = self.design.Heat_Pump.result_cache_hit_rate()
         self.state.step_executed = True
 
@@ -0,0 +1,147 @@
+"""
+This module contains a pool of worker processes, which calculate the heat pumps of a simulator in parallel.
+"""
+
+import multiprocessing as mp
+import traceback
+from mosaik_heatpump.heatpump.Heat_Pump_Cache import get_design_path_store, set_design_cache_size
+from mosaik_heatpump.heatpump.Heat_Pump_Model import Heat_Pump, Heat_Pump_Inputs, Heat_Pump_State
+
+
+class HeatPumpProxy():
+    """
+    Copy of the *inputs* and the *state* of a heat pump that is calculated in a worker process of a
+    :class:`HeatPumpWorkers` pool.
+    """
+
+    __slots__ = ['inputs', 'state']
+
+    def __init__(self, params):
+        self.inputs = Heat_Pump_Inputs(params)
+        self.state = Heat_Pump_State()
+
+
+class HeatPumpWorkers():
+    """
+    Pool of *processes* worker processes, which live until :meth:`close` is called. *design_cache_size* is the size
+    of the design cache of each worker (see :func:`.Heat_Pump_Cache.set_design_cache_size`), the default if None.
+
+    Each heat pump is assigned to one of the workers when it is created and is kept by this worker, including the
+    TESPy network of the 'detailed' mode, for the whole simulation. In each step, the inputs of all heat pumps of
+    a worker are sent to it at once and the states of all of them are returned at once.
+    """
+
+    def __init__(self, processes, design_cache_size=None):
+        self.connections = []
+        self.processes = []
+        self.shards = []  # the heat pumps (eid, proxy) of each worker
+        for _ in range(processes):
+            conn, worker_conn = mp.Pipe()
+            process = mp.Process(target=_work, args=(worker_conn, design_cache_size), daemon=True)
+            process.start()
+            worker_conn.close()
+            self.connections.append(conn)
+            self.processes.append(process)
+            self.shards.append([])
+
+    def create(self, eids, params, COP_m_data=None):
+        """
+        Creates heat pumps with *params* for each of the *eids* in the workers and returns their
+        :class:`HeatPumpProxy` objects.
+        """
+        if 'detailed' in params['calc_mode'].lower():
+            # the workers share the design points
+            params = dict(params, design_dir=get_design_path_store(params.get('design_dir')).root)
+
+        created = [[] for _ in self.shards]
+        proxies = []
+        for eid in eids:
+            i = min(range(len(self.shards)), key=lambda i: len(self.shards[i]) + len(created[i]))
+            created[i].append(eid)
+            proxy = HeatPumpProxy(params)
+            self.shards[i].append((eid, proxy))
+            proxies.append(proxy)
+
+        self._request([('create', shard_eids, params, COP_m_data) if shard_eids else None for shard_eids in created])
+        return proxies
+
+    def step(self):
+        """Performs a simulation step of all heat pumps and updates the states of their proxies."""
+        requests = []
+        for shard in self.shards:
+            inputs = []
+            for eid, proxy in shard:
+                inputs.append((eid, {attr: getattr(proxy.inputs, attr) for attr in Heat_Pump_Inputs.__slots__
+                                     if hasattr(proxy.inputs, attr)}))
+            requests.append(('step', inputs) if inputs else None)
+
+        for shard, states in zip(self.shards, self._request(requests)):
+            if states is not None:
+                for eid, proxy in shard:
+                    vars(proxy.state).update(states[eid])
+
+    def close(self):
+        """Stops the worker processes."""
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for conn, process in zip(self.connections, self.processes):
+            process.join()
+            conn.close()
+        self.connections = []
+        self.processes = []
+        self.shards = []
+
+    def _request(self, requests):
+        """Sends the *requests* (None for no request) to the workers and returns their replies."""
+        for conn, request in zip(self.connections, requests):
+            if request is not None:
+                conn.send(request)
+
+        replies = []
+        errors = []
+        for conn, request in zip(self.connections, requests):
+            if request is None:
+                replies.append(None)
+                continue
+            status, reply = conn.recv()
+            if status == 'error':
+                errors.append(reply)
+            replies.append(reply)
+
+        if errors:
+            raise RuntimeError('Error in heat pump worker process:\n%s' % errors[0])
+        return replies
+
+
+def _work(conn, design_cache_size=None):
+    """Main loop of a worker process, which calculates the heat pumps created in it."""
+    if design_cache_size is not None:
+        set_design_cache_size(design_cache_size)
+    models = {}
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+
+        try:
+            if request[0] == 'create':
+                _, eids, params, COP_m_data = request
+                for eid in eids:
+                    models[eid] = Heat_Pump(params, COP_m_data)
+                reply = None
+            else:
+                reply = {}
+                for eid, inputs in request[1]:
+                    model = models[eid]
+                    for attr, val in inputs.items():
+                        setattr(model.inputs, attr, val)
+                    model.step()
+                    reply[eid] = vars(model.state)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+        else:
+            conn.send(('ok', reply))
+    conn.close()
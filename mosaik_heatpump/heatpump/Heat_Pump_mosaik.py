@@ -1,8 +1,11 @@
+from functools import partial
 import mosaik_api
-import multiprocessing as mp
-import json
-import os
 from mosaik_heatpump.heatpump.Heat_Pump_Model import Heat_Pump
+from mosaik_heatpump.heatpump.Heat_Pump_Fleet import HeatPumpFleet
+from mosaik_heatpump.heatpump.Heat_Pump_Workers import HeatPumpWorkers
+from mosaik_heatpump.heatpump.Heat_Pump_Cache import set_design_cache_size
+from mosaik_heatpump.heatpump.Heat_Pump_Data import get_cop_table
+from mosaik_heatpump.recorder import check_config, start_recorder
 
 META = {
     'type': 'time-based',
@@ -11,18 +14,18 @@ META = {
             'public': True,
             'params': ['params'],
             'attrs': ['Q_Demand', 'Q_Supplied', 'heat_source_T', 'heat_source', 'cons_T', 'P_Required', 'COP',
-                      'cond_m', 'cond_in_T', 'T_amb', 'on_fraction', 'cond_m_neg', 'Q_evap', 'step_executed'],
+                      'cond_m', 'cond_in_T', 'T_amb', 'on_fraction', 'cond_m_neg', 'Q_evap', 'step_executed',
+                      'solve_iter', 'solve_time', 'result_cache_hit_rate'],
         },
     },
 }
 
-JSON_COP_DATA = os.path.abspath(os.path.join(os.path.dirname(__file__), 'cop_m_data.json'))
-
 class HeatPumpSimulator(mosaik_api.Simulator):
     def __init__(self):
         super().__init__(META)
         self.time_resolution = None
         self.models = dict()  # contains the model instances
+        self.fleets = []  # contains the fleets of heat pumps calculated together
         self.sid = None
         self.eid_prefix = 'HeatPump_'
         self.step_size = None
@@ -30,15 +33,25 @@ class HeatPumpSimulator(mosaik_api.Simulator):
 
         self.parallelization = False
         self.processes = 1
+        self.workers = None  # the worker processes, if the heat pumps are calculated in parallel
+        self.record = None  # the configuration of the recorder, see mosaik_heatpump.recorder
+        self.recorder = None
+        self.design_cache_size = None  # the number of design points of the 'detailed' mode kept in each process
         # start time of simulation as UTC ISO 8601 time string
 
-    def init(self, sid, time_resolution, step_size, same_time_loop=False):
+    def init(self, sid, time_resolution, step_size, same_time_loop=False, record=None, design_cache_size=None):
         self.time_resolution = float(time_resolution)
         if self.time_resolution != 1.0:
             print('WARNING: %s got a time_resolution other than 1.0, which \
                 can not be handled by this simulator.', sid)
         self.sid = sid # simulator id
         self.step_size = step_size
+        self.record = record
+        if record is not None:
+            check_config(record, sid, self.meta['models']['HeatPump']['attrs'])
+        if design_cache_size is not None:
+            set_design_cache_size(design_cache_size)
+            self.design_cache_size = design_cache_size
         if same_time_loop:
             self.meta['type'] = 'event-based'
 
@@ -47,22 +60,33 @@ class HeatPumpSimulator(mosaik_api.Simulator):
     def create(self, num, model, params):
         entities = []
 
-        if 'processes' in params:
+        if 'processes' in params and not params.get('fleet', False) and self.workers is None:
             self.parallelization = True
             self.processes = params['processes']
             if num < self.processes:
                 self.processes = num
+            self.workers = HeatPumpWorkers(self.processes, self.design_cache_size)
 
         COP_m_data = None
-        if params['calc_mode'] == 'fast' or params['calc_mode'] == 'fixed_hl':
-            with open(JSON_COP_DATA, "r") as read_file_1:
-                COP_m_data_all = json.load(read_file_1)
-                COP_m_data = COP_m_data_all[params['hp_model']]
+        if params['calc_mode'] in ('fast', 'fast_interp', 'fixed_hl'):
+            COP_m_data = get_cop_table(params['hp_model'])
+
+        fleet = None
+        if params.get('fleet', False):
+            fleet = HeatPumpFleet(params, num, COP_m_data)
+            self.fleets.append(fleet)
 
         next_eid = len(self.models)
-        for i in range(next_eid, next_eid + num):
-            eid = '%s%d' % (self.eid_prefix, i)
-            self.models[eid] = Heat_Pump(params, COP_m_data)
+        eids = ['%s%d' % (self.eid_prefix, i) for i in range(next_eid, next_eid + num)]
+        if fleet is not None:
+            models = [fleet.unit(i) for i in range(num)]
+        elif 'processes' in params and self.workers is not None:
+            models = self.workers.create(eids, params, COP_m_data)
+        else:
+            models = [Heat_Pump(params, COP_m_data) for _ in eids]
+
+        for eid, hp in zip(eids, models):
+            self.models[eid] = hp
             entities.append({'eid': eid, 'type': model})
         return entities
 
@@ -82,16 +106,22 @@ class HeatPumpSimulator(mosaik_api.Simulator):
 
             self.models[eid].inputs.step_size = self.step_size
 
-        if self.parallelization:
-            pool = mp.Pool(processes=self.processes)
-            for eid, model in self.models.items():
-                pool.apply_async(model.step(), args=())
-            pool.close()
-            pool.join()
-        else:
-            for eid, model in self.models.items():
+        for eid, model in self.models.items():
+            if isinstance(model, Heat_Pump):
                 model.step()
 
+        if self.workers is not None:
+            self.workers.step()
+
+        for fleet in self.fleets:
+            fleet.step()
+
+        if self.record is not None:
+            if self.recorder is None:
+                self.recorder = start_recorder(self.record, self.sid, self.models,
+                                               self.meta['models']['HeatPump']['attrs'], self._get_accessor)
+            self.recorder.record(time)
+
         if self.meta['type'] == 'event-based':
             return None
         else:
@@ -113,6 +143,16 @@ class HeatPumpSimulator(mosaik_api.Simulator):
                         data[eid][attr] = getattr(self.models[eid].state, attr)
         return data
 
+    def _get_accessor(self, eid, attr):
+        return partial(getattr, self.models[eid].state, attr)
+
+    def finalize(self):
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
+        if self.recorder is not None:
+            self.recorder.close()
+
 def main():
     return mosaik_api.start_simulation(HeatPumpSimulator())
 
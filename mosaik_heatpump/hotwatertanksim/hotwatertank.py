@@ -8,12 +8,21 @@ The hotwatertank module contains classes for the components of the hotwatertank
 and a class for the hotwater tank itself (:class:`HotWaterTank`).
 
 """
+import base64
+import bisect
+import copy
+import json
+import struct
 import jsonpickle
 import numpy as np
 
 C_W = 4180  # specific heat capacity of water in J/(kgK)
 RHO = 1  # density of water [kg/l]
 
+SNAPSHOT_MAGIC = b'HWTS'
+SNAPSHOT_CONNECTIONS_MAGIC = b'HWTC'
+SNAPSHOT_VERSION = 1
+
 # class HotWaterTank(object):
 class HotWaterTank():
     """
@@ -69,6 +78,24 @@ class HotWaterTank():
       structure analog to the example
     * **heating_rods**: each heating rod is specified by an dictionary with a
       structure analog to the example
+    * **solver**: optional, 'explicit' (default) to calculate the heat flows
+      with the temperatures at the beginning of the step, the step is divided
+      into smaller steps if a flow exceeds the volume of a layer, or
+      'implicit' to calculate them with the temperatures at the end of the
+      step, which is stable for any step size
+    * **mixing**: optional, 'flip' (default) to swap the temperatures of
+      layers which are warmer than the layers above them, or 'mix' to mix
+      such layers with the layers above them to their mean temperature
+      weighted by volume, which conserves the energy also for layers of
+      different volumes
+    * **merge_tol**: optional, temperature difference in K; if it is set,
+      neighbouring layers whose temperatures differ by less than merge_tol
+      are calculated as one layer in steps with flows or heating rods, except
+      at steep temperature gradients and at the layers of the connections and
+      heating rods in use and the layers their water reaches within the
+      step, so that many layers can be used where the temperature changes
+      while the uniform parts of the tank are calculated with few layers
+      (mainly faster with the 'implicit' solver)
 
     It is also possible to define layers and sensors explicitly::
 
@@ -139,6 +166,9 @@ class HotWaterTank():
     """
 
     def __init__(self, params, init_vals=None):
+        self._params = copy.deepcopy(params)
+        # parameters of the tank, written to snapshots
+        self._snapshot_header = None
         if init_vals is None:
             init_vals = {
                 'layers': {'T': 20}
@@ -151,6 +181,12 @@ class HotWaterTank():
         self.htc_layers = params['htc_layers']
         # heat transfer coefficient between layers in W/(m2K)
         self.T_env = params['T_env']  # environment temperature in °C
+        self.solver = params.get('solver', 'explicit')
+        # 'explicit' or 'implicit' integration of the layer temperatures
+        self.mixing = params.get('mixing', 'flip')
+        # 'flip' or 'mix' layers which are warmer than the layers above them
+        self.merge_tol = params.get('merge_tol')
+        # temperature difference in K below which layers are merged in a step
 
         if 'diameter' in params:
             diameter = params['diameter']  # mm
@@ -207,6 +243,8 @@ class HotWaterTank():
                 T_init = [init_vals['layers']['T']] * n_layers
 
             for idx, layer_params in enumerate(params['layers']):
+                layer_params = dict(layer_params)
+                # the parameters are not changed, as they are written to snapshots
                 if idx == 0 or idx == n_layers - 1:
                     bottom_top = True  # True for bottom and top layer
                 else:
@@ -221,6 +259,10 @@ class HotWaterTank():
         # height of each layer, used in the calculation of heat transfer between layers
         self.layer_height = self.height / n_layers / 1000
 
+        # the temperatures, volumes and outer surfaces of all layers are stored
+        # in the arrays of a LayerArrays object, the layers are views onto them
+        self.layer_arrays = LayerArrays(self.layers)
+
         # create connections
         self.connections = dict()
         if 'connections' in params:
@@ -263,118 +305,349 @@ class HotWaterTank():
         self._nested_attrs = dict()
         # dict to buffer information about nested attributes
 
+        # buffers for the layer indices, flows and temperatures of the
+        # connections in a step
+        self._flow_layers = np.zeros(len(self.connections), dtype=int)
+        self._flow_F = np.zeros(len(self.connections))
+        self._flow_T = np.zeros(len(self.connections))
+
     def step(self, step_size, adapted_step_size_mode=False):
         """Perform simulation step with step size step_size"""
+        T = self.layer_arrays.T
+        volume = self.layer_arrays.volume
 
-        # update mass flows out of the tank and into
-        # the tank
-
+        # collect mass flows out of the tank and into the tank
+        n_flows = 0
         for key, connection in self.connections.items():
 
             if not adapted_step_size_mode:
                 connection._T_buffer = []
             try:
-                if connection.F > 0:
-                    if connection.T is not None:
-                        connection.corresponding_layer.add_massflow(
-                            MassFlow(connection.F, connection.T))
-                    else:
-                        raise ValueError("temperature of input connection "
-                                         "'%s' was not set" % key)
-                else:
-                    connection.corresponding_layer.add_massflow(
-                        MassFlow(connection.F, connection.T))
+                if connection.F > 0 and connection.T is None:
+                    raise ValueError("temperature of input connection "
+                                     "'%s' was not set" % key)
+                self._flow_layers[n_flows] = connection.corresponding_layer.idx
+                self._flow_F[n_flows] = connection.F
+                self._flow_T[n_flows] = connection.T
+                n_flows += 1
             except TypeError:
                 pass
+        flow_layers = self._flow_layers[:n_flows]
+        flow_F = self._flow_F[:n_flows]
+        flow_T = self._flow_T[:n_flows]
 
-        # check mass flows
-        V_factors = []
-        for idx, layer in enumerate(self.layers):
-            V_in = layer.inflow * step_size
-            V_out = abs(layer.outflow * step_size)
-            V = max(V_in, V_out)
-            if V > layer.volume:
-                V_factors.append(V // layer.volume + (V % layer.volume > 0))
-
-                msg = ('Inflow or outflow per time step into/from layer_%d is '
-                       '%.2f l and exceeds layer volume. '
-                       'Therefore step size is adapted' % (idx, V))
-                # print(msg)
-
-        if V_factors:
-            # print(V_factors)
-            for layer in self.layers:
-                layer.empty_massflows()
-            step_size_adapted = step_size / max(V_factors)
-            for i in range(0, int(max(V_factors))):
-                self.step(step_size_adapted, adapted_step_size_mode=True)
-            return
+        for key, heating_rod in self.heating_rods.items():
+            heating_rod.update()
+        # without mass flows and heating rods, there is only heat transfer
+        # between the layers and to the environment
+        idle = not np.any(flow_F) and all(heating_rod.P_th == 0 for heating_rod
+                                          in self.heating_rods.values())
+
+        if not idle and self.solver != 'implicit':
+            # check mass flows
+            inflow = np.zeros(len(T))
+            outflow = np.zeros(len(T))
+            np.add.at(inflow, flow_layers[flow_F > 0], flow_F[flow_F > 0])
+            np.add.at(outflow, flow_layers[flow_F < 0], flow_F[flow_F < 0])
+            V = np.maximum(inflow * step_size, np.abs(outflow * step_size))
+            V_factors = [V[idx] // volume[idx] + (V[idx] % volume[idx] > 0)
+                         for idx in np.flatnonzero(V > volume)]
+            # inflow or outflow per time step exceeds layer volume, therefore
+            # step size is adapted
+
+            if V_factors:
+                step_size_adapted = step_size / max(V_factors)
+                for i in range(0, int(max(V_factors))):
+                    self.step(step_size_adapted, adapted_step_size_mode=True)
+                return
+
+        if idle:
+            self._step_without_flows(step_size)
+        else:
+            # calculate massflows between the layers, the net flow of a layer
+            # is passed on to the layer above
+            netflow_connections = np.zeros(len(T))
+            np.add.at(netflow_connections, flow_layers, flow_F)
+            netflow = np.cumsum(netflow_connections)
+            if np.any((np.abs(netflow[:-1]) <= 1e-10) & (netflow[:-1] != 0)):
+                # negligible net flows are not passed on
+                for idx in range(1, len(T)):
+                    if abs(netflow[idx - 1]) > 1e-10:
+                        netflow[idx] = netflow_connections[idx] + netflow[idx - 1]
+                    else:
+                        netflow[idx] = netflow_connections[idx]
+            if abs(netflow[-1]) > 1e-10:
+                raise ValueError("Sum of inputs and output flows doesn't "
+                                 "equal zero. Check flows!")
+            F_layers = np.where(np.abs(netflow[:-1]) > 1e-10, netflow[:-1], 0)
+
+            merged = None
+            if self.merge_tol is not None:
+                merged = self._merge_layers(step_size, flow_layers, flow_F, flow_T)
+            if merged is not None:
+                self._step_merged(step_size, flow_layers, flow_F, flow_T, F_layers,
+                                  merged)
+            else:
+                self._step_unmerged(step_size, flow_layers, flow_F, flow_T, F_layers)
 
-        # calculate massflows between the layers
-        for idx, layer in enumerate(self.layers):
-            netflow = layer.netflow
-            if netflow > 1e-10:
-                if idx == len(self.layers) - 1:
-                    raise ValueError("Sum of inputs and output flows doesn't "
-                                     "equal zero. Check flows!")
-                layer.add_massflow(MassFlow(-netflow, layer.T))
-                self.layers[idx + 1].add_massflow(MassFlow(netflow,
-                                                           layer.T))
-            elif netflow < -1e-10:
-                if idx == len(self.layers) - 1:
-                    raise ValueError("Sum of inputs and output flows doesn't "
-                                     "equal zero. Check flows!")
-                layer.add_massflow(MassFlow(-netflow,
-                                            self.layers[idx + 1].T))
-                self.layers[idx + 1].add_massflow(MassFlow(netflow,
-                                                           self.layers[idx + 1].T))
+        # flip temperature if temperature of lower layer is higher, or mix
+        # the layers
+        if self.mixing == 'mix':
+            _mix_layers(T, self.layer_arrays.volume)
+            self.layer_arrays.update_monotonic()
+        else:
+            T.sort()
+            self.layer_arrays.monotonic = True
 
-        # calculate heatflow to environment
-        for idx, layer in enumerate(self.layers):
+        # update connections
+        for key, connection in self.connections.items():
+            connection.update(adapted_step_size_mode)
 
-            heatflow = ((self.T_env - layer.T) * layer.outer_surface *
-                        self.htc_walls)
-            layer.add_heatflow(heatflow)
+    def _step_explicit(self, step_size, flow_layers, flow_F, flow_T, F_layers,
+                       layers=None, layer_height=None, heating_rods=None,
+                       T=None, T_env=None):
+        """
+        Updates the temperatures of the layers with the heat flows at the
+        beginning of the step.
+
+        By default, the layers of the tank are calculated. Otherwise *layers*
+        is a :class:`LayerArrays` object, *layer_height* the distances between
+        the layers in m and *heating_rods* the layer index and the thermal
+        power output of each heating rod.
+
+        The temperatures *T* of the layers (by default those of *layers*) may
+        also be an array of the shape (number of tanks, number of layers) for
+        tanks with the same parameters, like in
+        :class:`.hotwatertank_batch.HotWaterTankBatch`. Then the arguments of
+        the flows and *F_layers* have a row for each tank, the environment
+        temperatures *T_env* are a column and the thermal power outputs of the
+        heating rods are arrays.
+        """
+        layers, layer_height, heating_rods, T, T_env = self._kernel_args(
+            layers, layer_height, heating_rods, T, T_env)
+        T_layers = np.where(F_layers > 0, T[..., :-1], T[..., 1:])
+
+        # energy carried by the mass flows
+        delta_Q = np.zeros(T.shape)
+        _add_at(delta_Q, flow_layers,
+                flow_F * step_size * RHO * (flow_T + 273) * C_W)
+        Q_layers = F_layers * step_size * RHO * (T_layers + 273) * C_W
+        delta_Q[..., 1:] += Q_layers
+        delta_Q[..., :-1] -= Q_layers
+
+        # calculate heatflow to environment
+        delta_Q += ((T_env - T) * layers.outer_surface *
+                    self.htc_walls) * step_size
 
         # calculate heatflow caused by heating rods
-        for key, heating_rod in self.heating_rods.items():
-            heating_rod.update()
-            heating_rod.corresponding_layer.add_heatflow(heating_rod.P_th)
+        for idx, P_th in heating_rods:
+            delta_Q[..., idx] += P_th * step_size
 
         # calculate heatflow between layers
-        for layer, upper_layer in zip(self.layers[:-1], self.layers[1:]):
-            heatflow = ((layer.T - upper_layer.T)
-                        * self.surface_between_layers * self.htc_layers) / self.layer_height
-            upper_layer.add_heatflow(heatflow)
-            layer.add_heatflow(-heatflow)
+        heatflow = ((T[..., :-1] - T[..., 1:])
+                    * self.surface_between_layers * self.htc_layers) / layer_height
+        delta_Q[..., 1:] += heatflow * step_size
+        delta_Q[..., :-1] -= heatflow * step_size
 
         # update temperature of layers
-        for layer in self.layers:
-            m = layer.volume * RHO
-            delta_Q = 0
-            for massflow in layer.massflows:
-                delta_Q += (massflow.F * step_size * RHO * (massflow.T + 273)
-                            * C_W)
-            for heatflow in layer.heatflows:
-                delta_Q += heatflow * step_size
-            layer.T += delta_Q / (m * C_W)
-            layer.empty_massflows()
-            layer.empty_heatflows()
-
-        # flip temperature if temperature of lower layer is higher
-        n_flips = 1
-        while n_flips > 0:
-            n_flips = 0
-            for layer, lower_layer in zip(self.layers[1:], self.layers[:-1]):
-                if layer.T < lower_layer.T:
-                    n_flips += 1  # count number of flip operations
-                    T_buffer = layer.T
-                    layer.T = lower_layer.T
-                    lower_layer.T = T_buffer
+        T += delta_Q / (layers.volume * RHO * C_W)
+
+    def _step_implicit(self, step_size, flow_layers, flow_F, flow_T, F_layers,
+                       layers=None, layer_height=None, heating_rods=None,
+                       T=None, T_env=None):
+        """
+        Updates the temperatures of the layers with the heat flows at the end
+        of the step (backward Euler), so that the step is stable for any step
+        size and mass flow.
+
+        Water leaving a layer, through an output connection or to a
+        neighbouring layer, has the temperature of the layer at the end of the
+        step. This leads to a tridiagonal system of equations for the new
+        temperatures, whose solution conserves the energy of the tank.
+
+        The arguments *layers*, *layer_height*, *heating_rods*, *T* and
+        *T_env* are the same as those of :meth:`_step_explicit`.
+        """
+        layers, layer_height, heating_rods, T, T_env = self._kernel_args(
+            layers, layer_height, heating_rods, T, T_env)
+        c = RHO * C_W
+        UA = layers.outer_surface * self.htc_walls
+        K = self.surface_between_layers * self.htc_layers / layer_height
+        F_up = np.maximum(F_layers, 0)  # flow from layer j to layer j+1
+        F_down = np.maximum(-F_layers, 0)  # flow from layer j+1 to layer j
+
+        diagonal = np.zeros(T.shape) + (layers.volume * c / step_size + UA)
+        rhs = layers.volume * c / step_size * T + UA * T_env
+
+        # input connections
+        inlet = flow_F > 0
+        _add_at(rhs, flow_layers, np.where(inlet, c * flow_F * flow_T, 0))
+        # output connections
+        _add_at(diagonal, flow_layers, np.where(inlet, 0, -c * flow_F))
+
+        # heating rods
+        for idx, P_th in heating_rods:
+            rhs[..., idx] += P_th
+
+        # mass flows and heat flows between the layers
+        diagonal[..., :-1] += c * F_up + K
+        diagonal[..., 1:] += c * F_down + K
+        lower = -(c * F_up + K)
+        upper = -(c * F_down + K)
+
+        T[...] = _solve_tridiagonal(lower, diagonal, upper, rhs)
+
+    def _kernel_args(self, layers, layer_height, heating_rods, T=None, T_env=None):
+        if layers is None:
+            layers = self.layer_arrays
+            layer_height = self.layer_height
+        if heating_rods is None:
+            heating_rods = [(heating_rod.corresponding_layer.idx, heating_rod.P_th)
+                            for heating_rod in self.heating_rods.values()]
+        if T is None:
+            T = layers.T
+        if T_env is None:
+            T_env = self.T_env
+        return layers, layer_height, heating_rods, T, T_env
+
+    def _merge_layers(self, step_size, flow_layers, flow_F, flow_T):
+        """
+        Merges neighbouring layers, whose temperatures differ by less than
+        *merge_tol*, for the calculation of a step.
+
+        Layers with a steep temperature gradient to a neighbouring layer,
+        layers into which water flows with a different temperature and layers
+        with heating rods in operation are not merged, nor are the layers
+        which the water of these layers can reach within the step, so that
+        the thermocline is not smeared by merged layers. Returns None, if no
+        layers are merged, otherwise a :class:`LayerArrays` object with the
+        merged layers, the index of the merged layer of each layer, the index
+        of the first layer of each merged layer and the distances between the
+        merged layers in m.
+        """
+        T = self.layer_arrays.T
+        tol = self.merge_tol
+        fixed = np.zeros(len(T), dtype=bool)
+        inlet = flow_F > 0
+        fixed[flow_layers[inlet]] = np.abs(flow_T[inlet] - T[flow_layers[inlet]]) >= tol
+        fixed[flow_layers[flow_F < 0]] = True
+        for heating_rod in self.heating_rods.values():
+            if heating_rod.P_th != 0:
+                fixed[heating_rod.corresponding_layer.idx] = True
+        steep = np.abs(T[1:] - T[:-1]) >= tol
+        fixed[1:] |= steep
+        fixed[:-1] |= steep
+        reach = int(np.ceil(2 * np.sum(flow_F[inlet]) * step_size
+                            / np.min(self.layer_arrays.volume)))
+        if reach > 0:
+            # layers with a fixed layer at most reach layers away
+            n_fixed = np.concatenate(([0], np.cumsum(fixed)))
+            idx = np.arange(len(T))
+            fixed = (n_fixed[np.minimum(idx + reach + 1, len(T))]
+                     > n_fixed[np.maximum(idx - reach, 0)])
+        # a merged layer begins, where the temperature interval of the width
+        # merge_tol changes
+        T_interval = np.floor(T / tol)
+        first = np.ones(len(T), dtype=bool)
+        first[1:] = (T_interval[1:] != T_interval[:-1]) | fixed[1:] | fixed[:-1]
+        starts = np.flatnonzero(first)
+        if len(starts) == len(T):
+            return None
+
+        ends = np.append(starts[1:], len(T)) - 1
+        merged_idx = np.cumsum(first) - 1
+        merged = LayerArrays([])
+        merged.volume = np.add.reduceat(self.layer_arrays.volume, starts)
+        merged.outer_surface = np.add.reduceat(self.layer_arrays.outer_surface, starts)
+        merged.T = np.add.reduceat(self.layer_arrays.volume * T, starts) / merged.volume
+        centers = (self.layer_arrays.bottom[starts] + self.layer_arrays.top[ends]) / 2
+        return merged, merged_idx, starts, np.diff(centers) / 1000
+
+    def _step_merged(self, step_size, flow_layers, flow_F, flow_T, F_layers, merged):
+        """
+        Updates the temperatures of the layers, whereby the layers merged by
+        :meth:`_merge_layers` are calculated as one layer with their mean
+        temperature weighted by volume. Afterwards, each layer gets the
+        temperature of its merged layer, so that the energy of the tank is
+        conserved.
+        """
+        merged_layers, merged_idx, starts, layer_height = merged
+        heating_rods = [(merged_idx[heating_rod.corresponding_layer.idx], heating_rod.P_th)
+                        for heating_rod in self.heating_rods.values()]
+        args = (step_size, merged_idx[flow_layers], flow_F, flow_T,
+                F_layers[starts[1:] - 1], merged_layers, layer_height, heating_rods)
+        if self.solver == 'implicit':
+            self._step_implicit(*args)
+        else:
+            self._step_explicit(*args)
+        self.layer_arrays.T[:] = merged_layers.T[merged_idx]
 
-        # update connections
-        for key, connection in self.connections.items():
-            connection.update(adapted_step_size_mode)
+    def _step_unmerged(self, step_size, flow_layers, flow_F, flow_T, F_layers):
+        if self.solver == 'implicit':
+            self._step_implicit(step_size, flow_layers, flow_F, flow_T, F_layers)
+        else:
+            self._step_explicit(step_size, flow_layers, flow_F, flow_T, F_layers)
+
+    def _step_without_flows(self, step_size, T=None, T_env=None):
+        """
+        Updates the temperatures of the layers in a step without mass flows
+        and heating rods with the propagator of the step size (see
+        :meth:`_propagator`). *T* and *T_env* may be given for several tanks
+        like in :meth:`_step_explicit`.
+        """
+        if T is None:
+            T = self.layer_arrays.T
+            T_env = self.T_env
+        propagator = self._propagator(step_size)
+        if self.solver == 'implicit':
+            matrix, gain = propagator
+            T[...] = T @ matrix.T + gain * T_env
+        else:
+            diagonal, lower, upper, gain = propagator
+            T_new = diagonal * T + gain * T_env
+            T_new[..., 1:] += lower * T[..., :-1]
+            T_new[..., :-1] += upper * T[..., 1:]
+            T[...] = T_new
+
+    def _propagator(self, step_size):
+        """
+        Returns the propagator of a step without mass flows and heating rods,
+        which is linear in the temperatures of the layers and the environment
+        temperature.
+
+        For the explicit solver, these are the coefficients of the temperature
+        of each layer, the layer below and the layer above and of the
+        environment temperature in the new temperature of the layer. For the
+        implicit solver, these are the inverse of the matrix of the system of
+        equations, multiplied with the heat capacities per step size, and the
+        coefficients of the environment temperature.
+
+        The propagator is calculated again only if the step size or the
+        heat transfer coefficients change.
+        """
+        key = (step_size, self.htc_walls, self.htc_layers, self.solver)
+        if getattr(self, '_propagator_key', None) == key:
+            return self._propagator_cache
+
+        c = RHO * C_W
+        UA = self.layer_arrays.outer_surface * self.htc_walls
+        K = self.surface_between_layers * self.htc_layers / self.layer_height
+        capacity = self.layer_arrays.volume * c / step_size
+        neighbours = np.zeros(len(capacity))  # number of neighbouring layers
+        neighbours[1:] += 1
+        neighbours[:-1] += 1
+        if self.solver == 'implicit':
+            matrix = (np.diag(capacity + UA + K * neighbours)
+                      - np.diag(np.full(len(capacity) - 1, K), 1)
+                      - np.diag(np.full(len(capacity) - 1, K), -1))
+            propagator = (np.linalg.solve(matrix, np.diag(capacity)),
+                          np.linalg.solve(matrix, UA))
+        else:
+            propagator = (1 - (UA + K * neighbours) / capacity,
+                          K / capacity[1:], K / capacity[:-1], UA / capacity)
+        self._propagator_key = key
+        self._propagator_cache = propagator
+        return propagator
 
     def get_nested_attr(self, nested_attr):
         try:
@@ -395,20 +668,150 @@ class HotWaterTank():
 
     @property
     def snapshot(self):
-        """serialize to json"""
-        return jsonpickle.encode(self)
+        """
+        serialize to a compact binary format, encoded as base64 string
+
+        The snapshot contains the parameters of the tank, which are encoded
+        only once, and its state (see :meth:`_get_state`) as float64 numbers.
+        It is restored with :meth:`from_snapshot`.
+        """
+        if self._snapshot_header is None:
+            self._snapshot_header = json.dumps(self._params).encode()
+        return _encode_snapshot(SNAPSHOT_MAGIC, self._snapshot_header,
+                                self._get_state())
 
     @property
     def snapshot_connections(self):
-        """serialize connections to json"""
-        return jsonpickle.encode(self.connections)
+        """
+        serialize the state of the connections to a compact binary format,
+        encoded as base64 string, it is restored with
+        :meth:`restore_connections`
+        """
+        return _encode_snapshot(SNAPSHOT_CONNECTIONS_MAGIC, b'',
+                                self._get_connections_state())
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Creates a hotwater tank from a *snapshot*."""
+        header, state = _decode_snapshot(SNAPSHOT_MAGIC, snapshot)
+        hwt = cls(json.loads(header.decode()))
+        hwt._snapshot_header = header
+        hwt._set_state(state)
+        return hwt
+
+    @classmethod
+    def from_legacy_snapshot(cls, snapshot):
+        """
+        Creates a hotwater tank from a *snapshot* of an earlier version,
+        serialized with jsonpickle. The objects of the snapshot are decoded
+        as plain objects, from which the parameters and the state of the tank
+        are rebuilt.
+        """
+        classes = {'mosaik_heatpump.hotwatertanksim.hotwatertank.%s' % name: _LegacyObject
+                   for name in ('HotWaterTank', 'Layer', 'Connection', 'Sensor', 'HeatingRod')}
+        try:
+            legacy = jsonpickle.decode(snapshot, keys=False, classes=classes)
+            layers = legacy.layers
+            params = {
+                'height': legacy.height,
+                'diameter': 2e3 * (legacy.surface_between_layers / np.pi) ** 0.5,
+                'T_env': legacy.T_env,
+                'htc_walls': legacy.htc_walls,
+                'htc_layers': legacy.htc_layers,
+                'layers': [{'bottom': layer.bottom, 'top': layer.top} for layer in layers],
+                'sensors': {key: {'pos': sensor.pos} for key, sensor in legacy.sensors.items()},
+                'connections': {key: {'pos': connection.pos}
+                                for key, connection in legacy.connections.items()},
+                'heating_rods': {key: {'pos': heating_rod.pos, 'T_max': heating_rod.T_max,
+                                       'P_th_stages': np.asarray(heating_rod.P_th_stages).tolist(),
+                                       'eta': heating_rod.eta}
+                                 for key, heating_rod in legacy.heating_rods.items()},
+            }
+            connections = []
+            for connection in legacy.connections.values():
+                T_out = (sum(connection._T_buffer) / len(connection._T_buffer)
+                         if connection._T_buffer else None)
+                idx = [layer is connection.corresponding_layer for layer in layers].index(True)
+                connections.append([connection._F, connection._T, T_out, idx])
+            rods = [[heating_rod.P_th_set, heating_rod.P_el, heating_rod.P_th]
+                    for heating_rod in legacy.heating_rods.values()]
+            state = np.concatenate((
+                [legacy.T_env], [layer.T for layer in layers],
+                np.array(connections, dtype=float).ravel(),
+                np.array(rods, dtype=float).ravel()))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError('Invalid snapshot of an earlier version: %r' % e)
+        hwt = cls(params)
+        hwt._set_state(state)
+        return hwt
+
+    def clone(self):
+        """Returns a copy of the hotwater tank with the same state."""
+        hwt = HotWaterTank(self._params)
+        hwt._snapshot_header = self._snapshot_header
+        hwt._set_state(self._get_state())
+        return hwt
+
+    def restore_connections(self, snapshot_connections):
+        """Restores the state of the connections from
+        *snapshot_connections*."""
+        header, state = _decode_snapshot(SNAPSHOT_CONNECTIONS_MAGIC,
+                                         snapshot_connections)
+        self._set_connections_state(state)
+
+    def _get_state(self):
+        """
+        Returns the state of the tank as array: the environment temperature,
+        the temperatures of the layers, the state of the connections (see
+        :meth:`_get_connections_state`) and the set value, the el. power and
+        the thermal power of each heating rod. Missing values are NaN.
+        """
+        rods = [[heating_rod.P_th_set, heating_rod.P_el, heating_rod.P_th]
+                for heating_rod in self.heating_rods.values()]
+        return np.concatenate((
+            [self.T_env], self.layer_arrays.T, self._get_connections_state(),
+            np.array(rods, dtype=float).ravel()))
+
+    def _set_state(self, state):
+        n_layers = len(self.layers)
+        n_connections = 4 * len(self.connections)
+        self.T_env = float(state[0])
+        self.layer_arrays.T[:] = state[1:1 + n_layers]
+        self.layer_arrays.update_monotonic()
+        self._set_connections_state(
+            state[1 + n_layers:1 + n_layers + n_connections])
+        rods = state[1 + n_layers + n_connections:].reshape(-1, 3).tolist()
+        for heating_rod, values in zip(self.heating_rods.values(), rods):
+            heating_rod.P_th_set, heating_rod.P_el, heating_rod.P_th = [
+                None if value != value else value for value in values]
+            heating_rod._update_key = None
+
+    def _get_connections_state(self):
+        """
+        Returns the state of the connections as array: the flow, the set
+        temperature, the mean temperature of the outflow during the last step
+        and the index of the corresponding layer of each connection.
+        """
+        values = []
+        for connection in self.connections.values():
+            T_out = (sum(connection._T_buffer) / len(connection._T_buffer)
+                     if connection._T_buffer else None)
+            values.append([connection._F, connection._T, T_out,
+                           connection.corresponding_layer.idx])
+        return np.array(values, dtype=float).ravel()
+
+    def _set_connections_state(self, state):
+        values = state.reshape(-1, 4).tolist()
+        for connection, (F, T, T_out, idx) in zip(self.connections.values(),
+                                                  values):
+            connection._F = None if F != F else F
+            connection._T = None if T != T else T
+            connection._T_buffer = [] if T_out != T_out else [T_out]
+            connection.corresponding_layer = self.layers[int(idx)]
 
     @property
     def T_layers(self):
-        T_layers = []
-        for layer in self.layers:
-            T_layers.append(layer.T)
-        return T_layers
+        return self.layer_arrays.T.tolist()
 
     @property
     def T_sensors(self):
@@ -421,12 +824,125 @@ class HotWaterTank():
     def T_mean(self):
         """Returns mean temperature of hotwatertank in °C"""
         T_sum = 0
-        for layer in self.layers:
-            T_sum += layer.T
+        for T in self.layer_arrays.T.tolist():
+            T_sum += T
         T_mean = T_sum / len(self.layers)
         return T_mean
 
 
+def _encode_snapshot(magic, header, state):
+    """
+    Encodes a snapshot: *magic*, the version, the length of the *header*, the
+    *header* and the *state* array as little endian float64 numbers.
+    """
+    data = (magic + struct.pack('<BI', SNAPSHOT_VERSION, len(header)) + header
+            + np.asarray(state, dtype='<f8').tobytes())
+    return base64.b64encode(data).decode('ascii')
+
+
+class _LegacyObject(object):
+    """Plain object, as which the objects of a snapshot of an earlier version are decoded."""
+
+
+def _decode_snapshot(magic, snapshot):
+    """Returns the header and the state array of a snapshot."""
+    data = base64.b64decode(snapshot)
+    if data[:4] != magic:
+        raise ValueError('Invalid snapshot')
+    version, n_header = struct.unpack_from('<BI', data, 4)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported snapshot version %d' % version)
+    offset = 4 + struct.calcsize('<BI')
+    header = data[offset:offset + n_header]
+    state = np.frombuffer(data, dtype='<f8', offset=offset + n_header)
+    return header, state.astype(float)
+
+
+def _add_at(array, flow_layers, values):
+    """
+    Adds the *values* of the flows to the layers *flow_layers* of the
+    *array* of the layers, like :func:`numpy.add.at`, also for arrays with a
+    row for each tank.
+    """
+    if array.ndim == 1:
+        np.add.at(array, flow_layers, values)
+        return
+    n_layers = array.shape[-1]
+    rows = np.arange(array.size // n_layers).reshape(array.shape[:-1] + (1,))
+    np.add.at(array.reshape(-1), (flow_layers + rows * n_layers).ravel(),
+              np.broadcast_to(values, flow_layers.shape).ravel())
+
+
+def _solve_tridiagonal(lower, diagonal, upper, rhs):
+    """
+    Solves the tridiagonal system of equations with the sub-diagonal *lower*,
+    the main diagonal *diagonal* and the super-diagonal *upper* for the right
+    hand side *rhs* (Thomas algorithm). For arrays with a row for each tank,
+    the system of each row is solved.
+    """
+    if diagonal.ndim > 1:
+        return _solve_tridiagonal_rows(lower, diagonal, upper, rhs)
+    lower = lower.tolist()
+    upper = upper.tolist()
+    diagonal = diagonal.tolist()
+    rhs = rhs.tolist()
+    n = len(diagonal)
+    for i in range(1, n):
+        w = lower[i - 1] / diagonal[i - 1]
+        diagonal[i] -= w * upper[i - 1]
+        rhs[i] -= w * rhs[i - 1]
+    x = [0.0] * n
+    x[-1] = rhs[-1] / diagonal[-1]
+    for i in range(n - 2, -1, -1):
+        x[i] = (rhs[i] - upper[i] * x[i + 1]) / diagonal[i]
+    return x
+
+
+def _solve_tridiagonal_rows(lower, diagonal, upper, rhs):
+    """
+    Solves the tridiagonal systems of equations of the rows of the arrays
+    like :func:`_solve_tridiagonal`, all rows at once.
+    """
+    diagonal = diagonal.copy()
+    rhs = rhs.copy()
+    n = diagonal.shape[-1]
+    for i in range(1, n):
+        w = lower[..., i - 1] / diagonal[..., i - 1]
+        diagonal[..., i] -= w * upper[..., i - 1]
+        rhs[..., i] -= w * rhs[..., i - 1]
+    x = np.zeros(diagonal.shape)
+    x[..., -1] = rhs[..., -1] / diagonal[..., -1]
+    for i in range(n - 2, -1, -1):
+        x[..., i] = (rhs[..., i] - upper[..., i] * x[..., i + 1]) / diagonal[..., i]
+    return x
+
+
+def _mix_layers(T, volume):
+    """
+    Mixes layers, which are warmer than the layers above them, in place, so
+    that the temperatures *T* of the layers with the volumes *volume* don't
+    decrease from the bottom to the top.
+
+    Neighbouring layers are merged into blocks with the mean temperature of
+    the layers weighted by their volumes (pool adjacent violators), which
+    takes a single pass over the layers.
+    """
+    if np.all(T[1:] >= T[:-1]):
+        return
+    blocks = []  # [energy (V * T), volume, number of layers] of each block
+    for T_layer, V_layer in zip(T.tolist(), volume.tolist()):
+        block = [T_layer * V_layer, V_layer, 1]
+        while blocks and blocks[-1][0] * block[1] > block[0] * blocks[-1][1]:
+            # the block below is warmer
+            below = blocks.pop()
+            block = [below[0] + block[0], below[1] + block[1], below[2] + block[2]]
+        blocks.append(block)
+    idx = 0
+    for energy, V, n in blocks:
+        T[idx:idx + n] = energy / V
+        idx += n
+
+
 class Layer(object):
     """
     Layer of hotwater tank
@@ -447,47 +963,109 @@ class Layer(object):
           surface of the layer which in turn is needed to calculate heat losses
           to the environment.
 
+    The temperature, the volume and the outer surface of the layer are stored
+    in the arrays of a :class:`LayerArrays` object at the index *idx*. A new
+    layer has its own arrays, until it becomes part of a hotwater tank.
+
     """
 
     def __init__(self, params):
-        self.T = params['T']  # °C
         self.bottom = params['bottom']  # mm
         self.top = params['top']  # mm
         diameter = params['diameter']  # mm
-        self.outer_surface = np.pi * diameter / 1e3 * (self.top
-                            - self.bottom) / 1e3 + np.pi * (diameter
-                            / 2e3) ** 2 * params['bottom_top']  # m2
-        self.volume = np.pi * (diameter / 200) ** 2 * (self.top -
-                                                       self.bottom) / 100  # liters
-        self.massflows = []
-        self.heatflows = []
+        outer_surface = np.pi * diameter / 1e3 * (self.top
+                        - self.bottom) / 1e3 + np.pi * (diameter
+                        / 2e3) ** 2 * params['bottom_top']  # m2
+        volume = np.pi * (diameter / 200) ** 2 * (self.top -
+                                                  self.bottom) / 100  # liters
+        self.arrays = LayerArrays([])
+        self.arrays.T = np.array([params['T']], dtype=float)
+        self.arrays.volume = np.array([volume])
+        self.arrays.outer_surface = np.array([outer_surface])
+        self.arrays.bottom = np.array([self.bottom], dtype=float)
+        self.arrays.top = np.array([self.top], dtype=float)
+        self.idx = 0
 
-    def add_massflow(self, massflow):
-        if massflow.F != None:
-            self.massflows.append(massflow)
+    @property
+    def T(self):  # temperature in °C
+        return float(self.arrays.T[self.idx])
 
-    def add_heatflow(self, heatflow):
-        self.heatflows.append(heatflow)
+    @T.setter
+    def T(self, value):
+        self.arrays.T[self.idx] = value
+        self.arrays.monotonic = False
 
-    def empty_massflows(self):
-        self.massflows = []
+    @property
+    def volume(self):  # volume in liters
+        return float(self.arrays.volume[self.idx])
 
-    def empty_heatflows(self):
-        self.heatflows = []
+    @volume.setter
+    def volume(self, value):
+        self.arrays.volume[self.idx] = value
 
     @property
-    def inflow(self):
-        return sum([massflow.F for massflow in self.massflows
-                    if massflow.F > 0])
+    def outer_surface(self):  # outer surface in m2
+        return float(self.arrays.outer_surface[self.idx])
 
-    @property
-    def outflow(self):
-        return sum([massflow.F for massflow in self.massflows
-                    if massflow.F < 0])
+    @outer_surface.setter
+    def outer_surface(self, value):
+        self.arrays.outer_surface[self.idx] = value
 
-    @property
-    def netflow(self):
-        return sum([massflow.F for massflow in self.massflows])
+
+class LayerArrays(object):
+    """
+    Temperatures (*T*), volumes (*volume*), outer surfaces
+    (*outer_surface*), bottoms (*bottom*) and tops (*top*) of the *layers* of
+    a hotwater tank, from the undermost to the uppermost layer, as numpy
+    arrays.
+
+    The layers become views onto the arrays. The arrays are changed in place
+    only, so that the views stay valid. *monotonic* is True, if the
+    temperatures are known not to decrease from the bottom to the top, which
+    is the case after each step of the tank.
+
+    """
+
+    def __init__(self, layers):
+        self.T = np.array([layer.T for layer in layers], dtype=float)
+        self.volume = np.array([layer.volume for layer in layers], dtype=float)
+        self.outer_surface = np.array([layer.outer_surface for layer in layers],
+                                      dtype=float)
+        self.bottom = np.array([layer.bottom for layer in layers], dtype=float)
+        self.top = np.array([layer.top for layer in layers], dtype=float)
+        for idx, layer in enumerate(layers):
+            layer.arrays = self
+            layer.idx = idx
+        self.update_monotonic()
+
+    def update_monotonic(self):
+        """Checks whether the temperatures don't decrease from the bottom to
+        the top."""
+        self.monotonic = bool(np.all(self.T[1:] >= self.T[:-1]))
+
+    def layer_at(self, pos):
+        """Returns the index of the layer at the position *pos*, or None if
+        there is no layer at this position."""
+        idx = int(np.searchsorted(self.top, pos, side='right'))
+        if idx < len(self.top) and self.bottom[idx] <= pos:
+            return idx
+        return None
+
+    def closest_layer(self, T):
+        """
+        Returns the index of the (undermost) layer whose temperature is closest
+        to *T*. If the temperatures are monotonic, the layer is found by
+        bisection.
+        """
+        T_layers = self.T
+        if not self.monotonic or T != T:
+            return int(np.argmin(np.abs(T - T_layers)))
+        idx = int(np.searchsorted(T_layers, T))
+        if idx == len(T_layers) or (idx > 0 and abs(T - T_layers[idx - 1])
+                                    <= abs(T - T_layers[idx])):
+            # undermost layer with the temperature of the layer below
+            idx = int(np.searchsorted(T_layers, T_layers[idx - 1]))
+        return idx
 
 
 class Sensor(object):
@@ -503,10 +1081,10 @@ class Sensor(object):
     def __init__(self, params, layers):
         self.pos = params['pos']  # mm
         # determine corresponding layer
-        for layer in layers:
-            if layer.bottom <= self.pos < layer.top:
-                self.corresponding_layer = layer
-                # reference to corresponding layer
+        idx = layers[0].arrays.layer_at(self.pos)
+        if idx is not None:
+            self.corresponding_layer = layers[idx]
+            # reference to corresponding layer
 
     @property
     def T(self):  # temperature in °C
@@ -534,9 +1112,9 @@ class Connection(object):
         self._T = None  # °C
         self._T_buffer = []  # °C
         self.corresponding_layer = None  # reference to corresponding layer
-        for idx, layer in enumerate(self.layers):
-            if layer.bottom <= self.pos < layer.top:
-                self.corresponding_layer_pos = layer
+        idx = self.layers[0].arrays.layer_at(self.pos)
+        if idx is not None:
+            self.corresponding_layer_pos = self.layers[idx]
         self.update()
 
     def update(self, adapted_step_size_mode=False):
@@ -546,12 +1124,10 @@ class Connection(object):
                 if adapted_step_size_mode:
                     self._T_buffer.append(self.corresponding_layer.T)
             else:  # if self.F > 0:
-                delta_T_min = float('Inf')  # smallest difference so far
-                for idx, layer in enumerate(self.layers):
-                    delta_T = abs(self._T - layer.T)
-                    if delta_T < delta_T_min:
-                        delta_T_min = delta_T
-                        idx_min = idx
+                # layer with the smallest temperature difference
+                if self._T is None:
+                    raise TypeError
+                idx_min = self.layers[0].arrays.closest_layer(self._T)
                 self.corresponding_layer = self.layers[idx_min]
         except TypeError:
             self.corresponding_layer = self.corresponding_layer_pos
@@ -596,21 +1172,13 @@ class Connection(object):
             self.update()
 
 
-class MassFlow(object):
-    """Massflow"""
-
-    def __init__(self, F, T):
-        self.F = F
-        self.T = T
-
-
 class HeatingRod(object):
     """
 
     Heating rod integrated into to the hotwater tank.
 
     Heating rods are characterized by their position above tank level and their
-    power stages. Efficiency is assumed to be constantly 100%.
+    power stages in ascending order. Efficiency is assumed to be constantly 100%.
 
     """
 
@@ -618,11 +1186,15 @@ class HeatingRod(object):
         self.pos = params['pos']
         self.T_max = params['T_max']
         self.P_th_stages = np.array(params['P_th_stages'])  # power stages in W
+        self._stages = self.P_th_stages.tolist()
+        self._midpoints = ((self.P_th_stages[1:] + self.P_th_stages[:-1]) / 2).tolist()
+        # power stages and midpoints between them for the selection of a stage
+        self._update_key = None
+        # set value and temperature condition of the last update
         self.eta = params['eta'] # efficiency of the electric heater
-        for idx, layer in enumerate(layers):
-            if layer.bottom <= self.pos < layer.top:
-                self.corresponding_layer = layer
-                break
+        idx = layers[0].arrays.layer_at(self.pos)
+        if idx is not None:
+            self.corresponding_layer = layers[idx]
         # find corresponding layer
         self.P_th_set = None  # set value for thermal power output in W
         self.P_el = None  # electric power consumption in W
@@ -635,14 +1207,24 @@ class HeatingRod(object):
                     raise AttributeError("init_val %s doesn't match any attribute" % attr)
 
     def update(self):
-        if self.corresponding_layer.T < self.T_max:
-            idx = np.argmin(abs(self.P_th_stages - self.P_th_set))
-            # find closest power stage
-            self.P_th = self.P_th_stages[idx]
+        """
+        Sets the thermal power output to the power stage closest to P_th_set,
+        or to 0 if the layer has reached T_max. The stage is only selected
+        again, if P_th_set or the temperature condition has changed since the
+        last update.
+        """
+        on = bool(self.corresponding_layer.T < self.T_max)
+        key = (self.P_th_set, on)
+        if key == self._update_key:
+            return
+        if on:
+            # find closest power stage, the lower one at the midpoint
+            self.P_th = self._stages[bisect.bisect_left(self._midpoints, self.P_th_set)]
             self.P_el = -self.P_th/self.eta
         else:
             self.P_th = 0
             self.P_el = 0
+        self._update_key = key
 
     @property
     def P_th_min(self):
@@ -657,5 +1239,38 @@ class HeatingRod(object):
         return self.corresponding_layer.T
 
 
-
-
+def update_heating_rods(heating_rods, T):
+    """
+    Updates the heating rods *heating_rods* like :meth:`HeatingRod.update`,
+    whereby the power stages are selected for all heating rods with the same
+    stages at once. *T* are the temperatures of the layers of the heating
+    rods. Returns the thermal power outputs of the heating rods as array.
+    """
+    T = np.asarray(T, dtype=float)
+    P_th = np.zeros(len(heating_rods))
+    groups = dict()
+    for i, heating_rod in enumerate(heating_rods):
+        if heating_rod.P_th_set is None:
+            heating_rod.update()
+            P_th[i] = heating_rod.P_th
+        else:
+            groups.setdefault(tuple(heating_rod._stages), []).append(i)
+
+    for stages, rods in groups.items():
+        rods = np.array(rods)
+        rod = heating_rods[rods[0]]
+        P_th_set = np.array([heating_rods[i].P_th_set for i in rods.tolist()],
+                            dtype=float)
+        on = T[rods] < np.array([heating_rods[i].T_max for i in rods.tolist()])
+        # find closest power stage, the lower one at the midpoint
+        stage = np.searchsorted(rod._midpoints, P_th_set, side='left')
+        P_th[rods] = np.where(on, np.array(stages, dtype=float)[stage], 0)
+        P_el = np.where(on, -P_th[rods] / np.array(
+            [heating_rods[i].eta for i in rods.tolist()]), 0)
+        for i, rod_P_th, rod_P_el, rod_on in zip(
+                rods.tolist(), P_th[rods].tolist(), P_el.tolist(), on.tolist()):
+            heating_rod = heating_rods[i]
+            heating_rod.P_th = rod_P_th
+            heating_rod.P_el = rod_P_el
+            heating_rod._update_key = (heating_rod.P_th_set, rod_on)
+    return P_th
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+The hotwatertank_batch module contains a batch of hotwater tanks with the same
+parameters, which are calculated together in each step
+(:class:`HotWaterTankBatch`).
+
+"""
+import numpy as np
+
+from mosaik_heatpump.hotwatertanksim.hotwatertank import (
+    HotWaterTank, _mix_layers, update_heating_rods)
+
+
+class HotWaterTankBatch(object):
+    """
+    Hotwater tanks with the same *params*, whose layers are calculated
+    together in each step.
+
+    The tanks are :class:`.hotwatertank.HotWaterTank` objects, whose
+    connections, sensors and heating rods are accessed as usual. The
+    temperatures of their layers are the rows of the array *T* with the shape
+    (number of tanks, number of layers), so that the temperatures of all
+    tanks are updated at once. Tanks whose flows exceed the volume of a layer
+    in a step are calculated on their own with smaller steps, like a single
+    tank. The results are the same as those of single tanks without
+    *merge_tol*, which is not used by the batch.
+
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.tanks = []
+        self.T = np.zeros((0, 0))
+
+    def add(self, num, init_vals=None):
+        """Creates *num* tanks with the initial values *init_vals* and
+        returns them."""
+        tanks = [HotWaterTank(self.params, init_vals) for i in range(num)]
+        self.tanks.extend(tanks)
+
+        self.T = np.array([tank.layer_arrays.T for tank in self.tanks])
+        for i, tank in enumerate(self.tanks):
+            tank.layer_arrays.T = self.T[i]
+        self._connections = [list(tank.connections.values())
+                             for tank in self.tanks]
+        self._heating_rods = [list(tank.heating_rods.values())
+                              for tank in self.tanks]
+        return tanks
+
+    def step(self, step_size):
+        """Perform simulation step with step size step_size for all tanks"""
+        if not self.tanks:
+            return
+        tank = self.tanks[0]
+        T = self.T
+        volume = tank.layer_arrays.volume
+        n_tanks, n_layers = T.shape
+
+        # collect mass flows out of the tanks and into the tanks
+        n_connections = len(tank.connections)
+        F_list = []
+        T_list = []
+        layer_list = []
+        for connections in self._connections:
+            for connection in connections:
+                connection._T_buffer = []
+                F_list.append(connection._F)
+                T_list.append(connection._T)
+                layer_list.append(connection.corresponding_layer.idx)
+        shape = (n_tanks, n_connections)
+        # connections without flow (None) are not considered
+        flow_F = np.array(F_list, dtype=float).reshape(shape)
+        flow_F[np.isnan(flow_F)] = 0
+        T_in = np.array(T_list, dtype=float).reshape(shape)
+        flow_layers = np.array(layer_list, dtype=int).reshape(shape)
+        inlet = flow_F > 0
+        if np.any(inlet & np.isnan(T_in)):
+            j = np.flatnonzero(np.any(inlet & np.isnan(T_in), axis=0))[0]
+            raise ValueError("temperature of input connection "
+                             "'%s' was not set" % list(tank.connections)[j])
+        rows = np.repeat(np.arange(n_tanks), n_connections).reshape(shape)
+        # output connections have the temperature of their layer
+        flow_T = np.where(inlet, T_in, T[rows, flow_layers])
+
+        if tank.solver != 'implicit':
+            # check mass flows, tanks whose inflow or outflow per time step
+            # exceeds the layer volume are calculated with adapted step sizes
+            inflow = np.zeros((n_tanks, n_layers))
+            outflow = np.zeros((n_tanks, n_layers))
+            outlet = flow_F < 0
+            np.add.at(inflow, (rows[inlet], flow_layers[inlet]),
+                      flow_F[inlet])
+            np.add.at(outflow, (rows[outlet], flow_layers[outlet]),
+                      flow_F[outlet])
+            V = np.maximum(inflow * step_size, np.abs(outflow * step_size))
+            adapted = np.any(V > volume, axis=1)
+            for i in np.flatnonzero(adapted):
+                self.tanks[i].step(step_size)
+            regular = np.flatnonzero(~adapted)
+            if len(regular) < n_tanks:
+                rows = rows[:len(regular)]
+                flow_layers = flow_layers[regular]
+                flow_F = flow_F[regular]
+                flow_T = flow_T[regular]
+        else:
+            regular = np.arange(n_tanks)
+        if len(regular) == 0:
+            return
+
+        # calculate massflows between the layers, the net flow of a layer
+        # is passed on to the layer above
+        netflow_connections = np.zeros((len(regular), n_layers))
+        np.add.at(netflow_connections, (rows, flow_layers), flow_F)
+        netflow = np.cumsum(netflow_connections, axis=1)
+        negligible = (np.abs(netflow[:, :-1]) <= 1e-10) & (netflow[:, :-1] != 0)
+        for i in np.flatnonzero(np.any(negligible, axis=1)):
+            # negligible net flows are not passed on
+            for idx in range(1, n_layers):
+                if abs(netflow[i, idx - 1]) > 1e-10:
+                    netflow[i, idx] = (netflow_connections[i, idx]
+                                       + netflow[i, idx - 1])
+                else:
+                    netflow[i, idx] = netflow_connections[i, idx]
+        if np.any(np.abs(netflow[:, -1]) > 1e-10):
+            raise ValueError("Sum of inputs and output flows doesn't "
+                             "equal zero. Check flows!")
+        F_layers = np.where(np.abs(netflow[:, :-1]) > 1e-10,
+                            netflow[:, :-1], 0)
+
+        T_regular = T[regular]
+        T_env = np.array([self.tanks[i].T_env for i in regular.tolist()],
+                         dtype=float)[:, np.newaxis]
+        heating_rods = self._update_heating_rods(T_regular, regular)
+        # tanks without mass flows and heating rods are calculated with the
+        # propagator of the step size, like single tanks, the others with the
+        # kernels of the single tanks
+        idle = ~np.any(flow_F != 0, axis=1)
+        for idx, P_th in heating_rods:
+            idle &= P_th == 0
+        active = np.flatnonzero(~idle)
+
+        if len(active) > 0:
+            T_active = T_regular if len(active) == len(regular) else T_regular[active]
+            args = (step_size, flow_layers[active], flow_F[active],
+                    flow_T[active], F_layers[active])
+            kwargs = {'heating_rods': [(idx, P_th[active]) for idx, P_th in heating_rods],
+                      'T': T_active, 'T_env': T_env[active]}
+            if tank.solver == 'implicit':
+                tank._step_implicit(*args, **kwargs)
+            else:
+                tank._step_explicit(*args, **kwargs)
+            T_regular[active] = T_active
+        if len(active) < len(regular):
+            T_idle = T_regular[idle]
+            tank._step_without_flows(step_size, T_idle, T_env[idle])
+            T_regular[idle] = T_idle
+
+        # flip temperature if temperature of lower layer is higher, or mix
+        # the layers
+        if tank.mixing == 'mix':
+            inverted = np.any(T_regular[:, 1:] < T_regular[:, :-1], axis=1)
+            for i in np.flatnonzero(inverted):
+                _mix_layers(T_regular[i], volume)
+            monotonic = np.all(T_regular[:, 1:] >= T_regular[:, :-1], axis=1)
+        else:
+            T_regular.sort(axis=1)
+            monotonic = np.ones(len(regular), dtype=bool)
+        T[regular] = T_regular
+        for i, layer_monotonic in zip(regular.tolist(), monotonic.tolist()):
+            self.tanks[i].layer_arrays.monotonic = layer_monotonic
+
+        # update connections, the corresponding layer of an input connection
+        # is the layer with the smallest temperature difference
+        T_in = T_in[regular]
+        idx_min = np.argmin(np.abs(T_in[:, :, np.newaxis]
+                                   - T_regular[:, np.newaxis, :]), axis=2)
+        idx_min[~(inlet[regular] & ~np.isnan(T_in))] = -1
+        for i, idx_row in zip(regular.tolist(), idx_min.tolist()):
+            for connection, idx in zip(self._connections[i], idx_row):
+                if idx < 0:
+                    connection.corresponding_layer = \
+                        connection.corresponding_layer_pos
+                else:
+                    connection.corresponding_layer = connection.layers[idx]
+
+    def _update_heating_rods(self, T, regular):
+        """
+        Updates the heating rods of the tanks *regular* with the layer
+        temperatures *T* and returns the layer index and the thermal power
+        output of each heating rod.
+        """
+        layers = [heating_rod.corresponding_layer.idx
+                  for heating_rod in self.tanks[0].heating_rods.values()]
+        heating_rods = [heating_rod for i in regular.tolist()
+                        for heating_rod in self._heating_rods[i]]
+        P_th = update_heating_rods(heating_rods, T[:, layers].ravel())
+        P_th = P_th.reshape(len(regular), len(layers))
+        return [(idx, P_th[:, k]) for k, idx in enumerate(layers)]
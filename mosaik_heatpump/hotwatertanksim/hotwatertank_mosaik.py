@@ -2,9 +2,12 @@
 Mosaik interface for hot water tank
 
 """
+import json
+from functools import partial
 import mosaik_api
-import jsonpickle
 from mosaik_heatpump.hotwatertanksim.hotwatertank import HotWaterTank
+from mosaik_heatpump.hotwatertanksim.hotwatertank_batch import HotWaterTankBatch
+from mosaik_heatpump.recorder import check_config, start_recorder
 
 class HotWaterTankSimulator(mosaik_api.Simulator):
     def __init__(self):
@@ -15,6 +18,10 @@ class HotWaterTankSimulator(mosaik_api.Simulator):
                 }
         super().__init__(meta)
         self.models = dict()
+        self.accessors = dict()  # getters and setters of the attributes of each model
+        self.attrs = set()
+        self.batches = dict()  # contains the batches of tanks calculated together
+        self.batched_eids = set()
         self.sid = None
         self.eid_prefix = 'HotWaterTank_'
         self.step_size = None  # [sec]
@@ -22,38 +29,26 @@ class HotWaterTankSimulator(mosaik_api.Simulator):
         self.time = None
         self.first_iteration = None
         self.step_executed = False
+        self.record = None  # the configuration of the recorder, see mosaik_heatpump.recorder
+        self.recorder = None
 
-    def init(self, sid, time_resolution, step_size, config, same_time_loop=False):
+    def init(self, sid, time_resolution, step_size, config, same_time_loop=False, record=None):
         self.time_resolution = float(time_resolution)
         if self.time_resolution != 1.0:
             print('WARNING: %s got a time_resolution other than 1.0, which \
                 can not be handled by this simulator.', sid)
         self.sid = sid  # simulator id
         self.step_size = step_size
-        attrs = ['_', 'snapshot', 'snapshot_connections', 'T_env', 'T_mean', 'mass', 'step_executed']
-        if 'n_sensors' in config:
-            for i in range(config['n_sensors']):
-                attrs.append('sensor_%02d.T' % i)
-        elif 'sensors' in config:
-            for sensor in config['sensors']:
-                attrs.append('%s.T' % sensor)
-
-        if 'connections' in config:
-            for connection in config['connections']:
-                attrs.append('%s.T' % connection)
-                attrs.append('%s.F' % connection)
-        if 'heating_rods' in config:
-            for heating_rod in config['heating_rods']:
-                attrs.append('%s.P_th_set' % heating_rod)
-                attrs.append('%s.P_el' % heating_rod)
-                attrs.append('%s.P_th' % heating_rod)
-                attrs.append('%s.P_th_min' % heating_rod)
-                attrs.append('%s.P_th_max' % heating_rod)
+        self.record = record
+        attrs = tank_attrs(config)
+        self.attrs = set(attrs)
         self.meta['models']['HotWaterTank'] = {
             'public': True,
             'params': ['params', 'init_vals', 'snapshot'],
             'attrs': attrs
         }
+        if record is not None:
+            check_config(record, sid, attrs)
 
         if same_time_loop:
             self.meta['type'] = 'event-based'
@@ -64,12 +59,30 @@ class HotWaterTankSimulator(mosaik_api.Simulator):
         entities = []
 
         next_eid = len(self.models)
+        batched = params is not None and params.get('batch', False)
+        if batched:
+            key = _batch_key(params)
+            if key not in self.batches:
+                self.batches[key] = HotWaterTankBatch(params)
+            tanks = self.batches[key].add(num, init_vals)
+        elif params is not None:
+            tanks = [HotWaterTank(params, init_vals) for i in range(num)]
+        else:
+            # the snapshot is decoded once, the other tanks are copies
+            if snapshot.lstrip().startswith('{'):
+                # snapshot of an earlier version, serialized with jsonpickle
+                tanks = [HotWaterTank.from_legacy_snapshot(snapshot)][:num]
+            else:
+                tanks = [HotWaterTank.from_snapshot(snapshot)][:num]
+            tanks += [tanks[0].clone() for i in range(num - 1)]
+
         for i in range(next_eid, next_eid + num):
             eid = '%s%d' % (self.eid_prefix, i)
-            if params is not None:
-                self.models[eid] = HotWaterTank(params, init_vals)
-            else:
-                self.models[eid] = jsonpickle.decode(snapshot)
+            self.models[eid] = tanks[i - next_eid]
+            self.accessors[eid] = {attr: get_accessors(self.models[eid], attr)
+                                   for attr in self.meta['models']['HotWaterTank']['attrs']}
+            if batched:
+                self.batched_eids.add(eid)
             entities.append({'eid': eid, 'type': model})
 
         return entities
@@ -84,20 +97,27 @@ class HotWaterTankSimulator(mosaik_api.Simulator):
                 self.first_iteration = False
             self.time = time
         for eid, attrs in inputs.items():
+            accessors = self.accessors[eid]
             for attr, src_ids in attrs.items():
                 if attr == '_':
                     pass
                 else:
+                    if attr not in accessors:
+                        accessors[attr] = get_accessors(self.models[eid], attr)
+                    setter = accessors[attr][1]
                     for src_id, val in src_ids.items():
-                        set_nested_attr(self.models[eid], attr, val)
+                        setter(val)
         if self.meta['type'] == 'event-based':
             if not self.first_iteration and not self.step_executed:
-                for eid, model in self.models.items():
-                    model.step(self.step_size)
-                    self.step_executed = True
+                self._step_models()
+                self.step_executed = True
         else:
-            for eid, model in self.models.items():
-                model.step(self.step_size)
+            self._step_models()
+
+        if self.record is not None:
+            if self.recorder is None:
+                self.recorder = start_recorder(self.record, self.sid, self.models, self.attrs, self._get_accessor)
+            self.recorder.record(time)
 
         if self.meta['type'] == 'event-based':
             if self.step_executed and (time + self.step_size) <= self.mosaik.world.until:  #
@@ -105,19 +125,98 @@ class HotWaterTankSimulator(mosaik_api.Simulator):
         else:
             return (time + self.step_size)
 
+    def _step_models(self):
+        for eid, model in self.models.items():
+            if eid not in self.batched_eids:
+                model.step(self.step_size)
+        for batch in self.batches.values():
+            batch.step(self.step_size)
+
     def get_data(self, outputs):
         data = {}
         for eid, attrs in outputs.items():
             data[eid] = {}
+            accessors = self.accessors[eid]
             for attr in attrs:
-                if attr not in self.meta['models']['HotWaterTank'][
-                        'attrs']:
+                if attr not in self.attrs:
                     raise ValueError('Unknown output attribute: %s' % attr)
                 if self.meta['type'] == 'event-based':
                     data['time'] = self.time
-                data[eid][attr] = get_nested_attr(self.models[eid], attr)
+                data[eid][attr] = accessors[attr][0]()
         return data
 
+    def _get_accessor(self, eid, attr):
+        return self.accessors[eid][attr][0]
+
+    def finalize(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+def tank_attrs(config):
+    """Returns the attributes of tanks with the parameters *config*."""
+    attrs = ['_', 'snapshot', 'snapshot_connections', 'T_env', 'T_mean', 'mass', 'step_executed']
+    if 'n_sensors' in config:
+        for i in range(config['n_sensors']):
+            attrs.append('sensor_%02d.T' % i)
+    elif 'sensors' in config:
+        for sensor in config['sensors']:
+            attrs.append('%s.T' % sensor)
+
+    if 'connections' in config:
+        for connection in config['connections']:
+            attrs.append('%s.T' % connection)
+            attrs.append('%s.F' % connection)
+    if 'heating_rods' in config:
+        for heating_rod in config['heating_rods']:
+            attrs.append('%s.P_th_set' % heating_rod)
+            attrs.append('%s.P_el' % heating_rod)
+            attrs.append('%s.P_th' % heating_rod)
+            attrs.append('%s.P_th_min' % heating_rod)
+            attrs.append('%s.P_th_max' % heating_rod)
+    return attrs
+
+def _batch_key(params):
+    """Tanks whose parameters have the same key are calculated in the same batch."""
+    params = dict(params)
+    if 'layers' in params:
+        # the layers are supplemented by the tank
+        params['layers'] = [{'bottom': layer['bottom'], 'top': layer['top']}
+                            for layer in params['layers']]
+    return json.dumps(params, sort_keys=True)
+
+def get_accessors(hwt, name):
+    """
+    Returns a getter and a setter of the (nested) attribute *name* of the tank
+    *hwt*, which do the same as :func:`get_nested_attr` and
+    :func:`set_nested_attr` without looking up the attribute on each call.
+    """
+    attr_parts = name.split('.')
+    depth = len(attr_parts)
+    if depth == 1:
+        return partial(getattr, hwt, name), partial(setattr, hwt, name)
+    if depth == 2:
+        if attr_parts[0] in hwt.sensors:
+            obj = hwt.sensors[attr_parts[0]]
+        elif attr_parts[0] in hwt.connections:
+            obj = hwt.connections[attr_parts[0]]
+            return (partial(_get_float_attr, obj, attr_parts[1]),
+                    partial(setattr, obj, attr_parts[1]))
+        elif attr_parts[0] in hwt.heating_rods:
+            obj = hwt.heating_rods[attr_parts[0]]
+        else:
+            return _get_none, _set_nothing
+        return partial(getattr, obj, attr_parts[1]), partial(setattr, obj, attr_parts[1])
+    return _get_none, _set_nothing
+
+def _get_float_attr(obj, attr):
+    return float(getattr(obj, attr))
+
+def _get_none():
+    return None
+
+def _set_nothing(value):
+    pass
+
 def get_nested_attr(hwt, name):
     attr_parts = name.split('.')
     depth = len(attr_parts)
@@ -0,0 +1,152 @@
+"""
+The recorder module records attributes of the models of a simulator in each step into preallocated column buffers and
+writes full chunks of them in a background thread into a compressed, columnar file (:class:`Recorder`).
+
+The file is a zip archive of *.npy* arrays like the files of :func:`numpy.savez_compressed`, with one array
+'<column>/<chunk>' for each column and chunk and the times of the steps in the column 'time'. It can be read with
+:func:`numpy.load` and is read as whole columns with :func:`load_records`.
+
+The simulators of the package record the attributes *attrs* of all their models, when they are started with the
+argument *record*::
+
+    hp_sim = world.start('HeatPumpSim', step_size=60,
+                         record={'filename': 'hp.npz', 'attrs': ['Q_Supplied', 'P_Required'], 'chunk_size': 1440})
+
+The columns are named '<eid>.<attr>', the other keys are the arguments of :class:`Recorder`. Only attributes with
+numerical or boolean values are recorded, the simulators raise ValueError for the others in *init*.
+"""
+
+import queue
+import threading
+import zipfile
+
+import numpy as np
+
+NOT_RECORDABLE = {'_', 'snapshot', 'snapshot_connections', 'heat_source', 'hwt_connections'}
+# the attributes of the simulators, whose values are not numbers, also as the last part of nested attributes like
+# 'hwt.snapshot' of the heating system
+
+
+class Recorder():
+    """
+    Records the values of the *getters*, a dictionary of functions returning the value of each column, in each step.
+
+    The values are stored as floats, missing values as NaN. The buffers hold *chunk_size* steps. When a buffer is
+    full, it is written to *filename* by a background thread, while the next steps are recorded into a second buffer,
+    so that at most two chunks are held in memory. If a step is recorded twice for the same time, like in the loops of
+    event-based simulators, the values of the last call are kept.
+    """
+
+    def __init__(self, filename, getters, chunk_size=1440, compression=zipfile.ZIP_DEFLATED):
+        self.filename = filename
+        self.columns = list(getters)
+        self.getters = list(getters.values())
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.chunks = 0  # the number of chunks passed to the writer
+
+        self._free = queue.Queue()
+        for i in range(2):
+            self._free.put((np.empty(chunk_size), np.empty((chunk_size, len(self.columns)))))
+        self._times, self._values = self._free.get()
+        self._n = 0  # the number of recorded steps in the buffer
+        self._time = None  # the time of the last recorded step
+        self._error = None  # the error of the writer, raised by the next call
+        self._queue = queue.Queue()
+        self._zip = zipfile.ZipFile(filename, 'w', compression)
+        self._thread = threading.Thread(target=self._write, name='Recorder %s' % filename, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, getters):
+        """Returns a recorder of the *getters* with the parameters *config* of a simulator, except *attrs*."""
+        config = {key: value for key, value in config.items() if key != 'attrs'}
+        return cls(getters=getters, **config)
+
+    def record(self, time):
+        """Records the values of the step at *time*."""
+        if time != self._time:
+            if self._n == self.chunk_size:
+                self._flush()
+            self._n += 1
+            self._time = time
+            self._times[self._n - 1] = time
+        self._values[self._n - 1] = [getter() for getter in self.getters]
+
+    def close(self):
+        """Writes the remaining steps and closes the file."""
+        if self._thread is None:
+            return
+        if self._n > 0:
+            self._flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def _flush(self):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((self.chunks, self._n, self._times, self._values))
+        self.chunks += 1
+        self._times, self._values = self._free.get()
+        self._n = 0
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            chunk, n, times, values = item
+            try:
+                if self._error is None:
+                    self._write_array('time/%06d' % chunk, times[:n])
+                    for j, column in enumerate(self.columns):
+                        self._write_array('%s/%06d' % (column, chunk), np.ascontiguousarray(values[:n, j]))
+            except Exception as e:
+                self._error = e
+            self._free.put((times, values))
+        try:
+            self._zip.close()
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+
+    def _write_array(self, name, array):
+        with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def load_records(filename):
+    """Returns a dictionary with the recorded values of each column of the file *filename* of a :class:`Recorder`."""
+    chunks = {}
+    with np.load(filename) as data:
+        for name in data.files:
+            column, _, chunk = name.rpartition('/')
+            chunks.setdefault(column, []).append((chunk, data[name]))
+    return {column: np.concatenate([array for chunk, array in sorted(arrays, key=lambda item: item[0])])
+            for column, arrays in chunks.items()}
+
+
+def check_config(config, sid, attrs):
+    """
+    Raises ValueError if an attribute of the *config* of the recorder of the simulator *sid* is not in *attrs*, the
+    attributes of its models, or is in :data:`NOT_RECORDABLE`.
+    """
+    for attr in config['attrs']:
+        if attr not in attrs:
+            raise ValueError('%s can not record the unknown attribute: %s' % (sid, attr))
+        if attr.rpartition('.')[2] in NOT_RECORDABLE:
+            raise ValueError('%s can not record the attribute %s, whose values are not numbers' % (sid, attr))
+
+
+def start_recorder(config, sid, models, attrs, get_accessor):
+    """
+    Returns the :class:`Recorder` of the simulator *sid* with the *config* given to it, which records the attributes
+    *config['attrs']* of all *models*, a dictionary of the models by eid. *get_accessor* returns the getter of an
+    attribute of a model. Raises ValueError if an attribute can not be recorded (see :func:`check_config`).
+    """
+    check_config(config, sid, attrs)
+    getters = {'%s.%s' % (eid, attr): get_accessor(eid, attr) for eid in models for attr in config['attrs']}
+    return Recorder.from_config(config, getters)
@@ -25,6 +25,7 @@ setup(
     py_modules=['mosaik_heatpump'],
     entry_points={
         'console_scripts': [
+            'mosaik-heatpump-cop-data = mosaik_heatpump.heatpump.Heat_Pump_Generator:main',
         ],
     },
     classifiers=[
@@ -0,0 +1,97 @@
+import random
+
+import numpy as np
+import pytest
+
+from mosaik_heatpump.controller.controller import Controller
+from mosaik_heatpump.controller.controller_fleet import ControllerFleet
+from mosaik_heatpump.controller.controller_mosaik import ControllerSimulator
+
+
+def _params(operation_mode, control_strategy):
+    return {'T_hp_sp_h': 50, 'T_hp_sp_l': 40, 'T_hr_sp': 35, 'T_hr_sp_dhw': 40, 'T_hr_sp_sh': 35, 'dhw_in_T': 10,
+            'sh_dT': 7, 'operation_mode': operation_mode, 'control_strategy': control_strategy}
+
+
+def _inputs(rnd):
+    return {'sh_demand': rnd.choice([None, -1, 0, rnd.uniform(0, 10)]),
+            'dhw_demand': rnd.choice([None, 0, rnd.uniform(0, 20)]),
+            'sh_out_T': rnd.uniform(25, 50), 'dhw_out_T': rnd.uniform(30, 55), 'T_mean': rnd.uniform(30, 55),
+            'bottom_layer_T': rnd.uniform(30, 60), 'top_layer_T': rnd.uniform(35, 60), 'T_room': rnd.uniform(18, 28),
+            'hp_out_T': rnd.uniform(30, 55), 'hp_supply': rnd.choice([None, rnd.uniform(0, 9000)]),
+            'hp_on_fraction': rnd.choice([None, rnd.uniform(0, 1)]), 'hp_cond_m': rnd.uniform(0, 0.5),
+            'hwt_mass': 400, 'step_size': 900}
+
+
+@pytest.mark.parametrize('mode', [('heating', '1'), ('heating', '2'), ('cooling', None)])
+def test_fleet_matches_single_controllers(mode):
+    rnd = random.Random(42)
+    params = _params(*mode)
+    controllers = [Controller(params) for i in range(20)]
+    fleet = ControllerFleet(params, len(controllers))
+    for step in range(30):
+        for i, controller in enumerate(controllers):
+            for attr, value in _inputs(rnd).items():
+                setattr(controller, attr, value)
+                setattr(fleet.unit(i), attr, value)
+            controller.step()
+        fleet.step()
+        for i, controller in enumerate(controllers):
+            unit = fleet.unit(i)
+            assert unit.hp_status == controller.hp_status
+            for attr in fleet.values:
+                assert getattr(unit, attr) == pytest.approx(getattr(controller, attr))
+
+
+def test_fleet_rejects_unsupported_strategy():
+    with pytest.raises(ValueError):
+        ControllerFleet(_params('heating', '3'), 2)
+
+
+def test_fleet_in_simulator():
+    sim = ControllerSimulator()
+    sim.init('Controller', 1, 900)
+    params = _params('heating', '1')
+    params['fleet'] = True
+    entities = sim.create(3, 'Controller', params)
+    assert len(sim.fleets) == 1
+
+    inputs = {entity['eid']: {attr: {'src': value} for attr, value in _inputs(random.Random(i)).items()
+                              if attr != 'step_size'}
+              for i, entity in enumerate(entities)}
+    assert sim.step(0, inputs, 900) == 900
+    controller = Controller(params)
+    for attr, value in _inputs(random.Random(1)).items():
+        setattr(controller, attr, value)
+    controller.step()
+    data = sim.get_data({entities[1]['eid']: ['hp_demand', 'sh_in_F', 'dhw_in_F', 'hwt_hr_P_th_set']})
+    for attr, value in data[entities[1]['eid']].items():
+        assert value == pytest.approx(getattr(controller, attr))
+
+
+def test_fleet_and_controller_in_event_based_simulator():
+    sim = ControllerSimulator()
+    sim.init('Controller', 1, 900, same_time_loop=True)
+    params = _params('heating', '1')
+    entities = sim.create(1, 'Controller', params)
+    entities += sim.create(2, 'Controller', dict(params, fleet=True))
+
+    inputs = {entity['eid']: {attr: {'src': value} for attr, value in _inputs(random.Random(i)).items()
+                              if attr != 'step_size'}
+              for i, entity in enumerate(entities)}
+    assert sim.step(0, inputs, 900) is None
+    for i, entity in enumerate(entities):
+        controller = Controller(params)
+        for attr, value in _inputs(random.Random(i)).items():
+            setattr(controller, attr, value)
+        controller.step()
+        model = sim.models[entity['eid']]
+        for attr in ['hp_demand', 'sh_in_F', 'dhw_in_F', 'hwt_hr_P_th_set']:
+            assert getattr(model, attr) == pytest.approx(getattr(controller, attr))
+
+    # the fleet is not stepped again in the next iteration at the same time
+    hp_demand = sim.models[entities[1]['eid']].hp_demand
+    inputs[entities[1]['eid']]['hp_supply'] = {'src': 0}
+    sim.step(0, inputs, 900)
+    assert sim.models[entities[1]['eid']].hp_demand == hp_demand
+    assert sim.final_iteration
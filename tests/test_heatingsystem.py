@@ -0,0 +1,231 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from mosaik_heatpump import recorder
+from mosaik_heatpump.controller.controller_mosaik import ControllerSimulator
+from mosaik_heatpump.heatingsystem import scenario, sweep
+from mosaik_heatpump.heatingsystem.heatingsystem_mosaik import HeatingSystemSimulator
+from mosaik_heatpump.heatpump.Heat_Pump_mosaik import HeatPumpSimulator
+from mosaik_heatpump.hotwatertanksim.hotwatertank_mosaik import HotWaterTankSimulator
+
+STEP_SIZE = 60
+
+params_hp = {'hp_model': None, 'heat_source': 'Air', 'cons_T': 35, 'Q_Demand': 19780, 'cond_in_T': 30,
+             'heat_source_T': 7, 'calc_mode': 'fixed', 'COP': 3.5, 'heating capacity': 15000, 'cond_m': 0.5}
+params_hwt = {
+    'height': 3600,
+    'volume': 4000,
+    'T_env': 20.0,
+    'htc_walls': 0.28,
+    'htc_layers': 0.897,
+    'n_layers': 6,
+    'n_sensors': 6,
+    'connections': {
+        'sh_in': {'pos': 10, 'type': 'sh_in'},
+        'sh_out': {'pos': 2150, 'type': 'sh_out'},
+        'dhw_in': {'pos': 10, 'type': 'dhw_in', 'T_sp': -100},
+        'dhw_out': {'pos': 3400, 'type': 'dhw_out'},
+        'hp_in': {'pos': 10, 'type': 'hp_in'},
+        'hp_out': {'pos': 500, 'type': 'hp_out'},
+        },
+    }
+init_vals_hwt = {'layers': {'T': [40, 40, 40, 40, 40, 40]}}
+params_ctrl = {'T_hp_sp_h': 50, 'T_hp_sp_l': 40, 'T_hr_sp_dhw': 40, 'T_hr_sp_sh': 35, 'dhw_in_T': 10, 'sh_dT': 7,
+               'operation_mode': 'heating', 'control_strategy': '1'}
+
+hp_outputs = ['Q_Demand', 'Q_Supplied', 'cons_T', 'P_Required', 'cond_m', 'cond_in_T', 'on_fraction']
+hwt_outputs = ['sensor_00.T', 'sensor_04.T', 'sensor_05.T', 'T_mean', 'sh_in.F', 'dhw_in.F', 'hp_in.T', 'hp_out.T']
+ctrl_outputs = ['heat_demand', 'heat_supply', 'hp_demand', 'sh_in_F', 'sh_in_T', 'dhw_in_F', 'hp_supply', 'P_hr_dhw']
+
+
+def _heat_load(steps):
+    rnd = random.Random(0)
+    return [{'T_amb': rnd.uniform(-5, 10), 'sh_demand': rnd.uniform(0, 8), 'dhw_demand': rnd.choice([0, 0, 5, 20]),
+             'dhw_in_T': rnd.uniform(10, 14)} for step in range(steps)]
+
+
+def _run_simulators(heat_load):
+    """Steps the simulators of the components in the order of mosaik with the connections of the scenario."""
+    hp_sim = HeatPumpSimulator()
+    hp_sim.init('HeatPumpSim', 1, STEP_SIZE)
+    hwt_sim = HotWaterTankSimulator()
+    hwt_sim.init('HotWaterTankSim', 1, STEP_SIZE, config=params_hwt)
+    ctrl_sim = ControllerSimulator()
+    ctrl_sim.init('ControllerSim', 1, STEP_SIZE)
+    hp = hp_sim.create(1, 'HeatPump', params=copy.deepcopy(params_hp))[0]['eid']
+    hwt = hwt_sim.create(1, 'HotWaterTank', params=copy.deepcopy(params_hwt), init_vals=init_vals_hwt)[0]['eid']
+    ctrl = ctrl_sim.create(1, 'Controller', params=params_ctrl)[0]['eid']
+
+    ctrl_to_hwt = {'sh_in.F': 0, 'sh_in.T': 0, 'sh_out.F': 0, 'dhw_in.F': 0, 'dhw_in.T': 0, 'dhw_out.F': 0,
+                   'T_env': 0}
+    ctrl_to_hp = {'Q_Demand': 0, 'T_amb': 5, 'heat_source_T': 5}
+    hp_to_hwt = {'hp_in.T': 0, 'hp_in.F': 0, 'hp_out.F': 0}
+    results = []
+    for step, load in enumerate(heat_load):
+        time = step * STEP_SIZE
+        inputs = dict(ctrl_to_hwt, **hp_to_hwt)
+        hwt_sim.step(time, {hwt: {attr: {'src': value} for attr, value in inputs.items()}}, None)
+        hwt_data = hwt_sim.get_data({hwt: ['T_mean', 'mass', 'sensor_00.T', 'sensor_04.T', 'dhw_out.T', 'sh_out.T',
+                                           'hp_out.T'] + hwt_outputs})[hwt]
+
+        inputs = dict(ctrl_to_hp, cond_in_T=hwt_data['hp_out.T'])
+        hp_sim.step(time, {hp: {attr: {'src': value} for attr, value in inputs.items()}}, None)
+        hp_data = hp_sim.get_data({hp: ['Q_Supplied', 'on_fraction', 'cond_m', 'cons_T', 'cond_m_neg'] + hp_outputs})[hp]
+
+        inputs = dict(load, heat_source_T=load['T_amb'], T_mean=hwt_data['T_mean'], hwt_mass=hwt_data['mass'],
+                      bottom_layer_T=hwt_data['sensor_00.T'], top_layer_T=hwt_data['sensor_04.T'],
+                      dhw_out_T=hwt_data['dhw_out.T'], sh_out_T=hwt_data['sh_out.T'], hp_out_T=hwt_data['hp_out.T'],
+                      hp_supply=hp_data['Q_Supplied'], hp_on_fraction=hp_data['on_fraction'],
+                      hp_cond_m=hp_data['cond_m'])
+        ctrl_sim.step(time, {ctrl: {attr: {'src': value} for attr, value in inputs.items()}}, None)
+        ctrl_data = ctrl_sim.get_data({ctrl: ['sh_in_F', 'sh_in_T', 'sh_out_F', 'dhw_in_F', 'dhw_in_T', 'dhw_out_F',
+                                              'T_amb', 'heat_source_T'] + ctrl_outputs})[ctrl]
+
+        ctrl_to_hwt = {'sh_in.F': ctrl_data['sh_in_F'], 'sh_in.T': ctrl_data['sh_in_T'],
+                       'sh_out.F': ctrl_data['sh_out_F'], 'dhw_in.F': ctrl_data['dhw_in_F'],
+                       'dhw_in.T': ctrl_data['dhw_in_T'], 'dhw_out.F': ctrl_data['dhw_out_F'],
+                       'T_env': ctrl_data['T_amb']}
+        ctrl_to_hp = {'Q_Demand': ctrl_data['hp_demand'], 'T_amb': ctrl_data['T_amb'],
+                      'heat_source_T': ctrl_data['heat_source_T']}
+        hp_to_hwt = {'hp_in.T': hp_data['cons_T'], 'hp_in.F': hp_data['cond_m'], 'hp_out.F': hp_data['cond_m_neg']}
+        results.append(dict([('hp.%s' % attr, hp_data[attr]) for attr in hp_outputs] +
+                            [('hwt.%s' % attr, hwt_data[attr]) for attr in hwt_outputs] +
+                            [('ctrl.%s' % attr, ctrl_data[attr]) for attr in ctrl_outputs]))
+    return results
+
+
+def test_heating_system_matches_coupled_simulators():
+    heat_load = _heat_load(120)
+    reference = _run_simulators(heat_load)
+
+    sim = HeatingSystemSimulator()
+    sim.init('HeatingSystemSim', 1, STEP_SIZE, config=params_hwt)
+    eid = sim.create(1, 'HeatingSystem', params={'hp': copy.deepcopy(params_hp), 'hwt': copy.deepcopy(params_hwt),
+                                                  'hwt_init_vals': init_vals_hwt, 'ctrl': params_ctrl})[0]['eid']
+    for step, (load, expected) in enumerate(zip(heat_load, reference)):
+        inputs = dict(load, heat_source_T=load['T_amb'])
+        assert sim.step(step * STEP_SIZE, {eid: {attr: {'src': value} for attr, value in inputs.items()}},
+                        None) == (step + 1) * STEP_SIZE
+        assert sim.get_data({eid: list(expected)})[eid] == expected
+
+    assert any(values['hp.Q_Supplied'] > 0 for values in reference)
+    with pytest.raises(ValueError):
+        sim.get_data({eid: ['hp.unknown']})
+
+
+def test_scenario_matches_coupled_simulators(tmp_path):
+    heat_load = _heat_load(120)
+    datafile = tmp_path / 'heat_load.csv'
+    lines = ['HEATLOAD', 'Time,DHW Demand [L],SH Demand [kW],T_amb,dhw_in_T']
+    for step, load in enumerate(heat_load[::2]):
+        lines.append('01.01.2020 %02d:%02d,%r,%r,%r,%r' % (step // 30, step * 2 % 60, load['dhw_demand'],
+                                                           load['sh_demand'], load['T_amb'], load['dhw_in_T']))
+    datafile.write_text('\n'.join(lines) + '\n')
+    inputs = scenario.read_inputs(str(datafile), start='01.01.2020 00:00')
+    assert inputs[0][:3].tolist() == [0, 120, 240]
+    assert inputs[1]['T_amb'][1] == heat_load[2]['T_amb']
+
+    # each row of the file holds for two steps
+    heat_load = [heat_load[step - step % 2] for step in range(len(heat_load))]
+    reference = _run_simulators(heat_load)
+    params = {'hp': copy.deepcopy(params_hp), 'hwt': copy.deepcopy(params_hwt), 'hwt_init_vals': init_vals_hwt,
+              'ctrl': params_ctrl}
+    results = scenario.run(params, inputs, len(heat_load) * STEP_SIZE, STEP_SIZE, outputs=list(reference[0]))
+    for attr, values in results.items():
+        assert values.tolist() == [expected[attr] for expected in reference]
+
+    with pytest.raises(ValueError):
+        scenario.run(params, (inputs[0] + 60, inputs[1]), STEP_SIZE, STEP_SIZE)
+
+
+def test_sweep(tmp_path):
+    heat_load = _heat_load(60)
+    inputs = ([step * STEP_SIZE for step in range(len(heat_load))],
+              {column: [load[attr] for load in heat_load]
+               for attr, column in [('T_amb', 'T_amb'), ('sh_demand', 'SH Demand [kW]'),
+                                    ('dhw_demand', 'DHW Demand [L]'), ('dhw_in_T', 'dhw_in_T')]})
+    params = {'hp': copy.deepcopy(params_hp), 'hwt': copy.deepcopy(params_hwt), 'hwt_init_vals': init_vals_hwt,
+              'ctrl': dict(params_ctrl)}
+    variations = {('hp.hp_model', 'hp.calc_mode'): [(None, 'fixed'), ('unknown', 'fast')],
+                  'hwt.volume': [2000, 4000],
+                  'ctrl.T_hp_sp_h': [45, 50]}
+    rows = sweep.run_sweep(params, variations, inputs, len(heat_load) * STEP_SIZE, STEP_SIZE, processes=2,
+                           directory=str(tmp_path))
+
+    assert [(row['run'], row['hp.calc_mode'], row['hwt.volume'], row['ctrl.T_hp_sp_h']) for row in rows] == [
+        (0, 'fixed', 2000, 45), (1, 'fixed', 2000, 50), (2, 'fixed', 4000, 45), (3, 'fixed', 4000, 50),
+        (4, 'fast', 2000, 45), (5, 'fast', 2000, 50), (6, 'fast', 4000, 45), (7, 'fast', 4000, 50)]
+    for row in rows[:4]:
+        variant_params = copy.deepcopy(params)
+        variant_params['hwt']['volume'] = row['hwt.volume']
+        variant_params['ctrl']['T_hp_sp_h'] = row['ctrl.T_hp_sp_h']
+        results = scenario.run(variant_params, inputs, len(heat_load) * STEP_SIZE, STEP_SIZE, sweep.OUTPUTS)
+        assert {kpi: row[kpi] for kpi in sweep.KPIS} == sweep.kpis(results, STEP_SIZE)
+        assert row['error'] == '' and row['wall_time'] > 0
+        saved = np.load(str(tmp_path / ('run_%04d' % row['run']) / 'results.npz'))
+        assert saved['hp.Q_Supplied'].tolist() == results['hp.Q_Supplied'].tolist()
+    assert rows[0]['Q_hp'] > 0 and rows[0]['T_mean_min'] != rows[2]['T_mean_min']
+    assert rows[4]['error'] and rows[4]['Q_hp'] != rows[4]['Q_hp']
+
+    sweep.save_table(rows, str(tmp_path / 'summary.csv'))
+    with open(str(tmp_path / 'summary.csv')) as read_file:
+        assert len(read_file.readlines()) == len(rows) + 1
+
+
+def test_recorder(tmp_path):
+    heat_load = _heat_load(20)
+    filename = str(tmp_path / 'heating_system.npz')
+    attrs = ['hp.Q_Supplied', 'hp.step_executed', 'hwt.sensor_00.T', 'ctrl.P_hr_dhw', 'T_amb']
+    sim = HeatingSystemSimulator()
+    sim.init('HeatingSystemSim', 1, STEP_SIZE, config=params_hwt,
+             record={'filename': filename, 'attrs': attrs, 'chunk_size': 7})
+    eids = [entity['eid'] for entity in sim.create(2, 'HeatingSystem', params={
+        'hp': copy.deepcopy(params_hp), 'hwt': copy.deepcopy(params_hwt), 'hwt_init_vals': init_vals_hwt,
+        'ctrl': params_ctrl})]
+    expected = {'%s.%s' % (eid, attr): [] for eid in eids for attr in attrs}
+    for step, load in enumerate(heat_load):
+        inputs = dict(load, heat_source_T=load['T_amb'])
+        sim.step(step * STEP_SIZE, {eid: {attr: {'src': value} for attr, value in inputs.items()} for eid in eids},
+                 None)
+        for eid, values in sim.get_data({eid: attrs for eid in eids}).items():
+            for attr, value in values.items():
+                expected['%s.%s' % (eid, attr)].append(np.nan if value is None else value)
+    sim.finalize()
+
+    records = recorder.load_records(filename)
+    assert records.pop('time').tolist() == [step * STEP_SIZE for step in range(len(heat_load))]
+    assert sorted(records) == sorted(expected)
+    for column, values in records.items():
+        np.testing.assert_array_equal(values, expected[column])
+
+    # a step recorded twice for the same time keeps the last values
+    values = iter([1, 2, None])
+    rec = recorder.Recorder(str(tmp_path / 'same_time.npz'), {'value': lambda: next(values)}, chunk_size=1)
+    rec.record(0)
+    rec.record(0)
+    rec.record(60)
+    rec.close()
+    records = recorder.load_records(rec.filename)
+    assert records['time'].tolist() == [0, 60]
+    np.testing.assert_array_equal(records['value'], [2, np.nan])
+
+    with pytest.raises(ValueError):
+        recorder.start_recorder({'filename': filename, 'attrs': ['hp.unknown']}, 'HeatingSystemSim', sim.models,
+                                sim.attrs, sim._get_accessor)
+
+    # attributes whose values are not numbers are rejected when the simulators are started
+    for attrs in [['hwt.snapshot'], ['hp.heat_source'], ['ctrl.hwt_connections']]:
+        with pytest.raises(ValueError, match='not numbers'):
+            HeatingSystemSimulator().init('HeatingSystemSim', 1, STEP_SIZE, config=params_hwt,
+                                          record={'filename': filename, 'attrs': attrs})
+    with pytest.raises(ValueError, match='not numbers'):
+        HotWaterTankSimulator().init('HotWaterTankSim', 1, STEP_SIZE, config=params_hwt,
+                                     record={'filename': filename, 'attrs': ['T_mean', 'snapshot_connections']})
+    with pytest.raises(ValueError, match='not numbers'):
+        ControllerSimulator().init('ControllerSim', 1, STEP_SIZE, record={'filename': filename,
+                                                                         'attrs': ['hwt_connections']})
+    with pytest.raises(ValueError, match='unknown'):
+        HeatPumpSimulator().init('HeatPumpSim', 1, STEP_SIZE, record={'filename': filename, 'attrs': ['unknown']})
@@ -0,0 +1,382 @@
+import os
+
+import numpy as np
+import pytest
+
+from mosaik_heatpump.heatpump.Heat_Pump_Cache import DESIGN_CACHE, DesignPathStore, LRUCache, set_design_cache_size
+from mosaik_heatpump.heatpump.Heat_Pump_Data import COPTable, get_design_index, nearest_index
+from mosaik_heatpump.heatpump.Heat_Pump_Des import Heat_Pump_Des
+from mosaik_heatpump.heatpump.Heat_Pump_Fleet import HeatPumpFleet
+from mosaik_heatpump.heatpump.Heat_Pump_Generator import generate, grid, heatloads, save
+from mosaik_heatpump.heatpump.Heat_Pump_Model import Heat_Pump
+from mosaik_heatpump.heatpump.Heat_Pump_mosaik import HeatPumpSimulator
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put(('Air_8kW', 1), 'a')
+    cache.put(('Air_8kW', 2), 'b')
+    assert cache.get(('Air_8kW', 1)) == 'a'
+    cache.put(('Air_8kW', 3), 'c')  # evicts the least recently used entry
+
+    assert cache.get(('Air_8kW', 2)) is None
+    assert cache.get(('Air_8kW', 3)) == 'c'
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (2, 1, 1, 2)
+
+
+class _SavedNetwork():
+    def __init__(self):
+        self.saved = 0
+
+    def save(self, path):
+        os.makedirs(path)
+        open(os.path.join(path, 'connections.csv'), 'w').close()
+        self.saved += 1
+
+
+def test_design_path_store_writes_design_points_once(tmp_path):
+    nw = _SavedNetwork()
+    store = DesignPathStore(str(tmp_path))
+    path_1 = store.save(nw, 'LW 300(L)', 75)
+    path_2 = DesignPathStore(str(tmp_path)).save(nw, 'LW 300(L)', 75)
+    path_3 = store.save(nw, 'LW 300(L)', 95)
+
+    assert path_1 == path_2 != path_3
+    assert nw.saved == 2
+    assert os.path.dirname(path_1) == os.path.join(str(tmp_path), 'LW_300_L_')
+
+
+def test_warm_start_repeats_failed_solves_from_design_state():
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'heat_source_T': 7, 'cons_T': 35,
+              'Q_Demand': 20000, 'calc_mode': 'detailed'}
+    inputs = [{'heat_source_T': 7.2, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': 7.2},
+              {'heat_source_T': 7.3, 'Q_Demand': 15500, 'cond_in_T': 30.5, 'T_amb': 7.3}]
+    reference = Heat_Pump_Des(params)
+    cold = Heat_Pump_Des(params)
+    warm = Heat_Pump_Des(dict(params, warm_start=True))
+    for hp in (reference, cold, warm):
+        hp.step(inputs[0])
+    assert warm.COP == pytest.approx(reference.COP, abs=1e-6)
+    assert warm.solve_iter == reference.solve_iter
+
+    # the next calculation starting from the last converged state fails
+    def failing_solve(nw):
+        solve = nw.solve
+
+        def wrapper(*args, **kwargs):
+            if kwargs.get('init_previous', True):
+                raise ValueError('Singularity in jacobian matrix')
+            return solve(*args, **kwargs)
+        return wrapper
+
+    for hp in (cold, warm):
+        hp.nw.solve = failing_solve(hp.nw)
+        hp.step(inputs[1])
+    reference.step(inputs[1])
+
+    assert cold.skip_step and cold.COP == 0
+    assert not warm.skip_step
+    assert warm.COP == pytest.approx(reference.COP, rel=1e-6)
+    assert warm.solve_iter > 0
+
+
+def test_design_cache_shares_no_networks():
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'heat_source_T': 7, 'cons_T': 35,
+              'Q_Demand': 20000, 'calc_mode': 'detailed'}
+    inputs_1 = {'heat_source_T': 7.2, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': 7.2}
+    inputs_2 = {'heat_source_T': 7.3, 'Q_Demand': 18000, 'cond_in_T': 32, 'T_amb': 7.3}
+    DESIGN_CACHE.clear()
+    designed = Heat_Pump_Des(params)
+    cached = Heat_Pump_Des(params)
+    assert DESIGN_CACHE.info().hits == 1
+    assert cached.nw is not designed.nw
+    assert cached.design_path == designed.design_path
+
+    # the results of a heat pump do not depend on the steps of the other heat pumps of the design point
+    designed.step(inputs_1)
+    cached.step(inputs_2)
+    DESIGN_CACHE.clear()
+    reference = Heat_Pump_Des(params)
+    reference.step(inputs_2)
+    assert cached.COP == pytest.approx(reference.COP, abs=1e-6)
+    assert cached.cond_m == pytest.approx(reference.cond_m, abs=1e-6)
+
+
+def test_design_failure(monkeypatch):
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'heat_source_T': 7, 'cons_T': 35,
+              'Q_Demand': 20000, 'calc_mode': 'detailed'}
+    DESIGN_CACHE.clear()
+    heat_pump = Heat_Pump_Des(params)
+
+    def fail(self):
+        raise RuntimeError('design failed')
+    monkeypatch.setattr(Heat_Pump_Des, '_design_hp', fail)
+    DESIGN_CACHE.clear()
+    with pytest.raises(RuntimeError):
+        Heat_Pump_Des(params)
+
+    # a failure in a step is an error of the step, also in the next steps at the same design point
+    inputs = {'heat_source_T': -7, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': -7}
+    with pytest.warns(UserWarning, match='design failed'):
+        heat_pump.step(inputs)
+    assert heat_pump.skip_step and heat_pump.COP == 0 and heat_pump.nw is None
+    heat_pump.step(inputs)
+    assert heat_pump.skip_step and heat_pump.COP == 0
+
+
+def test_design_cache_size():
+    maxsize = DESIGN_CACHE.maxsize
+    try:
+        HeatPumpSimulator().init('HeatPumpSim-0', 1, 60, design_cache_size=3)
+        assert DESIGN_CACHE.maxsize == 3
+        for size in (0, -1, 2.5, '4', True):
+            with pytest.raises(ValueError):
+                set_design_cache_size(size)
+    finally:
+        set_design_cache_size(maxsize)
+
+
+def test_nearest_index_prefers_smaller_value_on_ties():
+    keys = np.array([-20, -15, -7, -2, 2, 7])
+    assert nearest_index(keys, -11) == 1
+    assert nearest_index(keys, -10.9) == 2
+    assert list(nearest_index(keys, np.array([-30, 0, 30]))) == [0, 3, 5]
+
+
+def test_design_index_lookup():
+    design_index = get_design_index('Air_30kW_1stage')
+    design = design_index.lookup(7.2, 30, air=True)
+    assert not design.skip
+    assert (design.heat_source_T_des, design.LFE_des, design.LWC_des, design.idx) == (7, 2, 35, 75)
+
+    # heat source warmer than the water entering the condenser
+    assert design_index.lookup(40, 30, air=True).skip
+    designs = design_index.lookup(np.array([7.2, -40]), np.array([30, 30]), air=True)
+    assert list(designs.valid_T) == [True, False]
+
+
+@pytest.fixture
+def cop_m_data():
+    cells = {
+        '30': {'1800.0': {'cond_m': 0.3, 'COP': 3.0}, '2300.0': {'cond_m': 0.4, 'COP': 3.1},
+               '2500.0': {'cond_m': 0.5, 'COP': 3.2}},
+        '35': {'1800.0': {'cond_m': 0.6, 'COP': 2.5}, '2300.0': {'cond_m': 0.7, 'COP': 2.6}},
+    }
+    return {'-2': cells, '2': {'30': cells['30'], '35': {}}}
+
+
+def test_cop_table_lookup(cop_m_data):
+    table = COPTable(cop_m_data)
+    assert list(table.heatload_keys) == [1800, 2300, 2500]
+
+    # closest tabulated heat load of the closest cell, the smaller one on ties
+    cond_m, COP = table.lookup(np.array([-2, -2, -2, 2]), np.array([31, 36, 36, 30]),
+                               np.array([2400, 2400, 2050, 5000]))
+    assert list(cond_m) == [0.4, 0.7, 0.6, 0.5]
+    assert list(COP) == [3.1, 2.6, 2.5, 3.2]
+
+    # cell without any data
+    cond_m, COP = table.lookup(2, 35, 2000)
+    assert np.isnan(cond_m) and np.isnan(COP)
+
+
+def test_cop_table_interpolate(cop_m_data):
+    table = COPTable(cop_m_data)
+
+    # halfway between two heat loads of a cell, clamped at the boundaries of the grid
+    cond_m, COP = table.interpolate(np.array([-2, -2, -40]), np.array([30, 30, 30]), np.array([2050, 2500, 1000]))
+    assert np.allclose(cond_m, [0.35, 0.5, 0.3])
+    assert np.allclose(COP, [3.05, 3.2, 3.0])
+
+    # the missing heat load of a cell is interpolated before interpolating between the cells
+    cond_m, COP = table.interpolate(-2, 32.5, 2500)
+    assert np.isclose(cond_m, 0.6) and np.isclose(COP, 2.9)
+
+    # corners of the cell without data are left out
+    cond_m, COP = table.interpolate(2, 32.5, 1800)
+    assert np.isclose(cond_m, 0.3) and np.isclose(COP, 3.0)
+
+
+@pytest.mark.parametrize('params', [
+    {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'calc_mode': 'fixed', 'cond_m': 0.5, 'COP': 3.5,
+     'heating capacity': 15000},
+    {'hp_model': 'LW 300(L)', 'heat_source': 'Air', 'calc_mode': 'hplib', 'equivalent hp model': 'Air_30kW_1stage'},
+])
+def test_fleet_matches_single_heat_pumps(params):
+    inputs = [{'heat_source_T': 7.2, 'Q_Demand': 12000, 'cond_in_T': 30, 'T_amb': 7.2},
+              {'heat_source_T': -3, 'Q_Demand': 30000, 'cond_in_T': 35, 'T_amb': -3},
+              {'heat_source_T': 2, 'Q_Demand': 0, 'cond_in_T': 70, 'T_amb': 2}]
+    fleet = HeatPumpFleet(params, len(inputs))
+    for i, unit_inputs in enumerate(inputs):
+        heat_pump = Heat_Pump(params, None)
+        for attr, value in unit_inputs.items():
+            setattr(heat_pump.inputs, attr, value)
+            setattr(fleet.unit(i).inputs, attr, value)
+        heat_pump.step()
+
+        fleet.step()
+        for attr in ('P_Required', 'COP', 'Q_Supplied', 'on_fraction', 'cond_m', 'cons_T'):
+            assert getattr(fleet.unit(i).state, attr) == pytest.approx(getattr(heat_pump.state, attr))
+
+
+@pytest.fixture
+def grid_cop_m_data():
+    """COP data on the grid of the design points of 'Air_30kW_1stage', with an empty and a failed cell."""
+    design_index = get_design_index('Air_30kW_1stage')
+    data = {}
+    for heat_source_T, cond_in_T in grid('Air_30kW_1stage', -10, 12):
+        cell = {}
+        for heatload in heatloads(design_index.min_heatload, 32000, 2500):
+            cond_m = heatload / (4184 * (5 + heatload / 10000))
+            COP = 2 + 0.08 * (heat_source_T + 20) - 0.03 * (cond_in_T - 10) + heatload / 40000
+            cell[str(heatload)] = {'cond_m': cond_m, 'COP': COP}
+        if (heat_source_T, cond_in_T) == (2, 30):
+            cell = {}
+        elif (heat_source_T, cond_in_T) == (7, 40):
+            cell = {heatload: {'cond_m': 0, 'COP': 0} for heatload in cell}
+        data.setdefault(str(heat_source_T), {})[str(cond_in_T)] = cell
+    return data
+
+
+@pytest.mark.parametrize('calc_mode', ['fast', 'fast_interp'])
+def test_fleet_matches_single_heat_pumps_with_cop_data(calc_mode, grid_cop_m_data):
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'calc_mode': calc_mode}
+    inputs = [{'heat_source_T': 7.2, 'Q_Demand': 12000, 'cond_in_T': 30.4, 'T_amb': 7.2},
+              {'heat_source_T': -3.4, 'Q_Demand': 30000, 'cond_in_T': 35, 'T_amb': -3.4},
+              {'heat_source_T': 10.6, 'Q_Demand': 17250, 'cond_in_T': 28.7, 'T_amb': 10.6},
+              {'heat_source_T': 2, 'Q_Demand': 15000, 'cond_in_T': 56, 'T_amb': 2},
+              {'heat_source_T': 2, 'Q_Demand': 0, 'cond_in_T': 30, 'T_amb': 2},
+              {'heat_source_T': 2.2, 'Q_Demand': 15000, 'cond_in_T': 30.2, 'T_amb': 2.2},
+              {'heat_source_T': 7, 'Q_Demand': 15000, 'cond_in_T': 40, 'T_amb': 7},
+              {'heat_source_T': 40, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': 40}]
+    fleet = HeatPumpFleet(params, len(inputs), grid_cop_m_data)
+    heat_pumps = [Heat_Pump(params, grid_cop_m_data) for unit_inputs in inputs]
+    for i, unit_inputs in enumerate(inputs):
+        for attr, value in unit_inputs.items():
+            setattr(heat_pumps[i].inputs, attr, value)
+            setattr(fleet.unit(i).inputs, attr, value)
+        heat_pumps[i].step()
+    fleet.step()
+
+    for i, heat_pump in enumerate(heat_pumps):
+        for attr in ('P_Required', 'COP', 'Q_Supplied', 'on_fraction', 'cond_m', 'cons_T', 'Q_evap'):
+            assert getattr(fleet.unit(i).state, attr) == pytest.approx(getattr(heat_pump.state, attr)), (i, attr)
+    assert heat_pumps[0].state.Q_Supplied == 12000
+    assert heat_pumps[3].state.cons_T == 60  # limited to the highest temperature of the design point
+    assert heat_pumps[6].state.COP == 0 and heat_pumps[7].state.COP == 0
+
+
+def test_fleet_in_simulator():
+    sim = HeatPumpSimulator()
+    sim.init('HeatPumpSim-0', 1, 60)
+    entities = sim.create(2, 'HeatPump', {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'calc_mode': 'fixed',
+                                          'cond_m': 0.5, 'COP': 3.5, 'heating capacity': 15000, 'fleet': True})
+    eid = entities[1]['eid']
+    sim.step(0, {eid: {'Q_Demand': {'src': 7500}, 'cond_in_T': {'src': 30}}}, 60)
+
+    data = sim.get_data({eid: ['Q_Supplied', 'on_fraction', 'P_Required', 'step_executed']})
+    assert data[eid] == {'Q_Supplied': 7500, 'on_fraction': 0.5, 'P_Required': 15000 / 3.5 * 0.5,
+                         'step_executed': True}
+
+
+def test_worker_processes():
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'calc_mode': 'fixed', 'cond_m': 0.5, 'COP': 3.5,
+              'heating capacity': 15000}
+    sim = HeatPumpSimulator()
+    sim.init('HeatPumpSim-0', 1, 60)
+    try:
+        entities = sim.create(3, 'HeatPump', dict(params, processes=2))
+        sim.create(1, 'HeatPump', params)
+        assert [len(shard) for shard in sim.workers.shards] == [2, 1]
+
+        inputs = {entity['eid']: {'Q_Demand': {'src': 7500 * (i + 1)}, 'cond_in_T': {'src': 30}}
+                  for i, entity in enumerate(entities)}
+        inputs['HeatPump_3'] = {'Q_Demand': {'src': 3000}, 'cond_in_T': {'src': 30}}
+        sim.step(0, inputs, 60)
+
+        data = sim.get_data({eid: ['Q_Supplied', 'on_fraction', 'step_executed'] for eid in inputs})
+        assert [data[eid]['Q_Supplied'] for eid in inputs] == [7500, 15000, 15000, 3000]
+        assert [data[eid]['on_fraction'] for eid in inputs] == [0.5, 1, 1, 0.2]
+        assert all(data[eid]['step_executed'] for eid in inputs)
+    finally:
+        sim.finalize()
+    assert sim.workers is None
+
+
+def test_worker_processes_detailed(tmp_path):
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'heat_source_T': 7, 'cons_T': 35,
+              'Q_Demand': 20000, 'calc_mode': 'detailed', 'design_dir': str(tmp_path)}
+    inputs = [{'heat_source_T': 7.2, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': 7.2},
+              {'heat_source_T': 7.3, 'Q_Demand': 18000, 'cond_in_T': 31, 'T_amb': 7.3},
+              {'heat_source_T': 1.8, 'Q_Demand': 16000, 'cond_in_T': 32, 'T_amb': 1.8}]
+    sim = HeatPumpSimulator()
+    sim.init('HeatPumpSim-0', 1, 60)
+    try:
+        eids = [entity['eid'] for entity in sim.create(2, 'HeatPump', dict(params, processes=2))]
+        heat_pumps = [Heat_Pump(params, None) for eid in eids]
+        for step, step_inputs in enumerate(inputs):
+            # the second heat pump is one step ahead of the first one
+            unit_inputs = [step_inputs, inputs[(step + 1) % len(inputs)]]
+            sim.step(step * 60, {eid: {attr: {'src': value} for attr, value in values.items()}
+                                 for eid, values in zip(eids, unit_inputs)}, None)
+            data = sim.get_data({eid: ['Q_Supplied', 'COP', 'cond_m', 'cons_T', 'P_Required'] for eid in eids})
+            for eid, heat_pump, values in zip(eids, heat_pumps, unit_inputs):
+                for attr, value in values.items():
+                    setattr(heat_pump.inputs, attr, value)
+                heat_pump.inputs.step_size = 60
+                heat_pump.step()
+                for attr, value in data[eid].items():
+                    assert value == pytest.approx(float(getattr(heat_pump.state, attr)), rel=1e-6), (step, eid, attr)
+                assert data[eid]['COP'] > 0
+    finally:
+        sim.finalize()
+    # the workers saved the design points in the shared directory
+    design_index = get_design_index('Air_30kW_1stage')
+    design_points = {str(int(design_index.lookup(values['heat_source_T'], values['cond_in_T'], air=True).idx))
+                     for values in inputs}
+    assert sorted(os.listdir(os.path.join(str(tmp_path), 'Air_30kW_1stage'))) == sorted(design_points)
+
+
+def test_result_cache_reuses_offdesign_results():
+    params = {'hp_model': 'Air_30kW_1stage', 'heat_source': 'Air', 'heat_source_T': 7, 'cons_T': 35,
+              'Q_Demand': 20000, 'calc_mode': 'detailed', 'result_cache_size': 4, 'result_cache_tol': (0.1, 10)}
+    heat_pump = Heat_Pump_Des(params)
+
+    heat_pump.step({'heat_source_T': 7.2, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': 7.2})
+    COP = heat_pump.COP
+    assert heat_pump.solve_iter > 0
+
+    # within the tolerances of the first step
+    heat_pump.step({'heat_source_T': 7.21, 'Q_Demand': 15002, 'cond_in_T': 30.01, 'T_amb': 7.21})
+    assert heat_pump.COP == COP
+    assert heat_pump.solve_iter == 0
+    assert heat_pump.result_cache_hit_rate() == 0.5
+
+    heat_pump.step({'heat_source_T': 7.5, 'Q_Demand': 15000, 'cond_in_T': 30, 'T_amb': 7.5})
+    assert heat_pump.COP != COP
+    assert heat_pump.solve_iter > 0
+
+
+def test_generator_heatloads():
+    assert heatloads(1800, 3000) == [1800, 2300, 2800, 3000]
+    assert heatloads(1800, 2300) == [2300]
+
+
+def test_generator_resumes_from_checkpoint(tmp_path):
+    points = grid('Air_30kW_1stage', 7, 7)
+    checkpoint = tmp_path / 'checkpoint'
+    with open(str(checkpoint), 'w') as write_file:
+        for T, cond_in_T in points:
+            write_file.write('[%d, %d, {"7300.0": {"cond_m": 0.9, "COP": 4.1}}]\n' % (T, cond_in_T))
+        write_file.write('[7, 3')  # interrupted while writing
+
+    data = generate('Air_30kW_1stage', 'air', checkpoint=str(checkpoint), T_min=7, T_max=7)
+    assert list(data) == ['7'] and len(data['7']) == len(points)
+
+    filename = str(tmp_path / 'cop_m_data.json')
+    save('Air_30kW_1stage', data, filename)
+    with pytest.raises(ValueError):
+        save('Air_30kW_1stage', data, filename)
+    cond_m, COP = COPTable(data).lookup(7, 30, 5000)
+    assert (cond_m, COP) == (0.9, 4.1)
@@ -1,8 +1,64 @@
-from mosaik_heatpump.hotwatertanksim.hotwatertank import HotWaterTank
+from mosaik_heatpump.hotwatertanksim.hotwatertank import HotWaterTank, update_heating_rods
+from mosaik_heatpump.hotwatertanksim.hotwatertank_batch import HotWaterTankBatch
+from mosaik_heatpump.hotwatertanksim.hotwatertank_mosaik import HotWaterTankSimulator
 import numpy as np
 import jsonpickle
 import pytest
 
+LEGACY_SNAPSHOT = (
+    '{"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.HotWaterTank", "height": 3600, "htc_wall'
+    's": 0.28, "htc_layers": 0.897, "T_env": 20.0, "surface_between_layers": 1.1111111111111112, "mass": '
+    '4000.0, "layers": [{"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.Layer", "T": 30.08997'
+    '6678680713, "bottom": 0.0, "top": 600.0, "outer_surface": 3.353107597670283, "volume": 666.666666666'
+    '6667, "massflows": [], "heatflows": []}, {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank'
+    '.Layer", "T": 35.08979725486318, "bottom": 600.0, "top": 1200.0, "outer_surface": 2.241996486559172,'
+    ' "volume": 666.6666666666667, "massflows": [], "heatflows": []}, {"py/object": "mosaik_heatpump.hotw'
+    'atertanksim.hotwatertank.Layer", "T": 40.089729673150906, "bottom": 1200.0, "top": 1800.0, "outer_su'
+    'rface": 2.241996486559172, "volume": 666.6666666666667, "massflows": [], "heatflows": []}, {"py/obje'
+    'ct": "mosaik_heatpump.hotwatertanksim.hotwatertank.Layer", "T": {"py/reduce": [{"py/function": "nump'
+    'y.core.multiarray.scalar"}, {"py/tuple": [{"py/reduce": [{"py/type": "numpy.dtype"}, {"py/tuple": ["'
+    'f8", false, true]}, {"py/tuple": [3, "<", null, null, null, -1, -1, 0]}]}, {"py/b64": "MGkZlDuORkA="'
+    '}]}]}, "bottom": 1800.0, "top": 2400.0, "outer_surface": 2.241996486559172, "volume": 666.6666666666'
+    '667, "massflows": [], "heatflows": []}, {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.'
+    'Layer", "T": 49.99959450972636, "bottom": 2400.0, "top": 3000.0, "outer_surface": 2.241996486559172,'
+    ' "volume": 666.6666666666667, "massflows": [], "heatflows": []}, {"py/object": "mosaik_heatpump.hotw'
+    'atertanksim.hotwatertank.Layer", "T": 54.99911365050212, "bottom": 3000.0, "top": 3600.0, "outer_sur'
+    'face": 3.353107597670283, "volume": 666.6666666666667, "massflows": [], "heatflows": []}], "layer_he'
+    'ight": 0.6, "connections": {"sh_in": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.Con'
+    'nection", "layers": {"py/id": 1}, "pos": 10, "_F": 0, "_T": null, "_T_buffer": [], "corresponding_la'
+    'yer": {"py/id": 2}, "corresponding_layer_pos": {"py/id": 2}}, "sh_out": {"py/object": "mosaik_heatpu'
+    'mp.hotwatertanksim.hotwatertank.Connection", "layers": {"py/id": 1}, "pos": 2150, "_F": 0, "_T": nul'
+    'l, "_T_buffer": [], "corresponding_layer": {"py/id": 11}, "corresponding_layer_pos": {"py/id": 11}},'
+    ' "dhw_in": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.Connection", "layers": {"py/i'
+    'd": 1}, "pos": 10, "_F": 0, "_T": null, "_T_buffer": [], "corresponding_layer": {"py/id": 2}, "corre'
+    'sponding_layer_pos": {"py/id": 2}}, "dhw_out": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwat'
+    'ertank.Connection", "layers": {"py/id": 1}, "pos": 3400, "_F": 0, "_T": null, "_T_buffer": [], "corr'
+    'esponding_layer": {"py/id": 19}, "corresponding_layer_pos": {"py/id": 19}}, "hp_in": {"py/object": "'
+    'mosaik_heatpump.hotwatertanksim.hotwatertank.Connection", "layers": {"py/id": 1}, "pos": 10, "_F": 0'
+    '.2, "_T": 50, "_T_buffer": [], "corresponding_layer": {"py/id": 16}, "corresponding_layer_pos": {"py'
+    '/id": 2}}, "hp_out": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.Connection", "layer'
+    's": {"py/id": 1}, "pos": 500, "_F": -0.2, "_T": null, "_T_buffer": [], "corresponding_layer": {"py/i'
+    'd": 2}, "corresponding_layer_pos": {"py/id": 2}}}, "sensors": {"sensor_00": {"py/object": "mosaik_he'
+    'atpump.hotwatertanksim.hotwatertank.Sensor", "pos": 0.0, "corresponding_layer": {"py/id": 2}}, "sens'
+    'or_01": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.Sensor", "pos": 720.0, "correspo'
+    'nding_layer": {"py/id": 5}}, "sensor_02": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertan'
+    'k.Sensor", "pos": 1440.0, "corresponding_layer": {"py/id": 8}}, "sensor_03": {"py/object": "mosaik_h'
+    'eatpump.hotwatertanksim.hotwatertank.Sensor", "pos": 2160.0, "corresponding_layer": {"py/id": 11}}, '
+    '"sensor_04": {"py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.Sensor", "pos": 2880.0, "co'
+    'rresponding_layer": {"py/id": 16}}, "sensor_05": {"py/object": "mosaik_heatpump.hotwatertanksim.hotw'
+    'atertank.Sensor", "pos": 3599.0, "corresponding_layer": {"py/id": 19}}}, "heating_rods": {"hr_1": {"'
+    'py/object": "mosaik_heatpump.hotwatertanksim.hotwatertank.HeatingRod", "pos": 1800, "T_max": 65, "P_'
+    'th_stages": {"py/reduce": [{"py/function": "numpy.core.multiarray._reconstruct"}, {"py/tuple": [{"py'
+    '/type": "numpy.ndarray"}, {"py/tuple": [0]}, {"py/b64": "Yg=="}]}, {"py/tuple": [1, {"py/tuple": [4]'
+    '}, {"py/reduce": [{"py/type": "numpy.dtype"}, {"py/tuple": ["i8", false, true]}, {"py/tuple": [3, "<'
+    '", null, null, null, -1, -1, 0]}]}, false, {"py/b64": "AAAAAAAAAAD0AQAAAAAAAOgDAAAAAAAA0AcAAAAAAAA="'
+    '}]}]}, "eta": 1, "corresponding_layer": {"py/id": 11}, "P_th_set": 800, "P_el": {"py/reduce": [{"py/'
+    'function": "numpy.core.multiarray.scalar"}, {"py/tuple": [{"py/id": 13}, {"py/b64": "AAAAAABAj8A="}]'
+    '}]}, "P_th": {"py/reduce": [{"py/function": "numpy.core.multiarray.scalar"}, {"py/tuple": [{"py/id":'
+    ' 45}, {"py/b64": "6AMAAAAAAAA="}]}]}}}, "_nested_attrs": {}}'
+)
+# snapshot of a tank with a heating rod, taken with jsonpickle by an earlier version after a step with flows
+
 @pytest.fixture
 def hwt_init_vals():
     init_vals = {
@@ -42,22 +98,31 @@ def test_get_nested_attrs(hwt_params, hwt_init_vals):
 
 
 
-#This test is currently not working, due to changes in the model
-#def test_snapshot(hwt_params, hwt_init_vals):
-#    hwt = HotWaterTank(hwt_params, hwt_init_vals)
-#    copy = jsonpickle.decode(hwt.snapshot)
-#    
-#    hwt.connections['gcb_in'].F = 0.1
-#    hwt.connections['gcb_out'].F = -0.1
-#    hwt.connections['gcb_in'].T = 80
-#    hwt.step(5*60)
-#
-#    copy.connections['gcb_in'].F = 0.1
-#    copy.connections['gcb_out'].F = -0.1
-#    copy.connections['gcb_in'].T = 80
-#    copy.step(5*60)
-#
-#    assert hwt.sensors['sensor_02'].T == copy.sensors['sensor_02'].T
+def test_snapshot(hwt_params, hwt_init_vals):
+    hwt = HotWaterTank(hwt_params, hwt_init_vals)
+    hwt.connections['gcb_in'].T = 65
+    hwt.connections['gcb_in'].F = 0.2
+    hwt.connections['gcb_out'].F = -0.2
+    hwt.step(60)
+    copy = HotWaterTank.from_snapshot(hwt.snapshot)
+    assert copy.snapshot == hwt.snapshot
+    assert copy.clone().snapshot == hwt.snapshot
+
+    hwt.connections['gcb_in'].F = 0.1
+    hwt.connections['gcb_out'].F = -0.1
+    hwt.connections['gcb_in'].T = 80
+    hwt.step(5*60)
+
+    copy.connections['gcb_in'].F = 0.1
+    copy.connections['gcb_out'].F = -0.1
+    copy.connections['gcb_in'].T = 80
+    copy.step(5*60)
+
+    assert hwt.sensors['sensor_02'].T == copy.sensors['sensor_02'].T
+    assert hwt.T_layers == copy.T_layers
+
+    with pytest.raises(ValueError):
+        HotWaterTank.from_snapshot(hwt.snapshot_connections)
 
 def test_step_flow_too_high():
 
@@ -452,3 +517,380 @@ def test_T_mean_attribute():
     }
     hwt = HotWaterTank(hwt_params, hwt_init_vals)
     assert hwt.T_mean == 50
+
+
+def test_layers_are_views_onto_layer_arrays(hwt_params, hwt_init_vals):
+    hwt = HotWaterTank(hwt_params, hwt_init_vals)
+    hwt.layers[1].T = 55
+    assert hwt.layer_arrays.T[1] == 55
+    assert hwt.T_layers == [30, 55, 70]
+
+    hwt.layer_arrays.T[:] = [80, 60, 40]
+    hwt.step(60)  # the layers are sorted in place
+    assert hwt.T_layers == [layer.T for layer in hwt.layers]
+    assert hwt.layers[0].T < hwt.layers[1].T < hwt.layers[2].T
+    assert hwt.sensors['sensor_02'].T == hwt.layers[2].T
+
+
+def test_step_implicit_solver_conserves_energy():
+    hwt_params = {
+        'height': 2100,
+        'diameter': 1200,
+        'T_env': 20.0,
+        'htc_walls': 1.0,
+        'htc_layers': 20,
+        'n_layers': 30,
+        'n_sensors': 3,
+        'solver': 'implicit',
+        'connections': {
+            'gcb_in': {'pos': 1700},
+            'gcb_out': {'pos': 100}
+            }
+        }
+    hwt = HotWaterTank(hwt_params, {'layers': {'T': [30, 60]}})
+    hwt.step = _count_calls(hwt.step)
+
+    # the flow per step is a multiple of the layer volumes
+    hwt.connections['gcb_in'].F = 2.0
+    hwt.connections['gcb_out'].F = -2.0
+    hwt.connections['gcb_in'].T = 80
+    T_before = np.array(hwt.T_layers)
+    hwt.step(15 * 60)
+    T_after = np.array(hwt.T_layers)
+
+    assert hwt.step.calls == 1
+    assert 30 < T_after.min() and T_after.max() < 80
+    volume = np.array([layer.volume for layer in hwt.layers])
+    outer_surface = np.array([layer.outer_surface for layer in hwt.layers])
+    E_stored = np.sum((T_after - T_before) * volume) * 4180
+    E_flows = 2.0 * 15 * 60 * 4180 * (80 - hwt.connections['gcb_out'].T)
+    E_env = np.sum(outer_surface * (20 - T_after)) * 15 * 60
+    assert abs(E_stored - (E_flows + E_env)) < 1e-6 * E_stored
+
+
+def test_step_implicit_solver_matches_explicit_solver(hwt_params, hwt_init_vals):
+    tanks = [HotWaterTank(dict(hwt_params, solver=solver), hwt_init_vals) for solver in ('explicit', 'implicit')]
+    for hwt in tanks:
+        for i in range(10):
+            hwt.connections['gcb_in'].F = 0.05
+            hwt.connections['gcb_out'].F = -0.05
+            hwt.connections['gcb_in'].T = 70
+            hwt.step(60)
+
+    assert np.allclose(tanks[0].T_layers, tanks[1].T_layers, atol=0.05)
+
+
+def _count_calls(func):
+    def wrapper(*args, **kwargs):
+        wrapper.calls += 1
+        return func(*args, **kwargs)
+    wrapper.calls = 0
+    return wrapper
+
+
+def test_step_mixing_of_layers_of_different_volumes():
+    hwt_params = {
+        'height': 2100,
+        'diameter': 1200,
+        'T_env': 20.0,
+        'htc_walls': 0.0,
+        'htc_layers': 0.0,
+        'mixing': 'mix',
+        'layers': [
+            {'bottom': 0, 'top': 300},
+            {'bottom': 300, 'top': 1800},
+            {'bottom': 1800, 'top': 1900},
+            {'bottom': 1900, 'top': 2100}
+            ],
+        }
+    hwt = HotWaterTank(hwt_params, {'layers': {'T': [70, 40, 42, 80]}})
+    volume = np.array([layer.volume for layer in hwt.layers])
+    E_before = np.sum(volume * np.array(hwt.T_layers))
+    hwt.step(60)
+
+    T = hwt.T_layers
+    T_mixed = (70 * 300 + 40 * 1500 + 42 * 100) / 1900
+    assert T[0] == T[1] == T[2]
+    assert T[0] == pytest.approx(T_mixed)
+    assert T[3] == 80
+    assert np.sum(volume * np.array(T)) == pytest.approx(E_before)
+
+
+@pytest.mark.parametrize('solver', ['explicit', 'implicit'])
+def test_batch_matches_single_tanks(hwt_params, hwt_init_vals, solver):
+    hwt_params['solver'] = solver
+    batch = HotWaterTankBatch(hwt_params)
+    tanks = batch.add(2, hwt_init_vals) + batch.add(1, hwt_init_vals)
+    singles = [HotWaterTank(hwt_params, hwt_init_vals) for i in range(3)]
+    flows = [0.01, 0.1, 20]  # the last flow exceeds the volume of a layer
+    T_in = [60, 25, 45]
+
+    for step in range(5):
+        for hwt_list in (tanks, singles):
+            for hwt, F, T in zip(hwt_list, flows, T_in):
+                hwt.connections['gcb_in'].T = T + step
+                hwt.connections['gcb_in'].F = F
+                hwt.connections['gcb_out'].F = -F
+                hwt.T_env = 10 + step
+        batch.step(60)
+        for hwt in singles:
+            hwt.step(60)
+
+        for hwt, single in zip(tanks, singles):
+            assert hwt.T_layers == single.T_layers
+            assert hwt.connections['gcb_out'].T == single.connections['gcb_out'].T
+            assert (hwt.connections['gcb_in'].corresponding_layer.idx ==
+                    single.connections['gcb_in'].corresponding_layer.idx)
+    assert batch.T.tolist() == [hwt.T_layers for hwt in tanks]
+
+
+@pytest.mark.parametrize('solver', ['explicit', 'implicit'])
+def test_batch_with_idle_tanks_and_heating_rods(hwt_params, hwt_init_vals, solver):
+    hwt_params['solver'] = solver
+    hwt_params['heating_rods'] = {'hr': {'pos': 1500, 'T_max': 90, 'P_th_stages': [0, 500, 1000], 'eta': 1}}
+    batch = HotWaterTankBatch(hwt_params)
+    tanks = batch.add(4, hwt_init_vals)
+    singles = [HotWaterTank(hwt_params, hwt_init_vals) for i in range(4)]
+    flows = [0.05, 0, 0, 0.02]
+    P_th_set = [0, 0, 1000, 500]  # the second tank is idle
+    kernel = '_step_implicit' if solver == 'implicit' else '_step_explicit'
+    shapes = []
+    step_kernel = getattr(tanks[0], kernel)
+
+    def wrapper(*args, **kwargs):
+        shapes.append(kwargs['T'].shape)
+        return step_kernel(*args, **kwargs)
+    setattr(tanks[0], kernel, wrapper)
+
+    for step in range(5):
+        for hwt_list in (tanks, singles):
+            for hwt, F, P_th in zip(hwt_list, flows, P_th_set):
+                hwt.connections['gcb_in'].T = 60 + step
+                hwt.connections['gcb_in'].F = F
+                hwt.connections['gcb_out'].F = -F
+                hwt.heating_rods['hr'].P_th_set = P_th
+        batch.step(60)
+        for hwt in singles:
+            hwt.step(60)
+        for hwt, single in zip(tanks, singles):
+            assert hwt.T_layers == pytest.approx(single.T_layers, abs=1e-10)
+            assert hwt.heating_rods['hr'].P_th == single.heating_rods['hr'].P_th
+
+    # the kernel with flows is only calculated for the tanks which are not idle
+    assert shapes == [(3, 3)] * 5
+
+
+def test_batch_in_simulator(hwt_params, hwt_init_vals):
+    sim = HotWaterTankSimulator()
+    sim.init('HWT', 1, 60, hwt_params)
+    hwt_params['batch'] = True
+    entities = sim.create(2, 'HotWaterTank', params=hwt_params,
+                          init_vals=hwt_init_vals)
+    entities += sim.create(1, 'HotWaterTank', params=hwt_params,
+                           init_vals=hwt_init_vals)
+    assert len(sim.batches) == 1
+
+    eids = [entity['eid'] for entity in entities]
+    inputs = {eid: {'gcb_in.T': {'src': 60}, 'gcb_in.F': {'src': 0.1},
+                    'gcb_out.F': {'src': -0.1}} for eid in eids}
+    sim.step(0, inputs, None)
+    data = sim.get_data({eid: ['sensor_02.T', 'T_mean'] for eid in eids})
+
+    single = HotWaterTank(hwt_params, hwt_init_vals)
+    single.connections['gcb_in'].T = 60
+    single.connections['gcb_in'].F = 0.1
+    single.connections['gcb_out'].F = -0.1
+    single.step(60)
+    for eid in eids:
+        assert data[eid] == {'sensor_02.T': single.sensors['sensor_02'].T,
+                             'T_mean': single.T_mean}
+
+
+def test_layer_lookup_by_position_and_temperature(hwt_init_vals):
+    hwt_params = {
+        'height': 2100,
+        'diameter': 1200,
+        'T_env': 20.0,
+        'htc_walls': 1.0,
+        'htc_layers': 20,
+        'n_layers': 7,
+        }
+    hwt = HotWaterTank(hwt_params, {'layers': {'T': [30, 30, 40, 50, 50, 60, 70]}})
+    layer_arrays = hwt.layer_arrays
+    assert layer_arrays.layer_at(0) == 0
+    assert layer_arrays.layer_at(300) == 1
+    assert layer_arrays.layer_at(2099) == 6
+    assert layer_arrays.layer_at(2100) is None
+
+    assert layer_arrays.monotonic
+    for T in [10, 30, 35, 44, 45, 46, 50, 55, 80]:
+        assert layer_arrays.closest_layer(T) == np.argmin(np.abs(T - layer_arrays.T))
+
+    hwt.layers[0].T = 80
+    assert not layer_arrays.monotonic
+    assert layer_arrays.closest_layer(75) == 0
+
+
+def test_simulator_accessors_match_nested_attrs(hwt_params, hwt_init_vals):
+    from mosaik_heatpump.hotwatertanksim.hotwatertank_mosaik import get_nested_attr
+
+    sim = HotWaterTankSimulator()
+    meta = sim.init('HWT', 1, 60, hwt_params)
+    entities = sim.create(1, 'HotWaterTank', params=hwt_params, init_vals=hwt_init_vals)
+    eid = entities[0]['eid']
+    sim.step(0, {eid: {'gcb_in.T': {'src': 60}, 'gcb_in.F': {'src': 0.1},
+                       'gcb_out.F': {'src': -0.1}, 'T_env': {'src': 15}}}, None)
+
+    hwt = sim.models[eid]
+    assert hwt.connections['gcb_in'].F == 0.1
+    assert hwt.T_env == 15
+    attrs = [attr for attr in meta['models']['HotWaterTank']['attrs']
+             if attr not in ('_', 'step_executed')]
+    data = sim.get_data({eid: attrs})
+    assert data[eid] == {attr: get_nested_attr(hwt, attr) for attr in attrs}
+    with pytest.raises(ValueError):
+        sim.get_data({eid: ['unknown']})
+
+
+@pytest.mark.parametrize('solver', ['explicit', 'implicit'])
+def test_step_without_flows_uses_propagator(hwt_params, hwt_init_vals, solver):
+    hwt_params['solver'] = solver
+    hwt = HotWaterTank(hwt_params, hwt_init_vals)
+    reference = HotWaterTank(hwt_params, hwt_init_vals)
+    no_flows = (np.zeros(0, dtype=int), np.zeros(0), np.zeros(0), np.zeros(2))
+
+    for step in range(10):
+        hwt.T_env = reference.T_env = 10 + step
+        hwt.step(60)
+        if solver == 'implicit':
+            reference._step_implicit(60, *no_flows)
+        else:
+            reference._step_explicit(60, *no_flows)
+        reference.layer_arrays.T.sort()
+        assert hwt.T_layers == pytest.approx(reference.T_layers, abs=1e-10)
+
+    propagator = hwt._propagator(60)
+    hwt.step(60)
+    assert hwt._propagator(60) is propagator
+    hwt.step(30)
+    assert hwt._propagator(60) is not propagator
+
+
+def test_step_with_merged_layers():
+    hwt_params = {
+        'height': 2100,
+        'diameter': 1200,
+        'T_env': 20.0,
+        'htc_walls': 1.0,
+        'htc_layers': 0.6,
+        'n_layers': 200,
+        'n_sensors': 5,
+        'solver': 'implicit',
+        'connections': {
+            'gcb_in': {'pos': 2000},
+            'gcb_out': {'pos': 100}
+            }
+        }
+    reference = HotWaterTank(hwt_params, {'layers': {'T': 40}})
+    hwt_params['merge_tol'] = 0.05
+    hwt = HotWaterTank(hwt_params, {'layers': {'T': 40}})
+    volume = np.array([layer.volume for layer in hwt.layers])
+    outer_surface = np.array([layer.outer_surface for layer in hwt.layers])
+
+    for tank in (hwt, reference):
+        tank.connections['gcb_in'].T = 55
+        tank.connections['gcb_in'].F = 0.1
+        tank.connections['gcb_out'].F = -0.1
+        # the inlet is moved to the hot water at the top
+        tank.step(15 * 60)
+    for step in range(8):
+        flow_layers = np.array([hwt.connections['gcb_in'].corresponding_layer.idx,
+                                hwt.connections['gcb_out'].corresponding_layer.idx])
+        merged = hwt._merge_layers(15 * 60, flow_layers, np.array([0.1, -0.1]),
+                                   np.array([55, 0]))
+        assert merged is not None and len(merged[0].T) < 200
+        T_before = np.array(hwt.T_layers)
+        hwt.step(15 * 60)
+        reference.step(15 * 60)
+        T_after = np.array(hwt.T_layers)
+
+        # the energy is conserved
+        E_stored = np.sum((T_after - T_before) * volume) * 4180
+        E_flows = 0.1 * 15 * 60 * 4180 * (55 - hwt.connections['gcb_out'].T)
+        E_env = np.sum(outer_surface * (20 - T_after)) * 15 * 60
+        assert abs(E_stored - (E_flows + E_env)) < 1e-6 * abs(E_stored)
+
+    # the thermocline is resolved like without merged layers
+    assert hwt.T_layers == pytest.approx(reference.T_layers, abs=0.5)
+    assert hwt.T_sensors == pytest.approx(reference.T_sensors, abs=0.5)
+    for sensor in hwt.sensors.values():
+        assert sensor.T == hwt.layers[hwt.layer_arrays.layer_at(sensor.pos)].T
+
+
+def test_heating_rod_stage_selection(hwt_params, hwt_init_vals):
+    hwt_params['heating_rods'] = {
+        'hr_1': {'pos': 1800, 'T_max': 75, 'P_th_stages': [0, 500, 1000, 2000, 3000], 'eta': 0.5}}
+    hwt_init_vals['hr_1'] = {'P_th_set': 0}
+    hwt = HotWaterTank(hwt_params, hwt_init_vals)
+    heating_rod = hwt.heating_rods['hr_1']
+
+    P_th_set = [-100, 0, 250, 251, 800, 1500, 2600, 3800]
+    for P in P_th_set:
+        heating_rod.P_th_set = P
+        heating_rod.update()
+        stages = heating_rod.P_th_stages
+        assert heating_rod.P_th == stages[np.argmin(abs(stages - P))]
+        assert heating_rod.P_el == -heating_rod.P_th / 0.5
+
+    # the stage is selected again, when the layer reaches T_max
+    heating_rod.update()
+    assert heating_rod.P_th == 3000
+    hwt.layers[2].T = 80
+    heating_rod.update()
+    assert heating_rod.P_th == 0 and heating_rod.P_el == 0
+    hwt.layers[2].T = 70
+    heating_rod.update()
+    assert heating_rod.P_th == 3000
+
+    tanks = [HotWaterTank(hwt_params, hwt_init_vals) for P in P_th_set]
+    heating_rods = [tank.heating_rods['hr_1'] for tank in tanks]
+    for tank, P in zip(tanks, P_th_set):
+        tank.heating_rods['hr_1'].P_th_set = P
+    tanks[0].layers[2].T = 80
+    P_th_batch = update_heating_rods(heating_rods, [tank.layers[2].T for tank in tanks])
+    for rod in heating_rods:
+        P_th, P_el = rod.P_th, rod.P_el
+        rod._update_key = None
+        rod.update()
+        assert rod.P_th == P_th and rod.P_el == P_el
+    assert heating_rods[0].P_th == 0
+    assert P_th_batch.tolist() == [rod.P_th for rod in heating_rods]
+
+
+def test_legacy_snapshot():
+    hwt = HotWaterTank.from_legacy_snapshot(LEGACY_SNAPSHOT)
+    assert hwt.T_layers == [30.089976678680713, 35.08979725486318, 40.089729673150906, 45.111193191917096,
+                            49.99959450972636, 54.99911365050212]
+    assert hwt.T_env == 20.0
+    assert hwt.connections['hp_in'].F == 0.2
+    assert hwt.connections['hp_in'].T == 50
+    assert hwt.connections['hp_in'].corresponding_layer is hwt.layers[4]
+    assert hwt.connections['hp_out'].F == -0.2
+    assert hwt.heating_rods['hr_1'].P_th_set == 800
+    assert list(hwt.sensors) == ['sensor_%02d' % i for i in range(6)]
+
+    # the next step of the earlier version
+    hwt.step(60)
+    assert hwt.T_layers == pytest.approx([30.179948302445325, 35.17959208352518, 40.17984524689427,
+                                          45.22037134558666, 49.99920029794846, 54.9982273361199])
+    assert hwt.heating_rods['hr_1'].P_th == 1000
+
+    sim = HotWaterTankSimulator()
+    sim.init('HWT', 1, 60, config={'connections': ['hp_in', 'hp_out']})
+    entities = sim.create(2, 'HotWaterTank', snapshot=LEGACY_SNAPSHOT)
+    snapshot = HotWaterTank.from_legacy_snapshot(LEGACY_SNAPSHOT).snapshot
+    for entity in entities:
+        assert sim.models[entity['eid']].snapshot == snapshot
+
+    with pytest.raises(ValueError):
+        HotWaterTank.from_legacy_snapshot('{"py/object": "builtins.dict"}')